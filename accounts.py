@@ -0,0 +1,431 @@
+import hashlib
+import hmac
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# --- ACCOUNT STORE ---
+# Accounts used to live in st.session_state.mock_db, i.e. in one browser session.
+# UserRepository keeps them in Supabase, shared by every session and replica:
+#
+#   create table accounts (
+#       email text primary key,
+#       pwd_hash text not null,
+#       profile_complete boolean not null default false,
+#       data jsonb not null default '{}'::jsonb,
+#       created_at timestamptz not null default now()
+#   );
+#
+# Profile lookups go through a short-TTL read-through cache, and the profile fields written
+# during onboarding are staged in memory and sent as one batched call. Only the staged keys
+# are sent: the database merges them into `data`, so a password or profile changed through
+# another replica is never overwritten with a cached row:
+#
+#   create function merge_account_data(updates jsonb) returns void language sql as $$
+#       update accounts a
+#       set data = a.data || u.data,
+#           profile_complete = coalesce(u.profile_complete, a.profile_complete)
+#       from jsonb_to_recordset(updates) as u(email text, data jsonb, profile_complete boolean)
+#       where a.email = u.email;
+#   $$;
+#
+# "Is this email already used?" (signup) is answered by EmailIndex: a Bloom filter of every
+# registered email, loaded once and kept up to date incrementally, so the store is only asked
+# about the emails the filter may contain.
+
+DEFAULT_CACHE_TTL = 30          # seconds a profile lookup is trusted
+DEFAULT_FLUSH_INTERVAL = 5      # seconds between two batched upserts
+PBKDF2_ITERATIONS = 200_000
+
+DEFAULT_INDEX_CAPACITY = 1_000_000      # emails before the filter is rebuilt larger (1.2 MB at 1 %)
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+DEFAULT_CONFIRMED_ENTRIES = 10_000      # store answers kept in the LRU
+DEFAULT_INDEX_REFRESH = 60              # seconds between two incremental loads
+REFRESH_OVERLAP = 300                   # seconds re-read at each refresh (clock skew, late commits)
+
+
+class AccountExists(Exception):
+    pass
+
+
+def hash_password(pwd, salt=None):
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", pwd.encode("utf-8"), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def check_password(pwd, pwd_hash):
+    try:
+        _, iterations, salt, digest = pwd_hash.split("$")
+    except (AttributeError, ValueError):
+        return False
+    candidate = hashlib.pbkdf2_hmac("sha256", pwd.encode("utf-8"), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
+# --- BACKENDS ---
+
+class SupabaseAccountBackend:
+    def __init__(self, clients, table="accounts"):
+        # The registry, not a client: the client may be rebuilt after failures
+        self.clients = clients
+        self.table = table
+
+    def fetch(self, email):
+        res = self.clients.supabase().table(self.table).select("*").eq("email", email).limit(1).execute()
+        return res.data[0] if res.data else None
+
+    def insert(self, row):
+        try:
+            self.clients.supabase().table(self.table).insert(row).execute()
+        except Exception as e:
+            # 23505 = unique_violation
+            if "23505" in str(e) or "duplicate" in str(e).lower():
+                raise AccountExists(row["email"])
+            raise
+
+    def merge_profiles(self, updates):
+        # [{"email", "data", "profile_complete"?}], merged by the database (see merge_account_data)
+        self.clients.supabase().rpc("merge_account_data", {"updates": updates}).execute()
+
+    def list_emails(self, since=None, page_size=1000):
+        # Paged by created_at; `since` is a Unix time (None: every account)
+        start = 0
+        while True:
+            query = self.clients.supabase().table(self.table).select("email")
+            if since is not None:
+                query = query.gte("created_at", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since)))
+            res = query.order("created_at").range(start, start + page_size - 1).execute()
+            rows = res.data or []
+            for row in rows:
+                yield row["email"]
+            if len(rows) < page_size:
+                return
+            start += page_size
+
+
+class MemoryAccountBackend:
+    """
+    Process-local backend for development and tests (ACCOUNTS_BACKEND = "memory").
+    """
+
+    def __init__(self, seed=None):
+        self._rows = {}
+        self._lock = threading.Lock()
+        for email, pwd, profile_complete, data in seed or []:
+            self._rows[email] = {"email": email, "pwd_hash": hash_password(pwd),
+                                 "profile_complete": profile_complete, "data": dict(data),
+                                 "created_at": time.time()}
+
+    def fetch(self, email):
+        with self._lock:
+            row = self._rows.get(email)
+            return {**row, "data": dict(row["data"])} if row else None
+
+    def insert(self, row):
+        with self._lock:
+            if row["email"] in self._rows:
+                raise AccountExists(row["email"])
+            self._rows[row["email"]] = {**row, "data": dict(row.get("data", {})), "created_at": time.time()}
+
+    def merge_profiles(self, updates):
+        with self._lock:
+            for update in updates:
+                row = self._rows.get(update["email"])
+                if row is None:
+                    continue
+                row["data"].update(update["data"])
+                if "profile_complete" in update:
+                    row["profile_complete"] = update["profile_complete"]
+
+    def list_emails(self, since=None):
+        with self._lock:
+            return [email for email, row in self._rows.items() if since is None or row["created_at"] >= since]
+
+
+# --- REPOSITORY ---
+
+class UserRepository:
+    def __init__(self, backend, cache_ttl=DEFAULT_CACHE_TTL, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()     # one batch in flight (flusher thread, end of onboarding)
+        self._cache = {}        # email -> (expires_at, row or None)
+        self._pending = {}      # email -> {"data": {...}, "profile_complete": bool}
+        self._inflight = {}     # batch being written by flush(), still visible to readers
+        self._flusher = None
+        self.counters = {"cache_hits": 0, "cache_misses": 0, "upserts": 0, "rows_upserted": 0}
+
+    # 1. Reads (read-through cache, misses are cached too)
+    def get(self, email):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(email)
+            if entry is not None and entry[0] > now:
+                self.counters["cache_hits"] += 1
+                return self._with_pending(email, entry[1])
+        self.counters["cache_misses"] += 1
+        row = self.backend.fetch(email)
+        with self._lock:
+            self._cache[email] = (now + self.cache_ttl, row)
+            return self._with_pending(email, row)
+
+    def _with_pending(self, email, row):
+        # Staged fields are visible to readers before they reach the database
+        if row is None:
+            return row
+        for staged in (self._inflight.get(email), self._pending.get(email)):
+            if staged is None:
+                continue
+            row = {**row, "data": {**row.get("data", {}), **staged["data"]}}
+            if "profile_complete" in staged:
+                row["profile_complete"] = staged["profile_complete"]
+        return row
+
+    def exists(self, email):
+        return self.get(email) is not None
+
+    def authenticate(self, email, pwd):
+        row = self.get(email)
+        if row and check_password(pwd, row.get("pwd_hash")):
+            return row
+        return None
+
+    # 2. Writes
+    def create(self, email, pwd):
+        row = {"email": email, "pwd_hash": hash_password(pwd), "profile_complete": False, "data": {}}
+        self.backend.insert(row)
+        with self._lock:
+            self._cache[email] = (time.monotonic() + self.cache_ttl, row)
+        return row
+
+    def stage(self, email, **fields):
+        """
+        Records onboarding fields (bac_type, levels, philosophy, profile_complete...).
+        They are written by the next flush, together with the other staged accounts.
+        profile_complete is a column of its own, the other fields go to `data`.
+        """
+        with self._lock:
+            pending = self._pending.setdefault(email, {"data": {}})
+            for key, value in fields.items():
+                if key == "profile_complete":
+                    pending["profile_complete"] = value
+                else:
+                    pending["data"][key] = value
+
+    def flush(self):
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+
+        # Only the staged keys: the store merges them into the current row
+        updates = [{"email": email, **pending} for email, pending in batch.items()]
+        try:
+            self.backend.merge_profiles(updates)
+        except Exception:
+            # Put the batch back, newer staged values win over the failed ones
+            with self._lock:
+                for email, pending in batch.items():
+                    current = self._pending.get(email, {"data": {}})
+                    merged = {**pending, **current, "data": {**pending["data"], **current["data"]}}
+                    self._pending[email] = merged
+                self._inflight = {}
+            raise
+
+        with self._lock:
+            # The cached rows predate the merge: the next read fetches the merged row
+            for email in batch:
+                self._cache.pop(email, None)
+            self._inflight = {}
+        self.counters["upserts"] += 1
+        self.counters["rows_upserted"] += len(updates)
+        return len(updates)
+
+    def start_flusher(self):
+        if self._flusher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception:
+                    pass        # retried at the next tick
+
+        self._flusher = threading.Thread(target=loop, name="accounts-flush", daemon=True)
+        self._flusher.start()
+
+    def stats(self):
+        return {**self.counters, "cached": len(self._cache), "pending": len(self._pending)}
+
+
+# --- EMAIL AVAILABILITY ---
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=DEFAULT_FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        # `count` is the number of distinct items (re-adding one is free, refreshes overlap)
+        new = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class EmailIndex:
+    """
+    Answers "is this email taken?" for the signup form. An email the filter does not
+    contain is free (no false negatives); a possible match is checked in the store and
+    the answer kept in an LRU. Until the first load is done, every check goes to the store.
+    """
+
+    def __init__(self, repository, capacity=DEFAULT_INDEX_CAPACITY, error_rate=DEFAULT_FALSE_POSITIVE_RATE,
+                 confirmed_entries=DEFAULT_CONFIRMED_ENTRIES, refresh_interval=DEFAULT_INDEX_REFRESH):
+        self.repository = repository
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.confirmed_entries = confirmed_entries
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._filter = None
+        self._loading = None            # emails added while a full load runs
+        self._confirmed = OrderedDict() # email -> taken, answers of the store
+        self._synced_at = None
+        self._thread = None
+        self.counters = {"checks": 0, "filter_negatives": 0, "confirmed_hits": 0, "store_lookups": 0,
+                         "false_positives": 0, "loads": 0, "refreshes": 0}
+
+    # 1. Signup side
+    def is_taken(self, email):
+        self.counters["checks"] += 1
+        with self._lock:
+            taken = self._confirmed.get(email)
+            if taken is not None:
+                self._confirmed.move_to_end(email)
+                self.counters["confirmed_hits"] += 1
+                return taken
+            if self._filter is not None and email not in self._filter:
+                self.counters["filter_negatives"] += 1
+                return False
+            filtered = self._filter is not None
+        # Possible match (or no filter yet): the store decides
+        self.counters["store_lookups"] += 1
+        taken = self.repository.exists(email)
+        if filtered and not taken:
+            self.counters["false_positives"] += 1
+        self._confirm(email, taken)
+        return taken
+
+    def add(self, email):
+        # Called after a signup (or when the store refused a duplicate)
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(email)
+            if self._loading is not None:
+                self._loading.add(email)
+        self._confirm(email, True)
+
+    def _confirm(self, email, taken):
+        with self._lock:
+            self._confirmed[email] = taken
+            self._confirmed.move_to_end(email)
+            while len(self._confirmed) > self.confirmed_entries:
+                self._confirmed.popitem(last=False)
+
+    # 2. Background side
+    def load(self):
+        """
+        Builds the filter from every account; it replaces the current one when complete.
+        """
+        started = time.time()
+        with self._lock:
+            self._loading = set()
+        try:
+            emails = list(self.repository.backend.list_emails())
+            # Room to grow: the filter is rebuilt once it holds `capacity` emails
+            bloom = BloomFilter(max(self.capacity, 2 * len(emails)), self.error_rate)
+            for email in emails:
+                bloom.add(email)
+            with self._lock:
+                for email in self._loading:
+                    bloom.add(email)
+                self._filter = bloom
+                self._synced_at = started
+                # Negative answers may be outdated by the accounts created meanwhile
+                for email in [e for e, taken in self._confirmed.items() if not taken]:
+                    del self._confirmed[email]
+        finally:
+            with self._lock:
+                self._loading = None
+        self.counters["loads"] += 1
+        return len(emails)
+
+    def refresh(self):
+        # Accounts created since the last sync (on this replica or another one)
+        started = time.time()
+        emails = list(self.repository.backend.list_emails(since=self._synced_at - REFRESH_OVERLAP))
+        with self._lock:
+            for email in emails:
+                self._filter.add(email)
+                if self._confirmed.get(email) is False:
+                    self._confirmed[email] = True
+            self._synced_at = started
+        self.counters["refreshes"] += 1
+        return len(emails)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    if self._filter is None or self._filter.count >= self._filter.capacity:
+                        self.load()
+                    else:
+                        self.refresh()
+                except Exception:
+                    pass        # store unreachable: the signup checks go to the store meanwhile
+                time.sleep(self.refresh_interval)
+
+        self._thread = threading.Thread(target=loop, name="email-index", daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            **self.counters,
+            "indexed": bloom.count if bloom else 0,
+            "filter_bytes": len(bloom.bits) if bloom else 0,
+            "confirmed": len(self._confirmed),
+        }
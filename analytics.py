@@ -0,0 +1,274 @@
+"""
+Where students struggle, by curriculum and branch, from pre-aggregated tables.
+
+    python analytics.py chapters --curriculum Tunisien --branch "Sciences Économiques et Gestion"
+    python analytics.py levels --curriculum Tunisien
+    python analytics.py export snapshot.npz          # columnar snapshot for offline analysis
+
+The queries read the aggregate tables only, never the events nor the chat transcripts.
+"""
+import argparse
+import atexit
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+import sdk
+
+# --- ANALYTICS ---
+# The app records two kinds of append-only events: "audit" (the self-assessed level of every
+# subject, submitted at onboarding) and "diagnostic" (a finished diagnostic: chapter, mastery
+# estimated by the mastery engine, graded answers). The render thread only queues them; a
+# background thread writes each batch in one transaction that appends the events AND increments
+# the aggregates, so the aggregates always match the events and are never rebuilt by a scan:
+#
+#   audit_levels          (curriculum, branch, subject, level) -> submissions
+#   chapter_diagnostics   (curriculum, branch, subject, chapter) -> completions, answers,
+#                         sum of mastery, histogram of mastery (HISTOGRAM_BUCKETS buckets)
+#
+# The increments are SQL upserts, so the processes of one host can share the file.
+
+DEFAULT_DB_PATH = "analytics.db"
+DEFAULT_FLUSH_INTERVAL = 1.0    # seconds between two batched writes
+HISTOGRAM_BUCKETS = 10          # mastery 0-10 %, 10-20 %, ..., 90-100 %
+MIN_COMPLETIONS = 5             # chapters with fewer diagnostics are left out of the rankings
+
+BUCKET_COLUMNS = [f"h{i}" for i in range(HISTOGRAM_BUCKETS)]
+
+SQLITE_SCHEMA = f"""
+create table if not exists events (
+    id integer primary key autoincrement,
+    at real not null,
+    kind text not null,
+    payload text not null
+);
+create table if not exists audit_levels (
+    curriculum text not null,
+    branch text not null,
+    subject text not null,
+    level text not null,
+    submissions integer not null default 0,
+    primary key (curriculum, branch, subject, level)
+) without rowid;
+create table if not exists chapter_diagnostics (
+    curriculum text not null,
+    branch text not null,
+    subject text not null,
+    chapter text not null,
+    completions integer not null default 0,
+    answers integer not null default 0,
+    mastery_sum real not null default 0,
+    {", ".join(f"{column} integer not null default 0" for column in BUCKET_COLUMNS)},
+    primary key (curriculum, branch, subject, chapter)
+) without rowid;
+"""
+
+
+def bucket(mastery):
+    return min(int(mastery * HISTOGRAM_BUCKETS), HISTOGRAM_BUCKETS - 1)
+
+
+class Analytics:
+    def __init__(self, db_path=DEFAULT_DB_PATH, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._queue = []
+        self._thread = None
+        self.counters = {"recorded": 0, "written": 0, "writes": 0, "errors": 0}
+        self._db().executescript(SQLITE_SCHEMA)
+
+    def _db(self):
+        # One connection per thread, SQLite connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("pragma journal_mode = wal")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    # 1. Render thread side: queued, never blocks on the database
+    def record_audit(self, curriculum, branch, levels):
+        # An incomplete profile is recorded under "" rather than failing the whole batch
+        self._record("audit", curriculum=curriculum or "", branch=branch or "", levels=levels)
+
+    def record_diagnostic(self, curriculum, branch, subject, chapter, mastery, answers):
+        self._record("diagnostic", curriculum=curriculum or "", branch=branch or "", subject=subject,
+                     chapter=chapter, mastery=round(mastery, 3), answers=answers)
+
+    def _record(self, kind, **payload):
+        with self._lock:
+            self._queue.append((time.time(), kind, payload))
+            self.counters["recorded"] += 1
+
+    # 2. Background side: events and aggregates in one transaction
+    def flush(self):
+        with self._lock:
+            batch, self._queue = self._queue, []
+        if not batch:
+            return 0
+        db = self._db()
+        try:
+            with db:
+                db.executemany(
+                    "insert into events (at, kind, payload) values (?, ?, ?)",
+                    [(at, kind, json.dumps(payload, ensure_ascii=False)) for at, kind, payload in batch],
+                )
+                for _, kind, payload in batch:
+                    if kind == "audit":
+                        self._apply_audit(db, payload)
+                    else:
+                        self._apply_diagnostic(db, payload)
+        except Exception:
+            self.counters["errors"] += 1
+            with self._lock:
+                self._queue[:0] = batch     # retried at the next tick, in order
+            raise
+        self.counters["writes"] += 1
+        self.counters["written"] += len(batch)
+        return len(batch)
+
+    @staticmethod
+    def _apply_audit(db, event):
+        db.executemany(
+            "insert into audit_levels (curriculum, branch, subject, level, submissions) values (?, ?, ?, ?, 1) "
+            "on conflict (curriculum, branch, subject, level) do update set submissions = submissions + 1",
+            [(event["curriculum"], event["branch"], subject, level) for subject, level in event["levels"].items()],
+        )
+
+    @staticmethod
+    def _apply_diagnostic(db, event):
+        column = BUCKET_COLUMNS[bucket(event["mastery"])]
+        db.execute(
+            "insert into chapter_diagnostics (curriculum, branch, subject, chapter, completions, answers, "
+            f"mastery_sum, {column}) values (?, ?, ?, ?, 1, ?, ?, 1) "
+            "on conflict (curriculum, branch, subject, chapter) do update set "
+            "completions = completions + 1, answers = answers + excluded.answers, "
+            f"mastery_sum = mastery_sum + excluded.mastery_sum, {column} = {column} + 1",
+            (event["curriculum"], event["branch"], event["subject"], event["chapter"],
+             event["answers"], event["mastery"]),
+        )
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception:
+                    pass        # database locked or unavailable: retried at the next tick
+
+        self._thread = threading.Thread(target=loop, name="analytics-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self._final_flush)
+
+    def _final_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    # 3. Admin queries (aggregate tables only)
+    def struggling_chapters(self, curriculum=None, branch=None, limit=10, min_completions=MIN_COMPLETIONS):
+        """
+        Chapters with the lowest mean mastery at the end of the diagnostic.
+        """
+        where, params = self._filters(curriculum, branch)
+        rows = self._db().execute(
+            f"select curriculum, branch, subject, chapter, completions, answers, "
+            f"mastery_sum / completions as mean_mastery, {', '.join(BUCKET_COLUMNS)} "
+            f"from chapter_diagnostics where completions >= ? {where} "
+            f"order by mean_mastery limit ?",
+            [min_completions, *params, limit],
+        ).fetchall()
+        return [
+            {**{key: row[key] for key in ("curriculum", "branch", "subject", "chapter", "completions", "answers")},
+             "mean_mastery": round(row["mean_mastery"], 3),
+             "histogram": [row[column] for column in BUCKET_COLUMNS]}
+            for row in rows
+        ]
+
+    def subject_levels(self, curriculum=None, branch=None):
+        """
+        {(curriculum, branch, subject): {level: submissions}} of the onboarding audits.
+        """
+        where, params = self._filters(curriculum, branch)
+        rows = self._db().execute(
+            f"select * from audit_levels where 1 = 1 {where} order by curriculum, branch, subject", params
+        ).fetchall()
+        levels = {}
+        for row in rows:
+            levels.setdefault((row["curriculum"], row["branch"], row["subject"]), {})[row["level"]] = row["submissions"]
+        return levels
+
+    @staticmethod
+    def _filters(curriculum, branch):
+        where, params = "", []
+        if curriculum:
+            where += " and curriculum = ?"
+            params.append(curriculum)
+        if branch:
+            where += " and branch = ?"
+            params.append(branch)
+        return where, params
+
+    def export_snapshot(self, path):
+        """
+        Writes the aggregate tables as columns (one array per column) to a NumPy .npz file:
+        np.load(path)["chapter_diagnostics.mean_mastery"], etc.
+        """
+        np = sdk.load("numpy")
+        columns = {"snapshot_at": np.array([time.time()])}
+        for table in ("audit_levels", "chapter_diagnostics"):
+            cursor = self._db().execute(f"select * from {table}")
+            names = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+            for i, name in enumerate(names):
+                columns[f"{table}.{name}"] = np.array([row[i] for row in rows])
+        last = self._db().execute("select max(id) from events").fetchone()[0]
+        # Events up to this id are included in the aggregates
+        columns["events_until"] = np.array([last or 0])
+        np.savez_compressed(path, **columns)
+        return path
+
+    def stats(self):
+        return {**self.counters, "queued": len(self._queue)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregated diagnostics and level audits")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    chapters = commands.add_parser("chapters", help="chapters with the lowest mastery after the diagnostic")
+    levels = commands.add_parser("levels", help="self-assessed levels of the onboarding audits")
+    for command in (chapters, levels):
+        command.add_argument("--curriculum")
+        command.add_argument("--branch")
+    chapters.add_argument("--limit", type=int, default=10)
+    chapters.add_argument("--min-completions", type=int, default=MIN_COMPLETIONS)
+    export = commands.add_parser("export", help="columnar snapshot of the aggregates (.npz)")
+    export.add_argument("path")
+    args = parser.parse_args(argv)
+
+    analytics = Analytics(args.db)
+    if args.command == "chapters":
+        result = analytics.struggling_chapters(args.curriculum, args.branch, args.limit, args.min_completions)
+    elif args.command == "levels":
+        result = [{"curriculum": c, "branch": b, "subject": s, "levels": counts}
+                  for (c, b, s), counts in analytics.subject_levels(args.curriculum, args.branch).items()]
+    else:
+        print(analytics.export_snapshot(args.path))
+        return 0
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
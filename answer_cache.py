@@ -0,0 +1,108 @@
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# --- CACHE OF THE ANSWER EVALUATIONS ---
+# Students of the same chapter answer the same bank question with the same words in many
+# forms ("Le BFR, c'est le besoin de financement" / "le bfr c'est le BESOIN de financement.").
+# Each evaluation is stored under the scope of the question (programme, subject, chapter,
+# question, prompt version) and the normalized answer: lowercase, no accents, no punctuation,
+# words in their order. Two answers share an evaluation only when they normalize to the same
+# text.
+#
+# Answers are never matched by similarity. "Le BFR augmente quand..." and "le BFR diminue
+# quand..." differ by one word, and so do "12 000" and "12 500": any measure close enough to
+# catch paraphrases also catches these, and their verdicts (✅ / ❌) must never be exchanged.
+#
+# The entries are a SQLite table (ANSWER_CACHE_PATH), shared by the processes of one host and
+# kept across restarts. Past `capacity`, the least recently used entries are dropped.
+
+DEFAULT_CAPACITY = 20_000       # entries
+TRIM_EVERY = 100                # puts between two capacity checks
+
+SQLITE_SCHEMA = """
+create table if not exists entries (
+    scope text not null,
+    answer text not null,           -- normalized
+    reply text not null,
+    used_at real not null,
+    primary key (scope, answer)
+) without rowid;
+create index if not exists entries_used_at on entries (used_at);
+"""
+
+
+def normalize(text):
+    # Lowercase, no accents, words separated by one space
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+(?:[.,][0-9]+)?", text))
+
+
+def make_scope(*parts):
+    # Only answers of the same scope share evaluations
+    return "|".join(str(part) for part in parts)
+
+
+class AnswerCache:
+    def __init__(self, path=None, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        # One connection, only used under self._lock
+        self._db = sqlite3.connect(path or ":memory:", timeout=10, check_same_thread=False)
+        if path is not None:
+            self._db.execute("pragma journal_mode = wal")
+        self._db.executescript(SQLITE_SCHEMA)
+        self._puts_since_trim = 0
+        self.counters = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+    def get(self, scope, text):
+        # Evaluation of an answer with the same normalized words, None otherwise
+        answer = normalize(text)
+        with self._lock:
+            row = self._db.execute("select reply from entries where scope = ? and answer = ?",
+                                   (scope, answer)).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self._db.execute("update entries set used_at = ? where scope = ? and answer = ?",
+                             (time.time(), scope, answer))
+            self._db.commit()
+            return row[0]
+
+    def put(self, scope, text, reply):
+        with self._lock:
+            self._db.execute(
+                "insert or replace into entries (scope, answer, reply, used_at) values (?, ?, ?, ?)",
+                (scope, normalize(text), reply, time.time()),
+            )
+            self.counters["puts"] += 1
+            self._puts_since_trim += 1
+            if self._puts_since_trim >= TRIM_EVERY:
+                self._puts_since_trim = 0
+                self._trim()
+            self._db.commit()
+
+    def _trim(self):
+        excess = self._db.execute("select count(*) from entries").fetchone()[0] - self.capacity
+        if excess > 0:
+            self._db.execute(
+                "delete from entries where (scope, answer) in "
+                "(select scope, answer from entries order by used_at limit ?)",
+                (excess,),
+            )
+            self.counters["evictions"] += excess
+
+    def stats(self):
+        total = self.counters["hits"] + self.counters["misses"]
+        with self._lock:
+            entries = self._db.execute("select count(*) from entries").fetchone()[0]
+        return {
+            **self.counters,
+            "entries": entries,
+            "hit_rate": round(self.counters["hits"] / total, 3) if total else 0.0,
+        }
@@ -1,32 +1,322 @@
 import streamlit as st
+import datetime
 import re
-import google.generativeai as genai
-from groq import Groq
-from supabase import create_client
+import threading
+import uuid
+from streamlit.errors import StreamlitAPIException
+from accounts import AccountExists, EmailIndex, MemoryAccountBackend, SupabaseAccountBackend, UserRepository
+from analytics import Analytics
+from answer_cache import AnswerCache, make_scope
+from catalog import load_catalog
+from clients import ClientRegistry, DEFAULT_POOL_SIZE
+from context import ConversationContext
+from jobs import ACTIVE, JobQueue
+from library import ContentLibrary, LIBRARY_DIR, split_solutions
+from llm import DEFAULT_GEMINI_MODEL, DEFAULT_GROQ_MODEL, DEFAULT_HEDGE_PERCENTILE, GeminiProvider, GroqProvider, LLMRouter
+from mastery import P_GUESS_OPEN, P_GUESS_QCM, MasteryModel, verdict_score
+from metrics import DEFAULT_PORT_TRIES, Metrics
+from plan_pdf import PlanPdfRenderer, plan_document
+from plans import PLAN_JOB, generate_plan, plan_dedupe_key
+from question_bank import (
+    BANK_PATH, EVALUATION_MAX_TOKENS, QuestionBank, choice_feedback, difficulty_for, evaluation_messages,
+    format_question, match_choice,
+)
+from ratelimit import DEFAULT_RPM, DEFAULT_TPM, RateLimiter, request_cost
+from response_cache import ResponseCache, SupabaseCacheStore, make_cache_key
+from scheduler import LEVEL_MASTERY, RevisionScheduler
+import sdk
+from session_store import DEFAULT_TOKEN_TTL, SessionStateSync, SessionTokens, SqliteSessionBackend, SupabaseSessionBackend
+from sessions import DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_IN_MEMORY, SessionMemory, SpillStore
+from singleflight import SingleFlight
+from transcripts import MemoryTranscriptBackend, SupabaseTranscriptBackend, TranscriptWriter
 
 # --- 1. INITIAL SETUP ---
+@st.cache_resource
+def get_metrics():
+    # In-process histograms; read through http://127.0.0.1:METRICS_PORT/metrics and/or a log line
+    # every METRICS_LOG_INTERVAL seconds, never written from the render thread. Each process of the
+    # host takes the next free port (up to METRICS_PORT_TRIES of them); none free: no endpoint.
+    registry = Metrics()
+    if st.secrets.get("METRICS_PORT"):
+        registry.start_http_server(int(st.secrets["METRICS_PORT"]),
+                                   tries=int(st.secrets.get("METRICS_PORT_TRIES", DEFAULT_PORT_TRIES)))
+    if st.secrets.get("METRICS_LOG_INTERVAL"):
+        registry.start_log_dump(float(st.secrets["METRICS_LOG_INTERVAL"]))
+    # Cold start: time spent importing each provider SDK, and whether a page or the warm-up paid for it
+    sdk.on_import(lambda name, seconds, trigger: registry.observe("sdk_import_seconds", seconds, sdk=name, trigger=trigger))
+    return registry
+
+@st.cache_resource
+def get_clients():
+    # Built once per process and shared by every session (keep-alive HTTP pools)
+    registry = ClientRegistry(
+        st.secrets,
+        pool_size=int(st.secrets.get("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)),
+    )
+    registry.start_health_checks()
+    return registry
+
+# Bump when get_ai_system_prompt, get_evaluation_prompt or the Question 1 instruction changes:
+# old cached turns and evaluations are then ignored
+TUTOR_PROMPT_VERSION = 4
+
+@st.cache_resource
+def get_response_cache():
+    # Shared by all sessions; the Supabase tier is shared by all replicas when enabled
+    store = None
+    if st.secrets.get("RESPONSE_CACHE_PERSIST", False):
+        store = SupabaseCacheStore(get_clients())
+    return ResponseCache(store=store)
+
+@st.cache_resource
+def get_answer_cache():
+    # Evaluations of bank answers, found again when another student gives the same answer.
+    # A SQLite file of the host (ANSWER_CACHE_PATH), kept across restarts.
+    cache = AnswerCache(st.secrets.get("ANSWER_CACHE_PATH", "answer_cache.db"))
+    registry = get_metrics()
+    registry.gauge("answer_cache_entries", lambda: cache.stats()["entries"])
+    registry.gauge("answer_cache_hit_rate", lambda: cache.stats()["hit_rate"])
+    return cache
+
+@st.cache_resource
+def get_groq_limiter():
+    # One queue for the whole process: GROQ_RPM / GROQ_TPM are the limits of our Groq plan
+    return RateLimiter(
+        rpm=int(st.secrets.get("GROQ_RPM", DEFAULT_RPM)),
+        tpm=int(st.secrets.get("GROQ_TPM", DEFAULT_TPM)),
+    )
+
+@st.cache_resource
+def get_llm_router():
+    # Groq first, Gemini when Groq errors, rate-limits or is slower than its usual p95.
+    # Identical prompts sent at the same time share one call; so do the first turns of a class
+    # opening the same chapter (coalesced on the first-turn cache key).
+    registry = get_clients()
+    return LLMRouter(
+        [
+            GroqProvider(registry, model=st.secrets.get("GROQ_MODEL", DEFAULT_GROQ_MODEL), limiter=get_groq_limiter()),
+            GeminiProvider(registry, model=st.secrets.get("GEMINI_MODEL", DEFAULT_GEMINI_MODEL)),
+        ],
+        # LLM_HEDGE_PERCENTILE = 0 disables hedging (Groq only, failover on errors still works)
+        hedge_percentile=st.secrets.get("LLM_HEDGE_PERCENTILE", DEFAULT_HEDGE_PERCENTILE) or None,
+        single_flight=SingleFlight(),
+        metrics=get_metrics(),
+    )
+
+@st.cache_resource
+def get_accounts():
+    # ACCOUNTS_BACKEND = "memory" keeps accounts in the process (local development)
+    if st.secrets.get("ACCOUNTS_BACKEND", "supabase") == "memory":
+        backend = MemoryAccountBackend(seed=[
+            ("test@taki.com", "password123", True, {"bac_type": "Mathématiques"}),
+        ])
+    else:
+        backend = SupabaseAccountBackend(get_clients())
+    repo = UserRepository(backend)
+    repo.start_flusher()
+    return repo
+
+@st.cache_resource
+def get_email_index():
+    # Bloom filter of the registered emails, loaded in the background and refreshed every minute:
+    # the signup check only reaches the store for the emails the filter may contain
+    index = EmailIndex(get_accounts())
+    index.start()
+    get_metrics().gauge("email_index_size", lambda: index.stats()["indexed"])
+    return index
+
+@st.cache_resource
+def get_transcripts():
+    # Write-behind checkpoints of the diagnostic chats (TRANSCRIPTS_BACKEND = "memory" for local dev)
+    if st.secrets.get("TRANSCRIPTS_BACKEND", "supabase") == "memory":
+        backend = MemoryTranscriptBackend()
+    else:
+        backend = SupabaseTranscriptBackend(get_clients())
+    writer = TranscriptWriter(backend)
+    writer.start()
+    return writer
+
+@st.cache_resource
+def get_job_queue():
+    # Local worker pool; the SQLite job table survives process restarts
+    queue = JobQueue(st.secrets.get("JOBS_DB_PATH", "jobs.db"))
+    router = get_llm_router()
+    queue.register(PLAN_JOB, lambda payload, progress: generate_plan(router, payload, progress))
+    queue.start()
+    return queue
+
+@st.cache_resource
+def get_pdf_renderer():
+    # Fonts parsed once per process; rendered PDFs are shared by every session (content-hash cache)
+    return PlanPdfRenderer(font_path=st.secrets.get("PDF_FONT_PATH"), bold_font_path=st.secrets.get("PDF_BOLD_FONT_PATH"))
+
+@st.cache_resource
+def get_session_memory():
+    # Chat histories keep their last SESSION_MAX_MESSAGES messages in RAM, the rest and the
+    # sessions idle for SESSION_IDLE_TIMEOUT seconds go to a local spill file
+    try:
+        spill = SpillStore(st.secrets.get("SESSION_SPILL_PATH"))
+    except Exception:
+        spill = None    # spill file unavailable: transcripts stay whole in RAM
+    memory = SessionMemory(
+        spill=spill,
+        max_in_memory=int(st.secrets.get("SESSION_MAX_MESSAGES", DEFAULT_MAX_IN_MEMORY)),
+        idle_timeout=float(st.secrets.get("SESSION_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT)),
+    )
+    memory.start()
+    registry = get_metrics()
+    registry.gauge("sessions_active", lambda: memory.stats()["active"])
+    registry.gauge("sessions_idle_offloaded", lambda: memory.stats()["idle_offloaded"])
+    registry.gauge("sessions_state_bytes", lambda: memory.stats()["state_bytes"])
+    if spill is not None:
+        registry.gauge("sessions_spilled_messages", spill.count)
+    return memory
+
+@st.cache_resource
+def get_session_sync():
+    # SESSION_BACKEND = "supabase" when several hosts serve the app; the default SQLite file
+    # is shared by the processes of one host
+    if st.secrets.get("SESSION_BACKEND", "sqlite") == "supabase":
+        backend = SupabaseSessionBackend(get_clients())
+    else:
+        backend = SqliteSessionBackend(st.secrets.get("SESSION_DB_PATH", "sessions.db"))
+    sync = SessionStateSync(backend)
+    sync.start()
+    return sync
+
+@st.cache_resource
+def get_session_tokens():
+    # SESSION_SECRET must be the same on every replica, or sessions cannot move between them
+    return SessionTokens(
+        st.secrets.get("SESSION_SECRET"),
+        ttl=float(st.secrets.get("SESSION_TOKEN_TTL", DEFAULT_TOKEN_TTL)),
+    )
+
+@st.cache_resource
+def start_warm_up():
+    # Once per process, after the first page was served (WARMUP_PROVIDERS = true): SDK imports,
+    # clients, first connections and PDF fonts are ready before the first student needs them
+    def run():
+        get_clients().warm_up()
+        get_pdf_renderer().warm_up()
+
+    threading.Thread(target=run, name="warm-up", daemon=True).start()
+    return True
+
+@st.cache_resource
+def get_question_bank():
+    # Read once per process; filled offline with `python question_bank.py generate`
+    return QuestionBank.load(st.secrets.get("QUESTION_BANK_PATH", BANK_PATH))
+
+@st.cache_resource
+def get_library():
+    # Résumés and exercise sets built offline with `python library.py build` (read-only here)
+    return ContentLibrary(st.secrets.get("LIBRARY_DIR", LIBRARY_DIR))
+
+@st.cache_resource
+def get_analytics():
+    # Audits and finished diagnostics, aggregated as they arrive (queried with `python analytics.py`)
+    analytics = Analytics(st.secrets.get("ANALYTICS_DB_PATH", "analytics.db"))
+    analytics.start()
+    return analytics
+
+# Instrumentation first: it must keep working when a vendor client fails to build
+metrics = get_metrics()
+session_tokens = get_session_tokens()
+
 try:
-    # 1. Standard Gemini Config (keep it for later if needed)
-    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-    
-    # 2. Groq Config (Our main engine for Mission X)
-    groq_client = Groq(api_key=st.secrets["GROQ_API_KEY"])
-    
-    # 3. Supabase Config
-    supabase = create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+    # 1-3. Gemini, Groq and Supabase clients: built (and their SDK imported) on first use,
+    # the landing, signup and onboarding pages do not need any of them
+    clients = get_clients()
+
+    # 4. Chat path (Groq rate limiter, failover Groq -> Gemini) and shared caches
+    groq_limiter = get_groq_limiter()
+    llm_router = get_llm_router()
+    response_cache = get_response_cache()
+    answer_cache = get_answer_cache()
+
+    # 5. Accounts and diagnostic checkpoints (shared by every session and replica)
+    accounts = get_accounts()
+    email_index = get_email_index()
+    transcripts = get_transcripts()
+
+    # 6. Background jobs (revision plans)
+    job_queue = get_job_queue()
 except Exception as e:
     st.error(f"Setup Error: {e}")
 
+# Local state (files and memory of this host, no vendor client is built): every page needs it,
+# so it is set up outside the block above. A failing vendor only breaks the pages that call it.
+
+def optional_component(where, getter):
+    # A local file that cannot be opened (read-only disk, corrupt JSON, locked database) only
+    # disables its feature: None, which the callers check. Retried on the next rerun.
+    try:
+        return getter()
+    except Exception as e:
+        metrics.incr("errors_total", where=where, error=type(e).__name__)
+        return None
+
+# 7. PDF export of the revision plans (None: no download button)
+pdf_renderer = optional_component("pdf_renderer", get_pdf_renderer)
+
+# 8. Per-session memory (bounded chat histories, idle sessions offloaded; without its spill file,
+# histories stay in RAM)
+session_memory = get_session_memory()
+
+# 9. Navigation state shared by every replica (no sticky sessions; None or a store that is down:
+# sessions are not restored on another replica)
+session_sync = optional_component("session_sync", get_session_sync)
+
+# 10. Precomputed diagnostic questions (None: live questions)
+question_bank = optional_component("question_bank", get_question_bank)
+
+# 11. Résumés and exercise sets, generated offline (None: both pages stay locked)
+library = optional_component("library", get_library)
+
+# 12. Analytics events (level audits, finished diagnostics; None: not recorded)
+analytics = optional_component("analytics", get_analytics)
+
 st.set_page_config(page_title="KhirMinTaki", layout="centered")
 
+# Curriculum tables (sections, séries, subjects, chapters, emojis), compiled once per process
+catalog = load_catalog()
+
+# The URL carries a signed, expiring session token (see session_store.py): a replica that does not
+# know the session rebuilds its navigation state from the shared store
+session_token = st.query_params.get("sid")
+session_id = session_tokens.session_id(session_token)
+if session_id and "step" not in st.session_state:
+    try:
+        restored = session_sync.load(session_id) if session_sync is not None else {}
+    except Exception:
+        restored = {}   # store unreachable: the session starts over
+    # An account is only restored with a token issued to it at login or signup
+    if session_tokens.verify(session_token, restored.get("user_data", {}).get("email")):
+        st.session_state.update(restored)
+    else:
+        session_id = None
+if not session_id:
+    session_id = uuid.uuid4().hex
+if session_tokens.session_id(session_token) != session_id or session_tokens.needs_renewal(session_token):
+    st.query_params["sid"] = session_tokens.issue(session_id, st.session_state.get("user_data", {}).get("email"))
+
 if "step" not in st.session_state:
     st.session_state.step = "landing"
 if "user_data" not in st.session_state:
     st.session_state.user_data = {}
-if "mock_db" not in st.session_state:
-    st.session_state.mock_db = {
-        "test@taki.com": {"pwd": "password123", "profile_complete": True, "data": {"bac_type": "Mathématiques"}}
-    }
+if "session_handle" not in st.session_state:
+    st.session_state.session_handle = session_memory.attach()
+
+# Marks the session as active (an offloaded one is read back) and refreshes its size estimate
+session_memory.touch(st.session_state.session_handle, st.session_state)
+if st.secrets.get("SHOW_SESSION_STATS", False):
+    session_info = session_memory.session_stats(st.session_state.session_handle)
+    st.sidebar.caption(
+        f"🧮 Session : {session_info['state_bytes'] // 1024} Ko · "
+        f"{session_info['messages']} messages ({session_info['messages_in_memory']} en mémoire, "
+        f"{session_info['messages_spilled']} sur disque, {session_info['transcript_bytes'] // 1024} Ko)"
+    )
 
 # --- 2. DYNAMIC CSS ---
 st.markdown("""
@@ -68,9 +358,48 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
+# Set to False to fall back to a single blocking completion per turn
+STREAM_REPLIES = True
+
 def is_valid_email(email):
     return re.match(r"[^@]+@[^@]+\.[^@]+", email)
 
+def email_taken(email):
+    # Answered by the email index (no store lookup for a free email); an unreachable store must not block signup
+    try:
+        return email_index.is_taken(email)
+    except Exception:
+        return False
+
+def rotate_session(email=None):
+    # New session id at login, signup and logout; the old one is emptied in the shared store, so an
+    # id seen before authentication, or a URL shared while logged in, never leads to the account
+    global session_id
+    try:
+        if session_sync is not None:
+            session_sync.forget(session_id)
+    except Exception:
+        pass
+    session_id = uuid.uuid4().hex
+    st.query_params["sid"] = session_tokens.issue(session_id, email)
+
+def index_email(email):
+    # The index only saves store lookups: signup goes on without it
+    try:
+        email_index.add(email)
+    except Exception:
+        pass
+
+def save_profile(**fields):
+    # Updates the session and stages the fields for the next batched upsert of the account
+    st.session_state.user_data.update(fields)
+    email = st.session_state.user_data.get("email")
+    if email:
+        try:
+            accounts.stage(email, **fields)
+        except Exception:
+            pass    # account store not set up: the profile stays in the session
+
 # --- 3. PAGE FUNCTIONS ---
 
 def show_landing():
@@ -82,43 +411,64 @@ def show_landing():
         st.session_state.step = "login"
         st.rerun()
 
+def show_field_error(slot, label, message):
+    # Red message under the field + CSS that turns the border red for this input only
+    slot.markdown(
+        f"<p class='validation-msg error-text'>{message}</p>"
+        f"<style>div[data-testid='stTextInput']:has(input[aria-label='{label}']) div[data-baseweb='input'] {{ border: 2px solid #dc3545 !important; }}</style>",
+        unsafe_allow_html=True,
+    )
+
 def show_signup():
     st.markdown("## Créer un compte")
-    
-    # --- EMAIL FIELD ---
-    email = st.text_input("Email", key="signup_email", placeholder="exemple@gmail.com")
-    email_valid = is_valid_email(email) if email else True # True when empty to avoid red on start
-    
-    if email and not email_valid:
-        st.markdown("<p class='validation-msg error-text'>Format invalide, doit être : exemple@gmail.com</p>", unsafe_allow_html=True)
-        # Injects CSS to turn the border red specifically for the Email input
-        st.markdown("<style>div[data-testid='stTextInput']:has(input[aria-label='Email']) div[data-baseweb='input'] { border: 2px solid #dc3545 !important; }</style>", unsafe_allow_html=True)
-    elif email and email in st.session_state.mock_db:
-        st.markdown("<p class='validation-msg error-text'>Cet email est déjà utilisé</p>", unsafe_allow_html=True)
-        st.markdown("<style>div[data-testid='stTextInput']:has(input[aria-label='Email']) div[data-baseweb='input'] { border: 2px solid #dc3545 !important; }</style>", unsafe_allow_html=True)
-
-    # --- PASSWORD FIELD ---
-    pwd = st.text_input("Mot de passe", type="password", key="signup_pwd")
-    pwd_valid = len(pwd) >= 8 if pwd else True # True when empty to avoid red on start
-    
-    if pwd and not pwd_valid:
-        st.markdown("<p class='validation-msg error-text'>Longueur invalide, minimum 8 caractères.</p>", unsafe_allow_html=True)
-        # Injects CSS to turn the border red specifically for the Password input
-        st.markdown("<style>div[data-testid='stTextInput']:has(input[aria-label='Mot de passe']) div[data-baseweb='input'] { border: 2px solid #dc3545 !important; }</style>", unsafe_allow_html=True)
-
-    pwd_conf = st.text_input("Confirmez votre mot de passe", type="password", key="signup_pwd_conf")
-    match_valid = (pwd == pwd_conf) if pwd_conf else True
-
-    if pwd_conf and not match_valid:
-        st.markdown("<p class='validation-msg error-text'>Les mots de passe ne correspondent pas</p>", unsafe_allow_html=True)
-        st.markdown("<style>div[data-testid='stTextInput']:has(input[aria-label='Confirmez votre mot de passe']) div[data-baseweb='input'] { border: 2px solid #dc3545 !important; }</style>", unsafe_allow_html=True)
-
-    # --- SUBMIT BUTTON ---
-    # Inside show_signup()
-    if st.button("Créer mon compte", use_container_width=True):
-        if is_valid_email(email) and len(pwd) >= 8 and pwd == pwd_conf:
-            st.session_state.mock_db[email] = {"pwd": pwd, "profile_complete": False, "data": {}}
+
+    # The form batches the three fields: typing does not rerun the script,
+    # validation (and the availability lookup) only runs on submit.
+    with st.form("signup_form", border=False):
+        # --- EMAIL FIELD ---
+        email = st.text_input("Email", key="signup_email", placeholder="exemple@gmail.com")
+        email_slot = st.empty()
+
+        # --- PASSWORD FIELD ---
+        pwd = st.text_input("Mot de passe", type="password", key="signup_pwd")
+        pwd_slot = st.empty()
+
+        pwd_conf = st.text_input("Confirmez votre mot de passe", type="password", key="signup_pwd_conf")
+        conf_slot = st.empty()
+
+        # --- SUBMIT BUTTON ---
+        submitted = st.form_submit_button("Créer mon compte", use_container_width=True)
+
+    if submitted:
+        valid = True
+        if not is_valid_email(email):
+            show_field_error(email_slot, "Email", "Format invalide, doit être : exemple@gmail.com")
+            valid = False
+        elif email_taken(email):
+            show_field_error(email_slot, "Email", "Cet email est déjà utilisé")
+            valid = False
+
+        if len(pwd) < 8:
+            show_field_error(pwd_slot, "Mot de passe", "Longueur invalide, minimum 8 caractères.")
+            valid = False
+
+        if pwd != pwd_conf:
+            show_field_error(conf_slot, "Confirmez votre mot de passe", "Les mots de passe ne correspondent pas")
+            valid = False
+
+        if valid:
+            try:
+                accounts.create(email, pwd)
+            except AccountExists:
+                index_email(email)
+                show_field_error(email_slot, "Email", "Cet email est déjà utilisé")
+                return
+            except Exception as e:
+                st.error(f"Service indisponible, réessayez plus tard. ({e})")
+                return
+            index_email(email)
             st.session_state.user_data = {"email": email}
+            rotate_session(email)
             st.session_state.step = "curriculum_selection" # This is the change
             st.rerun()
         else:
@@ -134,8 +484,12 @@ def show_login():
     pwd_log = st.text_input("Mot de passe", type="password", key="login_pwd")
     
     if st.button("Se connecter", use_container_width=True):
-        user_entry = st.session_state.mock_db.get(email_log)
-        if user_entry and user_entry["pwd"] == pwd_log:
+        try:
+            user_entry = accounts.authenticate(email_log, pwd_log)
+        except Exception as e:
+            st.error(f"Service indisponible, réessayez plus tard. ({e})")
+            return
+        if user_entry:
             # 1. Ensure user_data is a dictionary even if "data" was empty
             db_data = user_entry.get("data", {})
             
@@ -145,6 +499,7 @@ def show_login():
             
             # 3. Explicitly set the email to ensure it's always present
             st.session_state.user_data["email"] = email_log
+            rotate_session(email_log)
             
             # 4. Check profile status and redirect
             if user_entry.get("profile_complete"):
@@ -161,20 +516,13 @@ def show_login():
         st.rerun()
 
 # --- PROFILE SETUP FLOW ---
-CORE_MAPPING = {
-    "Mathématiques": ["Mathématiques", "Physique", "SVT", "Informatique", "Philosophie", "Arabe", "Français", "Anglais"],
-    "Sciences Expérimentales": ["SVT", "Physique", "Mathématiques", "Informatique", "Philosophie", "Arabe", "Français", "Anglais"],
-    "Sciences Économiques et Gestion": ["Économie", "Gestion", "Mathématiques", "Informatique", "Histoire-Géographie", "Philosophie", "Arabe", "Français", "Anglais"],
-    "Lettres": ["Arabe", "Philosophie", "Histoire-Géographie", "Français", "Anglais"]
-}
-
 def show_bac_selection():
     st.markdown("## 🎓 Quelle est votre section Bac ?")
     
     # Displaying the Tunisian Bac sections
-    for opt in CORE_MAPPING.keys():
+    for opt in catalog.tn_sections:
         if st.button(opt, use_container_width=True):
-            st.session_state.user_data["bac_type"] = opt
+            save_profile(bac_type=opt)
             st.session_state.step = "option_selection"
             st.rerun()
     
@@ -189,12 +537,12 @@ def show_curriculum_selection():
     st.markdown("## 🌍 Quel est votre système ?")
     
     if st.button("🇹🇳 Baccalauréat Tunisien", use_container_width=True):
-        st.session_state.user_data["curriculum"] = "Tunisien"
+        save_profile(curriculum="Tunisien")
         st.session_state.step = "bac_selection" # Leads to Bac choice
         st.rerun()
         
     if st.button("🇫🇷 Baccalauréat Français", use_container_width=True):
-        st.session_state.user_data["curriculum"] = "Français"
+        save_profile(curriculum="Français")
         st.session_state.step = "fr_level_selection" # New starting point
         st.rerun()
 
@@ -207,7 +555,7 @@ def show_fr_level_selection():
     with col1:
         if st.button("Première", use_container_width=True):
             # Enregistre le niveau
-            st.session_state.user_data["fr_level"] = "Première"
+            save_profile(fr_level="Première")
             # Direction le choix de la voie (Générale ou Techno)
             st.session_state.step = "fr_voie_selection"
             st.rerun()
@@ -215,7 +563,7 @@ def show_fr_level_selection():
     with col2:
         if st.button("Terminale", use_container_width=True):
             # Enregistre le niveau
-            st.session_state.user_data["fr_level"] = "Terminale"
+            save_profile(fr_level="Terminale")
             # Direction le choix de la voie (Générale ou Techno)
             st.session_state.step = "fr_voie_selection"
             st.rerun()
@@ -233,14 +581,14 @@ def show_fr_voie_selection():
     
     with col1:
         if st.button("Voie Générale", use_container_width=True):
-            st.session_state.user_data["fr_voie"] = "Générale"
+            save_profile(fr_voie="Générale")
             # Les élèves en voie générale doivent choisir leurs spécialités
             st.session_state.step = "fr_specialites_selection"
             st.rerun()
             
     with col2:
         if st.button("Voie Technologique", use_container_width=True):
-            st.session_state.user_data["fr_voie"] = "Technologique"
+            save_profile(fr_voie="Technologique")
             # C'est ici que l'on redirige vers le choix de la série (STMG, STI2D, etc.)
             st.session_state.step = "fr_serie_selection"
             st.rerun()
@@ -252,14 +600,14 @@ def show_fr_voie_selection():
 def show_fr_serie_selection():
     st.markdown("## 🔬 Choisissez votre série")
     
-    # On définit la liste des séries
-    series = ["STMG", "STI2D", "STL", "ST2S", "STD2A", "STHR"]
+    # La liste des séries vient du catalogue
+    series = catalog.fr_series
     
     # On crée un bouton pour chaque série de la liste
     for s in series:
         if st.button(s, use_container_width=True):
             # Enregistre exactement le nom de la série (ex: "ST2S")
-            st.session_state.user_data["fr_serie"] = s
+            save_profile(fr_serie=s)
             
             # Redirige vers l'audit
             st.session_state.step = "level_audit"
@@ -270,30 +618,30 @@ def show_fr_serie_selection():
 def show_fr_specialites_selection():
     level = st.session_state.user_data.get("fr_level")
     # Définit la limite selon le niveau choisi précédemment
-    limit = 3 if level == "Première" else 2
+    limit = catalog.fr_specialites_count.get(level, 2)
     
     st.markdown(f"## 🧪 Les spécialités ({level})")
     st.info(f"Veuillez choisir exactement **{limit}** spécialités.")
     
-    specs = [
-        "Mathématiques", "Physique-Chimie", "Sciences de la Vie et de la Terre",
-        "Sciences Économiques et Sociales", "HGGSP", "Numérique et Sciences Informatiques",
-        "Humanités, Littérature et Philosophie", "Langues étrangères approfondies"
-    ]
-    
-    # Création des cases à cocher
-    selected = []
-    for spec in specs:
-        if st.checkbox(spec, key=f"check_{spec}"):
-            selected.append(spec)
+    specs = catalog.fr_specialites
     
-    st.markdown("---") # Séparateur visuel
+    # Formulaire : cocher une case ne relance plus le script, seul le bouton le fait
+    with st.form("specialites_form", border=False):
+        # Création des cases à cocher
+        selected = []
+        for spec in specs:
+            if st.checkbox(spec, key=f"check_{spec}"):
+                selected.append(spec)
+        
+        st.markdown("---") # Séparateur visuel
+
+        submitted = st.form_submit_button("Confirmer mes spécialités", use_container_width=True)
 
     # --- LE BLOC DE REDIRECTION ---
-    if st.button("Confirmer mes spécialités", use_container_width=True):
+    if submitted:
         if len(selected) == limit:
             # Enregistre les choix dans les données utilisateur
-            st.session_state.user_data["fr_specialites"] = selected
+            save_profile(fr_specialites=selected)
             
             # Change l'étape du routeur pour afficher l'audit des matières
             st.session_state.step = "level_audit"
@@ -306,137 +654,38 @@ def show_fr_specialites_selection():
 
 def show_option_selection():
     st.markdown("## ✨ Choisissez votre Option")
-    options = {"Allemand": "🇩🇪", "Espagnol": "🇪🇸", "Italien": "🇮🇹", "Russe": "🇷🇺", "Chinois": "🇨🇳", "Dessin": "🎨"}
+    options = catalog.tn_options
     for opt, emoji in options.items():
         if st.button(f"{emoji} {opt}", use_container_width=True):
-            st.session_state.user_data["selected_option"] = opt
+            save_profile(selected_option=opt)
             st.session_state.step = "level_audit"
             st.rerun()
 
 def get_full_subject_list():
-    curriculum = st.session_state.user_data.get("curriculum")
+    user_info = st.session_state.user_data
+    curriculum = user_info.get("curriculum")
     
     # 1. FLUX TUNISIEN
     if curriculum == "Tunisien":
-        bac = st.session_state.user_data.get("bac_type")
-        subjects = CORE_MAPPING.get(bac, []).copy()
-        opt = st.session_state.user_data.get("selected_option")
+        subjects = list(catalog.subjects("Tunisien", user_info.get("bac_type")))
+        opt = user_info.get("selected_option")
         if opt: 
             subjects.append(opt)
         return subjects
 
     # 2. FLUX FRANÇAIS
     elif curriculum == "Français":
-        level = st.session_state.user_data.get("fr_level")
-        voie = st.session_state.user_data.get("fr_voie")
-        serie = st.session_state.user_data.get("fr_serie")
-
-        # --- CAS : STHR (Hôtellerie et Restauration) ---
-        if voie == "Technologique" and serie == "STHR":
-            return [
-                "Français" if level == "Première" else "Philosophie",
-                "Histoire-Géographie",
-                "Mathématiques",
-                "Langue Vivante A",
-                "Langue Vivante B",
-                "EPS (Sport)",
-                "Enseignement Moral et Civique (EMC)",
-                "Sciences et Technologies de l’Hôtellerie et de la Restauration (STHR)",
-                "Cuisine et Service / Travaux Pratiques",
-                "Gestion et Mercatique appliquée à l’Hôtellerie",
-                "Projet professionnel / atelier pratique"
-            ]
-
-        # --- CAS : STD2A (Design) ---
-        elif voie == "Technologique" and serie == "STD2A":
-            return [
-                "Français" if level == "Première" else "Philosophie",
-                "Histoire-Géographie",
-                "Mathématiques",
-                "Langue Vivante A",
-                "Langue Vivante B",
-                "EPS (Sport)",
-                "Enseignement Moral et Civique (EMC)",
-                "Création et Culture Design (CCD)",
-                "Arts Appliqués et Projet Artistique",
-                "Technologie et Méthodologie de Projet",
-                "Travaux pratiques / Atelier"
-            ]
-
-        # --- CAS : ST2S (Santé-Social) ---
-        elif voie == "Technologique" and serie == "ST2S":
-            return [
-                "Français" if level == "Première" else "Philosophie",
-                "Histoire-Géographie",
-                "Mathématiques",
-                "Langue Vivante A",
-                "Langue Vivante B",
-                "EPS (Sport)",
-                "Enseignement Moral et Civique (EMC)",
-                "Sciences et Techniques Sanitaires et Sociales",
-                "Biologie et Physiopathologie Humaines",
-                "Psychologie / Sociologie appliquée",
-                "Travaux pratiques / projets santé-social"
-            ]
-
-        # --- CAS : STL (Laboratoire) ---
-        elif voie == "Technologique" and serie == "STL":
-            return [
-                "Français" if level == "Première" else "Philosophie",
-                "Histoire-Géographie",
-                "Mathématiques",
-                "Langue Vivante A",
-                "Langue Vivante B",
-                "EPS (Sport)",
-                "Enseignement Moral et Civique (EMC)",
-                "Sciences Physiques et Chimiques",
-                "Biotechnologies ou SPCL"
-            ]
-
-        # --- CAS : STI2D (Industrie) ---
-        elif voie == "Technologique" and serie == "STI2D":
-            return [
-                "Français" if level == "Première" else "Philosophie",
-                "Histoire-Géographie",
-                "Mathématiques",
-                "Langue Vivante A",
-                "Langue Vivante B",
-                "Physique-Chimie",
-                "Innovation Technologique",
-                "Ingénierie et Développement Durable",
-                "EPS",
-                "Enseignement Moral et Civique",
-                "Sciences Physiques et Mathématiques appliquées"
-            ]
-
-        # --- CAS : STMG (Gestion) ---
-        elif voie == "Technologique" and serie == "STMG":
-            return [
-                "Français" if level == "Première" else "Philosophie",
-                "Histoire-Géographie",
-                "Mathématiques",
-                "Langue Vivante A",
-                "Langue Vivante B",
-                "Management",
-                "Sciences de Gestion et Numérique",
-                "Droit et Économie",
-                "EPS",
-                "Enseignement Moral et Civique"
-            ]
+        level = user_info.get("fr_level")
+        voie = user_info.get("fr_voie")
+
+        # La série identifie la filière en voie technologique, la voie sinon
+        branch = user_info.get("fr_serie") if voie == "Technologique" else voie
+        subjects = list(catalog.subjects("Français", branch, level))
 
         # --- CAS : VOIE GÉNÉRALE (Spécialités) ---
-        elif voie == "Générale":
-            subjects = [
-                "Français" if level == "Première" else "Philosophie",
-                "Histoire-Géographie",
-                "LVA (Anglais)",
-                "LVB",
-                "Enseignement Scientifique",
-                "EPS"
-            ]
-            specs = st.session_state.user_data.get("fr_specialites", [])
-            subjects.extend(specs)
-            return subjects
+        if voie == "Générale" and subjects:
+            subjects.extend(user_info.get("fr_specialites", []))
+        return subjects
             
     return []
 def show_level_audit():
@@ -473,18 +722,23 @@ def show_level_audit():
     
     st.info("Évaluez honnêtement votre niveau actuel dans chaque matière pour que l'IA puisse s'adapter.")
     
-    for sub in subjects:
-        levels[sub] = st.select_slider(
-            f"Votre niveau en **{sub}**",
-            options=assessment_levels,
-            value="Satisfaisant",
-            key=f"aud_{sub}"
-        )
-        st.markdown("<hr style='margin:10px 0;'>", unsafe_allow_html=True)
-        
-    # 4. Bouton de validation
-    if st.button("Confirmer mon profil", use_container_width=True):
-        st.session_state.user_data["levels"] = levels
+    # Formulaire : déplacer un slider ne relance plus le script, seule la validation le fait
+    with st.form("level_audit_form", border=False):
+        for sub in subjects:
+            levels[sub] = st.select_slider(
+                f"Votre niveau en **{sub}**",
+                options=assessment_levels,
+                value="Satisfaisant",
+                key=f"aud_{sub}"
+            )
+            st.markdown("<hr style='margin:10px 0;'>", unsafe_allow_html=True)
+            
+        # 4. Bouton de validation
+        submitted = st.form_submit_button("Confirmer mon profil", use_container_width=True)
+
+    if submitted:
+        save_profile(levels=levels)
+        record_analytics(lambda: analytics.record_audit(*library_profile(), levels))
         st.session_state.step = "philosophy"
         st.rerun()
 
@@ -492,6 +746,17 @@ def show_philosophy():
     st.markdown("## 🧠 Votre philosophie d'apprentissage")
     st.write("Décrivez en détail comment vous souhaitez que votre professeur IA interagisse avec vous.")
 
+    philosophy_editor()
+
+    if st.button("← Retour"):
+        st.session_state.step = "level_audit"
+        st.rerun()
+
+@st.fragment
+@metrics.timed("fragment_render_seconds", fragment="philosophy_editor")
+def philosophy_editor():
+    # Fragment: editing the text only reruns this block (counter + progress bar), not the page
+
     # 1. Logic to sync text and character count instantly
     if "temp_philosophy" not in st.session_state:
         st.session_state.temp_philosophy = ""
@@ -528,15 +793,17 @@ def show_philosophy():
                  use_container_width=True, 
                  disabled=(char_count < 80)):
         
-        st.session_state.user_data["philosophy"] = user_philosophy
-        st.session_state.user_data["profile_complete"] = True
+        save_profile(philosophy=user_philosophy, profile_complete=True)
+        # End of onboarding: write the staged profile now instead of waiting for the flusher
+        try:
+            accounts.flush()
+        except Exception:
+            pass    # still staged, the background flusher will retry
+        # The draft is saved in the profile, no need to keep it in the session
+        st.session_state.pop("temp_philosophy", None)
         st.session_state.step = "dashboard"
         st.balloons()
         st.rerun()
-
-    if st.button("← Retour"):
-        st.session_state.step = "level_audit"
-        st.rerun()
 # --- MAIN DASHBOARD & FEATURES ---
 
 def show_dashboard():
@@ -553,10 +820,21 @@ def show_dashboard():
         if st.button("👨‍🏫 AI Professor", use_container_width=True):
             st.session_state.step = "subject_hub"
             st.rerun()
-        st.button("📄 Résumés (🔒)", disabled=True, use_container_width=True)
+        # Unlocked once the offline build has content for the student's branch
+        has_summaries = bool(library_subjects("resume"))
+        if st.button("📄 Résumés" if has_summaries else "📄 Résumés (🔒)",
+                     disabled=not has_summaries,
+                     use_container_width=True):
+            st.session_state.step = "summaries"
+            st.rerun()
         
     with col2:
-        st.button("📝 Exercices (🔒)", disabled=True, use_container_width=True)
+        has_exercises = bool(library_subjects("exercices"))
+        if st.button("📝 Exercices" if has_exercises else "📝 Exercices (🔒)",
+                     disabled=not has_exercises,
+                     use_container_width=True):
+            st.session_state.step = "exercises"
+            st.rerun()
         plan_ready = st.session_state.user_data.get("plan_ready")
         if st.button("📅 Plans" if plan_ready else "📅 Plans (🔒)", 
                      disabled=not plan_ready, 
@@ -564,6 +842,7 @@ def show_dashboard():
             st.session_state.step = "view_plan"
             st.rerun()
             
+    show_weak_chapters(3)
     st.markdown("<hr>", unsafe_allow_html=True)
     
     if st.button("⭐ Abonnement", use_container_width=True):
@@ -574,6 +853,49 @@ def show_dashboard():
         # Clear sensitive data and return to landing
         st.session_state.user_data = {}
         st.session_state.step = "landing"
+        rotate_session()
+        st.rerun()
+
+def library_profile():
+    user_info = st.session_state.user_data
+    branch = user_info.get("bac_type") or user_info.get("fr_serie") or user_info.get("fr_voie")
+    return user_info.get("curriculum"), branch
+
+def library_subjects(kind):
+    # {subject: [chapters]} available for the student's curriculum and branch
+    if library is None:
+        return {}
+    return library.available(kind, *library_profile())
+
+def pick_library_chapter(kind):
+    # Subjects in the student's order, chapters in the programme's order
+    curriculum, branch = library_profile()
+    available = library_subjects(kind)
+    subjects = [sub for sub in get_full_subject_list() if sub in available] or list(available)
+    subject = st.selectbox("Matière", subjects, format_func=lambda sub: f"{catalog.emoji(sub)} {sub}", key=f"{kind}_subject")
+    chapters = [chap for chap in catalog.chapters(curriculum, branch, subject) if chap in available[subject]]
+    chapter = st.selectbox("Chapitre", chapters or available[subject], key=f"{kind}_chapter")
+    return library.get(kind, curriculum, branch, subject, chapter)
+
+def show_summaries():
+    st.markdown("## 📄 Résumés de cours")
+    artifact = pick_library_chapter("resume")
+    if artifact:
+        st.markdown(artifact["markdown"])
+    if st.button("← Retour au Dashboard", use_container_width=True):
+        st.session_state.step = "dashboard"
+        st.rerun()
+
+def show_exercises():
+    st.markdown("## 📝 Exercices type Bac")
+    artifact = pick_library_chapter("exercices")
+    if artifact:
+        statements, solutions = split_solutions(artifact["markdown"])
+        st.markdown(statements)
+        with st.expander("✅ Voir le corrigé"):
+            st.markdown(solutions)
+    if st.button("← Retour au Dashboard", use_container_width=True):
+        st.session_state.step = "dashboard"
         st.rerun()
 
 def show_subscription():
@@ -605,58 +927,84 @@ def show_subject_hub():
     
     # Récupère dynamiquement la liste des matières selon le profil utilisateur
     subjects = get_full_subject_list()
-    
-    # --- DICTIONNAIRE COMPLET DES EMOJIS ---
-    subject_emojis = {
-        # Tronc Commun & Tunisien
-        "Mathématiques": "📐", "Physique": "⚛️", "Physique-Chimie": "🧪", 
-        "SVT": "🧬", "Informatique": "💻", "Philosophie": "📜",
-        "Arabe": "🇹🇳", "Français": "🇫🇷", "Anglais": "🇬🇧", "Allemand": "🇩🇪", "Espagnol": "🇪🇸", "Italien": "🇮🇹", "Russe": "🇷🇺", "Chinois": "🇨🇳",
-        "Économie": "📈", "Gestion": "💼", "Histoire-Géographie": "🌍", 
-        "LVA (Anglais)": "🇬🇧", "LVB": "🌍", "EPS": "🏃", "EPS (Sport)": "🏃",
-        "Enseignement Moral et Civique (EMC)": "🗳️", "Enseignement Scientifique": "🧬",
-
-        # Spécificités STHR (Hôtellerie-Restauration)
-        "Sciences et Technologies de l’Hôtellerie et de la Restauration (STHR)": "🏨",
-        "Cuisine et Service / Travaux Pratiques": "👨‍🍳",
-        "Gestion et Mercatique appliquée à l’Hôtellerie": "📊",
-        "Projet professionnel / atelier pratique": "💼",
-
-        # Autres Séries Technologiques (STI2D, STMG, ST2S, STD2A, STL)
-        "Management": "🏢", 
-        "Sciences de Gestion et Numérique": "📊", 
-        "Droit et Économie": "⚖️",
-        "Innovation Technologique": "🛠️", 
-        "Ingénierie et Développement Durable": "🌱",
-        "Sciences Physiques et Mathématiques appliquées": "🔬",
-        "Sciences et Techniques Sanitaires et Sociales": "🏥",
-        "Biologie et Physiopathologie Humaines": "🫀",
-        "Création et Culture Design (CCD)": "🎨",
-        "Arts Appliqués et Projet Artistique": "🖌️",
-        "Technologie et Méthodologie de Projet": "📐",
-        "Travaux pratiques / Atelier": "🏗️",
-        "Sciences Physiques et Chimiques": "🧪",
-        "Biotechnologies ou SPCL": "🧪"
-    }
+
+    # Diagnostics commencés et non terminés (reprise depuis le dernier checkpoint)
+    resumable = get_resumable_diagnostics()
     
     # Affichage en grille de 3 colonnes
     cols = st.columns(3)
     for i, sub in enumerate(subjects):
         # Récupère l'émoji correspondant ou un livre bleu par défaut
-        emoji = subject_emojis.get(sub, "📘")
+        emoji = catalog.emoji(sub)
+        label = f"{emoji} {sub}"
+        if sub in resumable:
+            label += f" ▶️ {resumable[sub]['q_count']}/10"
         
         with cols[i % 3]:
             # Création du bouton pour chaque matière
-            if st.button(f"{emoji} {sub}", key=f"sub_{sub}", use_container_width=True):
-                # Configuration de la session pour le diagnostic IA
+            if st.button(label, key=f"sub_{sub}", use_container_width=True):
                 st.session_state.selected_subject = sub
                 st.session_state.step = "chat_diagnose"
-                st.session_state.messages = []
-                st.session_state.q_count = 0
-                st.session_state.diag_step = "get_chapter"
+                st.session_state.pop("resumable", None)
+                if sub in resumable:
+                    # Reprise : aucun tour déjà payé n'est régénéré
+                    restore_checkpoint(resumable[sub])
+                else:
+                    # Configuration de la session pour le diagnostic IA
+                    st.session_state.messages = session_memory.new_transcript(st.session_state.session_handle)
+                    st.session_state.q_count = 0
+                    st.session_state.diag_step = "get_chapter"
+                    st.session_state.chat_context = ConversationContext()
                 st.rerun()
 
+def get_resumable_diagnostics():
+    # Loaded once per visit of the hub, not on every rerun
+    if "resumable" not in st.session_state:
+        email = st.session_state.user_data.get("email")
+        try:
+            st.session_state.resumable = transcripts.in_progress(email) if email else {}
+        except Exception:
+            st.session_state.resumable = {}
+    return st.session_state.resumable
+
+def restore_checkpoint(row):
+    st.session_state.current_chapter = row.get("chapter")
+    st.session_state.diag_step = row["diag_step"]
+    st.session_state.q_count = row["q_count"]
+    st.session_state.messages = session_memory.new_transcript(st.session_state.session_handle, row["messages"])
+    st.session_state.chat_context = ConversationContext.from_dict(row.get("context"))
+
+def save_checkpoint():
+    # Queued only: the background writer batches it to the database
+    email = st.session_state.user_data.get("email")
+    if not email:
+        return
+    transcripts.checkpoint(
+        email,
+        st.session_state.selected_subject,
+        st.session_state.get("current_chapter"),
+        st.session_state.diag_step,
+        st.session_state.q_count,
+        st.session_state.messages,
+        context=st.session_state.chat_context.to_dict() if "chat_context" in st.session_state else None,
+    )
+
 def show_chat_diagnose():
+    # 0. Session lost (reconnexion, redémarrage) : reprise depuis le dernier checkpoint
+    if "messages" not in st.session_state:
+        row = None
+        email = st.session_state.user_data.get("email")
+        if email and "selected_subject" in st.session_state:
+            try:
+                row = transcripts.load(email, st.session_state.selected_subject)
+            except Exception:
+                row = None
+        if row and row["diag_step"] != "finished":
+            restore_checkpoint(row)
+        else:
+            st.session_state.step = "subject_hub"
+            st.rerun()
+
     # 1. Back Navigation
     if st.button("← Quitter le chat"):
         st.session_state.step = "subject_hub"
@@ -664,6 +1012,14 @@ def show_chat_diagnose():
 
     st.markdown(f"### 👨‍🏫 Tuteur : {st.session_state.selected_subject}")
 
+    diagnostic_chat()
+
+@st.fragment
+@metrics.timed("fragment_render_seconds", fragment="diagnostic_chat")
+def diagnostic_chat():
+    # Fragment: a chat turn only reruns this block, not the whole page and router.
+    # Every rerun below is scoped to the fragment for the same reason.
+
     # 2. Progress Bar
     if st.session_state.get("diag_step") == "questioning":
         st.progress(st.session_state.q_count / 10, text=f"Diagnostic : {st.session_state.q_count}/10")
@@ -685,11 +1041,25 @@ def show_chat_diagnose():
                 st.session_state.diag_step = "questioning"
                 st.session_state.q_count = 1
                 st.session_state.messages.append({"role": "user", "content": f"Je choisis le chapitre : {chap}"})
-                st.rerun()
+                # Chapter in the question bank: Question 1 is on screen at once, without an LLM call
+                questions = get_diagnostic_questions()
+                if questions:
+                    greeting = "Ahla !" if user_info.get("curriculum", "Tunisien") == "Tunisien" else "Bonjour !"
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": f"{greeting} On commence le diagnostic : 10 questions sur **{chap}**.\n\n"
+                                   + format_question(1, questions[0]),
+                    })
+                save_checkpoint()
+                rerun_fragment()
         return 
 
-    # 4. Display Messages
-    for m in st.session_state.messages:
+    # 4. Display Messages (older turns stay in the spill file unless the student asks for them)
+    transcript = st.session_state.messages
+    shown = transcript.recent()
+    if transcript.spilled and st.toggle(f"Afficher les {transcript.spilled} messages précédents", key="show_older_messages"):
+        shown = transcript.to_list()
+    for m in shown:
         with st.chat_message(m["role"]): 
             st.markdown(m["content"])
 
@@ -699,121 +1069,484 @@ def show_chat_diagnose():
         
         with st.chat_message("assistant"):
             try:
-                system_instruction = get_ai_system_prompt()
-                
-                messages_for_groq = [{"role": "system", "content": system_instruction}]
-                for m in st.session_state.messages:
-                    messages_for_groq.append({"role": m["role"], "content": m["content"]})
-
-                if st.session_state.q_count == 1:
-                    messages_for_groq.append({
-                        "role": "system", 
-                        "content": f"L'élève a choisi '{st.session_state.current_chapter}'. Salue-le brièvement et pose la Question 1."
-                    })
-
-                chat_completion = groq_client.chat.completions.create(
-                    messages=messages_for_groq,
-                    model="llama-3.1-8b-instant", 
-                )
-                
-                ai_text = chat_completion.choices[0].message.content
+                questions = get_diagnostic_questions()
+                if questions:
+                    # Question from the bank: the LLM only evaluates the answer
+                    question = questions[st.session_state.q_count - 1]
+                    ai_text = evaluate_bank_answer(question, prompt)
+                    record_mastery(ai_text, P_GUESS_QCM if question["type"] == "qcm" else P_GUESS_OPEN)
+                else:
+                    ai_text = live_tutor_reply()
+                    # From the second turn on, the reply starts by evaluating the previous answer
+                    if st.session_state.q_count > 1:
+                        record_mastery(ai_text, P_GUESS_OPEN)
                 st.session_state.q_count += 1
 
                 if st.session_state.q_count > 10:
-                    ai_text += "\n\n**Diagnostic terminé !** Ton plan de révision est prêt dans l'onglet 'Plans'."
-                    st.session_state.user_data["plan_ready"] = True
+                    done_text = "\n\n**Diagnostic terminé !** Ton plan de révision est en préparation dans l'onglet 'Plans'."
+                    # Only the closing line is rendered here, the reply is already on screen
+                    st.markdown(done_text)
+                    ai_text += done_text
+                    save_profile(plan_ready=True)
+                    record_diagnostic_completion(ai_text)
                     st.session_state.diag_step = "finished"
+                elif questions:
+                    next_question = "\n\n" + format_question(st.session_state.q_count, questions[st.session_state.q_count - 1])
+                    st.markdown(next_question)
+                    ai_text += next_question
 
-                st.markdown(ai_text)
+                # The final text is stored once, after the stream is complete
                 st.session_state.messages.append({"role": "assistant", "content": ai_text})
-                st.rerun()
+                save_checkpoint()
+                if st.session_state.diag_step == "finished":
+                    enqueue_plan_job()
+                rerun_fragment()
 
             except Exception as e:
-                st.error(f"Erreur avec Groq : {e}")
+                # Groq and Gemini both failed (retries and failover are done by the router)
+                st.error(f"Erreur avec l'AI Professor : {e}")
+
+def get_diagnostic_questions():
+    # [] when the bank has no entry for the chapter (live questions). Drawn per student, so
+    # that a resumed diagnostic goes on with the same questions.
+    profile = get_prompt_profile()
+    chapter = st.session_state.get("current_chapter")
+    if not chapter or question_bank is None:
+        return []
+    return question_bank.draw(
+        profile["curriculum"], profile["branch"], profile["subject"], chapter,
+        difficulty_for(profile["student_level"]),
+        seed=st.session_state.user_data.get("email", ""),
+    )
+
+def evaluate_bank_answer(question, answer):
+    # A QCM answered with a letter (or the text of a choice) is graded here, instantly
+    choice = match_choice(question, answer)
+    # Otherwise the same answer (case, accents and punctuation aside) may already have been evaluated
+    scope = evaluation_scope(question) if choice is None else None
+    cached_text = answer_cache.get(scope, answer) if scope else None
+
+    with metrics.timer("chat_reply_seconds", source="answer_cache" if cached_text is not None else "bank"):
+        if choice is not None:
+            ai_text = choice_feedback(question, choice)
+            st.markdown(ai_text)
+            return ai_text
+        if cached_text is not None:
+            st.markdown(cached_text)
+            return cached_text
+
+        messages = evaluation_messages(get_evaluation_prompt(), question, answer)
+        show_queue_wait(messages)
+        if STREAM_REPLIES:
+            ai_text = st.write_stream(llm_router.stream(messages, max_tokens=EVALUATION_MAX_TOKENS))
+        else:
+            ai_text = llm_router.complete(messages, max_tokens=EVALUATION_MAX_TOKENS)
+            st.markdown(ai_text)
+
+    # An empty reply (stream cut, blocked answer) is shown once, never served to other students
+    if (ai_text or "").strip():
+        answer_cache.put(scope, answer, ai_text)
+    return ai_text
+
+def evaluation_scope(question):
+    # Evaluations are shared within one question of one programme (the tone of the tutor
+    # depends on the curriculum). Everything get_evaluation_prompt uses is part of the scope.
+    profile = get_prompt_profile()
+    return make_scope(
+        TUTOR_PROMPT_VERSION, profile["curriculum"], profile["branch"], profile["subject"],
+        st.session_state.current_chapter, question["id"],
+    )
+
+def live_tutor_reply():
+    # No bank entry for this chapter: the tutor evaluates and writes the next question in one reply.
+    # The first turn is shared by the students of a profile (see first_turn_cache_key): its prompt
+    # leaves out what is personal to one of them
+    first_turn = st.session_state.q_count == 1
+    system_instruction = get_ai_system_prompt(personal=not first_turn)
+
+    extra_instruction = None
+    if first_turn:
+        extra_instruction = f"L'élève a choisi '{st.session_state.current_chapter}'. Salue-le brièvement et pose la Question 1."
+
+    # Bounded prompt: system prompt + rolling summary + last turns (+ Question 1 injection)
+    if "chat_context" not in st.session_state:
+        st.session_state.chat_context = ConversationContext()
+    messages_for_groq = st.session_state.chat_context.build(
+        system_instruction,
+        st.session_state.messages,
+        extra_system=extra_instruction,
+        summarizer=summarize_turns,
+    )
+
+    # The first turn ("greet and ask Question 1") only depends on the profile and the chapter
+    cache_key = first_turn_cache_key() if first_turn else None
+    cached_text = response_cache.get(cache_key) if cache_key else None
+
+    if cached_text is None:
+        show_queue_wait(messages_for_groq)
+
+    # Time until the whole reply is on screen (LLM latency/TTFT per provider are recorded by the router)
+    with metrics.timer("chat_reply_seconds", source="cache" if cached_text is not None else "llm"):
+        if cached_text is not None:
+            ai_text = cached_text
+            st.markdown(ai_text)
+        elif STREAM_REPLIES:
+            # Tokens are painted as they arrive; write_stream returns the full text.
+            # First turns of the same profile and chapter share one call (same key as the cache).
+            ai_text = st.write_stream(llm_router.stream(messages_for_groq, coalesce_key=cache_key))
+        else:
+            ai_text = llm_router.complete(messages_for_groq, coalesce_key=cache_key)
+            st.markdown(ai_text)
+
+    if cache_key and cached_text is None:
+        response_cache.put(cache_key, ai_text)
+    return ai_text
+
+def record_mastery(ai_text, guess):
+    # The verdict (✅ / 🟡 / ❌) the evaluation starts with updates the chapter locally, in O(1)
+    score = verdict_score(ai_text)
+    if score is None:
+        return
+    model = get_mastery_model()
+    if model.observe(st.session_state.selected_subject, st.session_state.current_chapter, score, guess) is None:
+        return
+    # Saved as {"subject::chapter": mastery}, read back by the revision scheduler
+    mastery, answers = model.to_profile()
+    save_profile(chapter_mastery=mastery, chapter_answers=answers)
+
+def record_diagnostic_completion(last_reply):
+    # Analytics: the chapter's mastery at the end of the diagnostic, not the transcript. The
+    # model's answer count covers every diagnostic of the chapter; only the answers graded in this
+    # one are recorded: the replies with a verdict, read back from the transcript (a resumed
+    # diagnostic included) plus the last one, not appended yet
+    subject = st.session_state.selected_subject
+    chapter = st.session_state.current_chapter
+    mastery, _ = get_mastery_model().estimate(subject, chapter)
+    if mastery is None:
+        return
+    replies = [m["content"] for m in st.session_state.messages if m["role"] == "assistant"] + [last_reply]
+    answers = sum(1 for reply in replies if verdict_score(reply) is not None)
+    record_analytics(lambda: analytics.record_diagnostic(*library_profile(), subject, chapter, mastery, answers))
+
+def record_analytics(record):
+    # Best effort: a failing analytics store never blocks onboarding or the end of a diagnostic
+    if analytics is None:
+        return
+    try:
+        record()
+    except Exception as e:
+        metrics.incr("errors_total", where="analytics", error=type(e).__name__)
+
+def show_queue_wait(messages):
+    # Rush hour (a whole class answering at once): the reply waits in the shared Groq queue.
+    # Beyond max_wait the router answers with Gemini instead, so no wait is announced.
+    wait = groq_limiter.estimate_wait(request_cost(messages))
+    if 1 <= wait <= groq_limiter.max_wait:
+        st.caption(f"⏳ Beaucoup d'élèves en ligne : réponse dans ~{round(wait)} s")
+
+def sync_session_state():
+    # Only the keys changed since the last run are queued, the store is written in the background
+    try:
+        if session_sync is not None:
+            session_sync.capture(session_id, st.session_state)
+    except Exception:
+        pass
+
+def rerun_fragment():
+    # scope="fragment" is only valid during a fragment rerun; the first render of the
+    # fragment happens inside a full run (and AppTest always does full runs).
+    # A fragment rerun skips the router, so the changed state is synced here.
+    sync_session_state()
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def summarize_turns(previous_summary, turns):
+    # Incremental: only the turns that just left the window are sent, with the previous summary
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+    return llm_router.complete(
+        [
+            {"role": "system", "content": "Résume en quelques phrases l'échange entre un élève et son tuteur : chapitre, questions posées, réponses de l'élève, erreurs repérées. Réponds uniquement par le résumé."},
+            {"role": "user", "content": f"Résumé actuel :\n{previous_summary or '(vide)'}\n\nNouveaux échanges :\n{transcript}"},
+        ],
+        max_tokens=300,
+    )
 
 def show_view_plan():
     st.markdown("## 📅 Votre Plan de Révision")
     st.write("Voici votre programme personnalisé basé sur le diagnostic.")
     
+    # 1. Planning jour par jour, calculé localement (niveaux + résultats des diagnostics)
+    scheduler = show_revision_schedule()
+    show_weak_chapters(5)
+
+    # 2. Plans rédigés par l'IA après chaque diagnostic
     # Optional: Check if the user actually has a plan
     if st.session_state.user_data.get("plan_ready"):
-        st.success("Votre plan est prêt ! Voici vos prochaines étapes...")
-        # You can add more details here later
+        plan_jobs = latest_plan_jobs()
+        if any(job["status"] in ACTIVE for job in plan_jobs):
+            plan_jobs_panel()
+        else:
+            show_plan_jobs(plan_jobs)
     else:
         st.info("Complétez un diagnostic avec l'AI Professor pour générer votre plan.")
 
+    # 3. Export PDF (planning complet + plans rédigés)
+    show_plan_download(scheduler)
+
     if st.button("← Retour au Dashboard", use_container_width=True):
         st.session_state.step = "dashboard"
         st.rerun()
 
-def get_ai_system_prompt():
+def default_exam_date():
+    # The Bac starts in June; after mid-June we plan for next year's session
+    today = datetime.date.today()
+    exam = datetime.date(today.year, 6, 10)
+    return exam if exam > today else datetime.date(today.year + 1, 6, 10)
+
+def get_revision_scheduler(exam_date):
+    # Kept in the session: after the first build only the subjects whose inputs changed are re-placed.
+    # It lives in the session cache, which is dropped when the session goes idle (rebuilt on return).
+    today = datetime.date.today()
+    cache = st.session_state.session_handle.cache
+    scheduler = cache.get("revision_scheduler")
+    if scheduler is None or scheduler.start_date != today or scheduler.exam_date != exam_date:
+        scheduler = RevisionScheduler(today, exam_date)
+        cache["revision_scheduler"] = scheduler
+
+    user_info = st.session_state.user_data
+    subjects = get_student_chapters()
+    # Diagnostic results are stored as {"subject::chapter": mastery}
+    mastery = {
+        tuple(key.split("::", 1)): value
+        for key, value in user_info.get("chapter_mastery", {}).items()
+    }
+    scheduler.sync(subjects, user_info.get("levels", {}), mastery)
+    return scheduler
+
+def get_student_chapters():
+    # {subject: chapters} of the student's programme; subjects without a chapter list get one pseudo-chapter
+    curriculum, branch = library_profile()
+    return {
+        sub: catalog.chapters(curriculum, branch, sub) or ("Révision générale",)
+        for sub in get_full_subject_list()
+    }
+
+def get_mastery_model():
+    # Kept in the session cache like the scheduler; rebuilt from the profile when the cache
+    # was dropped or when the programme or the self-assessed levels changed
+    user_info = st.session_state.user_data
+    levels = user_info.get("levels", {})
+    signature = (library_profile(), tuple(get_full_subject_list()), tuple(sorted(levels.items())))
+    cache = st.session_state.session_handle.cache
+    cached = cache.get("mastery_model")
+    if cached is None or cached[0] != signature:
+        model = MasteryModel.from_profile(
+            get_student_chapters(),
+            lambda sub: LEVEL_MASTERY.get(levels.get(sub), LEVEL_MASTERY["Satisfaisant"]),
+            user_info.get("chapter_mastery"),
+            user_info.get("chapter_answers"),
+        )
+        cached = cache["mastery_model"] = (signature, model)
+    return cached[1]
+
+def show_weak_chapters(k):
+    # Chapters already evaluated in a diagnostic, least mastered first
+    weakest = get_mastery_model().weakest(k)
+    if not weakest:
+        return
+    st.markdown("#### 🎯 Chapitres à retravailler")
+    for subject, chapter, mastery in weakest:
+        st.progress(mastery, text=f"{catalog.emoji(subject)} {subject} — {chapter} : {mastery:.0%}")
+
+def show_revision_schedule():
+    if not st.session_state.user_data.get("levels"):
+        return None
+    exam_date = st.date_input("Date de l'examen", value=default_exam_date(), key="exam_date")
+    scheduler = get_revision_scheduler(exam_date)
+
+    kind_icons = {"apprentissage": "📖", "rappel": "🔁"}
+    with st.expander("🗓️ Mes 7 prochains jours", expanded=True):
+        for day, sessions in scheduler.plan(days=7):
+            st.markdown(f"**{day.strftime('%d/%m')}**")
+            if not sessions:
+                st.caption("Repos")
+            for subject, chapter, kind in sessions:
+                st.markdown(f"- {kind_icons[kind]} {catalog.emoji(subject)} {subject} — {chapter}")
+    return scheduler
+
+def latest_plan_jobs():
+    # [] when the job queue is not set up: the page still shows the local schedule
+    email = st.session_state.user_data.get("email")
+    try:
+        return job_queue.latest_by_owner(email, kind=PLAN_JOB) if email else []
+    except Exception:
+        return []
+
+def show_plan_download(scheduler):
+    user_info = st.session_state.user_data
+    plan_jobs = latest_plan_jobs()
+    plans = [job["result"] for job in plan_jobs if job["status"] == "done"]
+    # No renderer (see optional_component): the plan stays on the page, without its PDF
+    if pdf_renderer is None or (scheduler is None and not plans):
+        return
+
+    document = plan_document(
+        {
+            "curriculum": user_info.get("curriculum"),
+            "branch": user_info.get("bac_type") or user_info.get("fr_serie") or user_info.get("fr_voie"),
+        },
+        scheduler.exam_date if scheduler else None,
+        scheduler.plan() if scheduler else [],
+        plans,
+    )
+    # The PDF is built on click (on Streamlit's download thread), not on every rerun of the page;
+    # the same plan is served from the renderer's cache, whoever downloads it
+    st.download_button(
+        "📄 Télécharger mon plan (PDF)",
+        data=lambda: pdf_renderer.stream(document),
+        file_name="plan_de_revision.pdf",
+        mime="application/pdf",
+        on_click="ignore",
+        use_container_width=True,
+    )
+
+@st.fragment(run_every=2)
+@metrics.timed("fragment_render_seconds", fragment="plan_jobs_panel")
+def plan_jobs_panel():
+    # Polls the job table every 2 s while a plan is queued or running; only this block reruns,
+    # generation happens on the workers
+    plan_jobs = latest_plan_jobs()
+    if not any(job["status"] in ACTIVE for job in plan_jobs):
+        # Every plan is finished: one full run shows them (and the PDF) without polling
+        st.rerun()
+    show_plan_jobs(plan_jobs)
+
+def show_plan_jobs(plan_jobs):
+    if not plan_jobs:
+        st.info("Aucun plan en cours de génération.")
+        return
+
+    for job in plan_jobs:
+        subject = job["payload"]["profile"]["subject"]
+        if job["status"] in ACTIVE:
+            st.progress(job["progress"], text=f"{subject} : {job['message'] or 'En attente'}…")
+        elif job["status"] == "done":
+            plan = job["result"]
+            with st.expander(f"✅ {plan['subject']} — {plan['chapter']} ({plan['generated_at']})"):
+                st.markdown(plan["markdown"])
+        else:
+            st.error(f"La génération du plan de {subject} a échoué.")
+            if st.button("Relancer", key=f"retry_{job['id']}"):
+                job_queue.retry(job["id"])
+                st.rerun()  # queued again: the page polls until it is done
+
+def enqueue_plan_job():
+    # Called when the diagnostic ends: the plan is written by a background worker
+    email = st.session_state.user_data.get("email")
+    if not email:
+        return
+    job_queue.enqueue(
+        PLAN_JOB,
+        {
+            "profile": get_prompt_profile(),
+            "chapter": st.session_state.get("current_chapter"),
+            "messages": [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
+        },
+        owner=email,
+        dedupe_key=plan_dedupe_key(email, st.session_state.selected_subject),
+    )
+
+def get_prompt_profile():
     # 1. Pull data from the session
     data = st.session_state.get("user_data", {})
     subject = st.session_state.get("selected_subject", "Matière générale")
     
-    # 2. Extract specific profile details
-    curriculum = data.get("curriculum", "Inconnu")
-    level = data.get("fr_level", "")
-    
-    # Get the branch (handles both Tunisian and French logic)
-    branch = data.get("bac_type") or data.get("fr_serie", data.get("fr_voie", "Générale"))
+    # 2. Get the student's specific level for this subject
+    subject_levels = data.get("levels", {})
+
+    return {
+        "curriculum": data.get("curriculum", "Inconnu"),
+        "level": data.get("fr_level", ""),
+        # Get the branch (handles both Tunisian and French logic)
+        "branch": data.get("bac_type") or data.get("fr_serie", data.get("fr_voie", "Générale")),
+        "subject": subject,
+        "student_level": subject_levels.get(subject, "Satisfaisant"),
+    }
+
+def first_turn_cache_key():
+    # Everything the first-turn prompt uses: get_ai_system_prompt(personal=False) has neither the
+    # philosophy nor the mastery estimate of the student
+    return make_cache_key(
+        "first_turn",
+        TUTOR_PROMPT_VERSION,
+        chapter=st.session_state.get("current_chapter"),
+        **get_prompt_profile(),
+    )
+
+def get_ai_system_prompt(personal=True):
+    # personal=False: the prompt of the first turn, shared by every student of the same profile
+    # (the philosophy and the mastery estimate of one student are left out)
+    # 1. Extract specific profile details
+    profile = get_prompt_profile()
+    curriculum = profile["curriculum"]
+    level = profile["level"]
+    branch = profile["branch"]
+    subject = profile["subject"]
+    student_level = profile["student_level"]
     
     # Use the custom philosophy the user wrote during signup
-    philosophy = data.get("philosophy", "Sois un tuteur bienveillant.")
-    
-    # 3. Get the student's specific level for this subject
-    subject_levels = data.get("levels", {})
-    student_level = subject_levels.get(subject, "Satisfaisant")
+    data = st.session_state.get("user_data", {})
+    philosophy = data.get("philosophy", "Sois un tuteur bienveillant.") if personal else None
 
-    # 4. Build the Instruction String
+    # 2. Build the Instruction String
     prompt = f"Tu es 'AI Professor', un tuteur expert pour le système {curriculum}. "
     prompt += f"L'élève est en classe de {level} {branch}. "
     prompt += f"Sa matière actuelle est {subject}, et son niveau auto-évalué est '{student_level}'. "
-    prompt += f"PHILOSOPHIE PERSONNALISÉE DE L'ÉLÈVE : '{philosophy}'. "
+    # Estimate of the mastery engine (the level's prior until the first graded answer)
+    chapter = st.session_state.get("current_chapter")
+    mastery, answers = get_mastery_model().estimate(subject, chapter) if chapter and personal else (None, 0)
+    if mastery is not None:
+        basis = f"d'après {answers} réponses évaluées" if answers else "d'après son niveau"
+        prompt += f"Maîtrise estimée du chapitre '{chapter}' : {mastery:.0%} ({basis}), adapte la difficulté. "
+    if philosophy:
+        prompt += f"PHILOSOPHIE PERSONNALISÉE DE L'ÉLÈVE : '{philosophy}'. "
+    else:
+        prompt += "Sois bienveillant. "
     prompt += "CONSIGNES : 1. Ne donne jamais la réponse directement. "
     prompt += "2. Guide l'élève par le raisonnement et des indices. "
+    prompt += "3. Quand tu évalues une réponse, commence par ✅ (juste), 🟡 (partiellement juste) ou ❌ (faux). "
     
     # Specific instruction for Tunisian students
     if curriculum == "Tunisien":
-        prompt += "3. Puisque le système est Tunisien, utilise parfois des mots en 'Tunsi' (Derja) pour créer un lien de proximité."
+        prompt += "4. Puisque le système est Tunisien, utilise parfois des mots en 'Tunsi' (Derja) pour créer un lien de proximité."
     
     return prompt
 
+def get_evaluation_prompt():
+    # Tutor prompt of the bank evaluations, which are shared between the students of a scope
+    # (see evaluation_scope): the philosophy, the self-assessed level and the mastery estimate
+    # of one student are left out
+    profile = get_prompt_profile()
+    prompt = f"Tu es 'AI Professor', un tuteur expert pour le système {profile['curriculum']}. "
+    prompt += f"L'élève est en {profile['branch']}, matière {profile['subject']}. "
+    prompt += "Sois bienveillant et guide l'élève par le raisonnement."
+    if profile["curriculum"] == "Tunisien":
+        prompt += " Utilise parfois des mots en 'Tunsi' (Derja) pour créer un lien de proximité."
+    return prompt
+
 def get_chapters_by_subject(curriculum, branch, subject):
     """
-    Official 2024-2025 Tunisian Bac Curriculum Database.
-    Section: Économie et Gestion
+    Chapters come from catalog.json (official 2024-2025 programmes).
+    Only the Tunisian Bac Économie et Gestion is filled in for now.
     """
-    # 1. Official Data for Bac Économie & Gestion
-    bac_eco_gestion = {
-        "Gestion": [
-            "Thème 1 : Gestion des Approvisionnements (Stocks & Valorisation)",
-            "Thème 2 : Gestion de la Production (Plein emploi & Coûts)",
-            "Thème 3 : Gestion Commerciale (Marketing Mix & Ventes)",
-            "Thème 4 : Gestion des Ressources Humaines (Paie & Recrutement)",
-            "Thème 5 : Analyse de la Performance (SIG & CAF)",
-            "Thème 5 : Analyse de la Rentabilité (Seuil de rentabilité)",
-            "Thème 6 : Gestion de l'Investissement (VAN, DRCI, IP)",
-            "Thème 6 : Gestion du Financement (Emprunts & Plan de financement)",
-            "Thème 7 : Analyse Fonctionnelle du Bilan (FRNG, BFR, TN)",
-            "Thème 7 : Gestion Budgétaire (Trésorerie & Ventes)"
-        ],
-        "Économie": [
-            "Thème 1 : La Croissance Économique (Sources & Facteurs)",
-            "Thème 1 : Les Mutations des Structures Économiques",
-            "Thème 2 : L'Ouverture sur l'Extérieur",
-            "Thème 2 : La Mondialisation (Échanges & Firmes)",
-            "Thème 3 : Le Développement Durable (Indicateurs & Enjeux)",
-            "Thème 3 : L'Intégration Économique (Ex: Zone Euro)"
-        ]
-    }
-
-    # 2. Accuracy Logic
+    # 1. Accuracy Logic
     # We must match the exact string the user chose during signup
-    if curriculum == "Tunisien" and branch == "Sciences Économiques et Gestion":
-        return bac_eco_gestion.get(subject, ["Chapitre non répertorié"])
+    if catalog.has_chapters(curriculum, branch):
+        return list(catalog.chapters(curriculum, branch, subject)) or ["Chapitre non répertorié"]
     
-    # 3. Dynamic Fallback (If logic fails, we return a clear message)
+    # 2. Dynamic Fallback (If logic fails, we return a clear message)
     return ["Veuillez vérifier votre profil (Bac Eco-Gestion requis)"]
 
 
@@ -838,6 +1571,8 @@ pages = {
     "subject_hub": show_subject_hub, 
     "chat_diagnose": show_chat_diagnose,
     "view_plan": show_view_plan,
+    "summaries": show_summaries,
+    "exercises": show_exercises,
 }
 
 # 1. Get the current step safely (defaults to "landing" if not set)
@@ -845,8 +1580,13 @@ current_step = st.session_state.get("step", "landing")
 
 # 2. Check if the current step exists in our mapping
 if current_step in pages:
-    # 3. Call the function associated with the step
-    pages[current_step]()
+    # 3. Call the function associated with the step (render time and reruns recorded per step)
+    with metrics.timer("page_render_seconds", counter="page_runs_total", step=current_step):
+        try:
+            pages[current_step]()
+        finally:
+            # Also on st.rerun(): the new step is in the store before the next run starts
+            sync_session_state()
 else:
     # 4. Fallback UI if a step is misspelled or missing
     st.error(f"⚠️ Erreur de navigation : L'étape '{current_step}' est introuvable.")
@@ -855,3 +1595,7 @@ else:
     if st.button("Retour à l'accueil", use_container_width=True):
         st.session_state.step = "landing"
         st.rerun()
+
+# 5. The page is on screen: providers can be warmed up in the background
+if st.secrets.get("WARMUP_PROVIDERS", False):
+    start_warm_up()
@@ -0,0 +1,470 @@
+"""
+Headless benchmark of every page of the router (app.py), with Streamlit's AppTest and a
+local stub LLM server.
+
+    python bench/run.py                     # compare with bench/baseline.json, exit 1 on regression
+    python bench/run.py --update-baseline   # store the current numbers as the new baseline
+    python bench/run.py --ttft-ms 800 --chunk-ms 30 --repeat 5
+
+Reported per page (router step active when the rerun starts): median rerun time and peak
+memory allocated during a rerun (tracemalloc, measured on a separate pass so that it does not
+inflate the timings). Reported per flow: total time and LLM calls received by the stub.
+
+Only the signals that do not depend on the machine fail the run: more LLM calls in a flow, or a
+larger peak allocation on a page. Rerun times are first scaled by the median ratio of all the
+pages to their baseline, which absorbs the speed difference between machines: a page only
+stands out when it got slower than the others. A slower page is reported, never a failure. The committed timings come from one machine: refresh the baseline on yours
+(--update-baseline) before reading them closely.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP = BENCH_DIR.parent / "app.py"
+BASELINE = BENCH_DIR / "baseline.json"
+
+sys.path.insert(0, str(BENCH_DIR))
+from stub_llm import StubLLM    # noqa: E402
+
+DEFAULT_REPEAT = 3
+TIME_TOLERANCE = 0.30       # +30 % of the baseline median...
+TIME_FLOOR_MS = 10.0        # ...and at least +10 ms before a page counts as slower
+ALLOC_TOLERANCE = 0.30
+ALLOC_FLOOR_KB = 256.0
+PLAN_TIMEOUT = 30.0         # seconds to wait for the background plan job
+
+
+# --- DRIVER ---
+
+class Driver:
+    """
+    One browser session. Every rerun is timed (and measured by tracemalloc on the traced pass)
+    under the router step that was active when it started.
+    """
+
+    def __init__(self, report, secrets, traced):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(str(APP), default_timeout=60)
+        for key, value in secrets.items():
+            self.at.secrets[key] = value
+        self.report = report
+        self.traced = traced
+
+    @property
+    def step(self):
+        return self.at.session_state["step"] if "step" in self.at.session_state else "landing"
+
+    def run(self, action=None, record=True):
+        page = self.step
+        if self.traced:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        (action() if action else self.at).run()
+        elapsed = (time.perf_counter() - started) * 1000
+        if self.at.exception:
+            raise RuntimeError(f"{page}: {self.at.exception[0].value}")
+        if record:
+            if self.traced:
+                self.report.alloc(page, (tracemalloc.get_traced_memory()[1] - before) / 1024)
+            else:
+                self.report.time(page, elapsed)
+        return self.at
+
+    def button(self, label):
+        for button in self.at.button:
+            if label in button.label:
+                return button
+        raise LookupError(f"{self.step}: no button '{label}' in {[b.label for b in self.at.button]}")
+
+    def click(self, label, record=True):
+        return self.run(lambda: self.button(label).click(), record=record)
+
+    def expect(self, step):
+        if self.step != step:
+            raise AssertionError(f"expected step '{step}', got '{self.step}'")
+
+
+# --- FLOWS ---
+
+def flow_landing(d, n):
+    d.run()
+    d.click("S'inscrire")
+    d.click("Retour")
+    d.click("Se connecter")
+    d.click("Retour")
+    d.expect("landing")
+
+
+def signup(d, email):
+    d.click("S'inscrire")
+    d.at.text_input(key="signup_email").input(email)
+    d.at.text_input(key="signup_pwd").input("motdepasse")
+    d.at.text_input(key="signup_pwd_conf").input("motdepasse")
+    d.click("Créer mon compte")
+    d.expect("curriculum_selection")
+
+
+def flow_signup(d, n):
+    d.run()
+    d.click("S'inscrire")
+    # Every validation error at once, then an email that is already taken, then a valid form
+    d.at.text_input(key="signup_email").input("pas-un-email")
+    d.at.text_input(key="signup_pwd").input("court")
+    d.at.text_input(key="signup_pwd_conf").input("autre")
+    d.click("Créer mon compte")
+    d.at.text_input(key="signup_email").input("test@taki.com")
+    d.at.text_input(key="signup_pwd").input("motdepasse")
+    d.at.text_input(key="signup_pwd_conf").input("motdepasse")
+    d.click("Créer mon compte")
+    d.expect("signup")
+    d.at.text_input(key="signup_email").input(f"bench.signup{n}@taki.com")
+    d.click("Créer mon compte")
+    d.expect("curriculum_selection")
+
+
+def flow_login(d, n):
+    d.run()
+    d.click("Se connecter")
+    d.at.text_input(key="login_email").input("test@taki.com")
+    d.at.text_input(key="login_pwd").input("mauvais")
+    d.click("Se connecter")
+    d.expect("login")
+    d.at.text_input(key="login_pwd").input("password123")
+    d.click("Se connecter")
+    d.expect("dashboard")
+
+
+def finish_onboarding(d):
+    d.expect("level_audit")
+    d.click("Confirmer mon profil")
+    d.expect("philosophy")
+    d.run(lambda: d.at.text_area(key="philosophy_area").input("Explique-moi chaque notion avec un exemple concret, puis laisse-moi essayer seul avant de corriger."))
+    d.click("Confirmer et accéder au Dashboard")
+    d.expect("dashboard")
+
+
+def flow_onboarding_tn(d, n):
+    d.run()
+    signup(d, f"bench.tn{n}@taki.com")
+    d.click("Baccalauréat Tunisien")
+    d.click("Sciences Économiques et Gestion")
+    d.expect("option_selection")
+    d.click("Allemand")
+    finish_onboarding(d)
+
+
+def flow_onboarding_fr_techno(d, n):
+    # Première STI2D: the longest subject list of the catalog in the level audit
+    d.run()
+    signup(d, f"bench.sti2d{n}@taki.com")
+    d.click("Baccalauréat Français")
+    d.click("Première")
+    d.click("Voie Technologique")
+    d.click("STI2D")
+    finish_onboarding(d)
+
+
+def flow_onboarding_fr_general(d, n):
+    d.run()
+    signup(d, f"bench.gen{n}@taki.com")
+    d.click("Baccalauréat Français")
+    d.click("Première")
+    d.click("Voie Générale")
+    d.expect("fr_specialites_selection")
+    checkboxes = list(d.at.checkbox)
+    checkboxes[0].check()
+    d.click("Confirmer mes spécialités")     # one only: validation error
+    d.expect("fr_specialites_selection")
+    checkboxes = list(d.at.checkbox)
+    checkboxes[1].check()
+    checkboxes[2].check()
+    d.click("Confirmer mes spécialités")
+    finish_onboarding(d)
+
+
+def flow_dashboard(d, n):
+    d.run()
+    d.click("Se connecter")
+    d.at.text_input(key="login_email").input("test@taki.com")
+    d.at.text_input(key="login_pwd").input("password123")
+    d.click("Se connecter")
+    d.click("Abonnement")
+    d.expect("subscription")
+    d.click("Retour au Dashboard")
+    d.click("AI Professor")
+    d.expect("subject_hub")
+    d.click("Dashboard")
+    d.click("Déconnexion")
+    d.expect("landing")
+
+
+def onboarding_seg(d, email):
+    # Sciences Économiques et Gestion: the branch of the question bank and library fixtures
+    d.run()
+    signup(d, email)
+    d.click("Baccalauréat Tunisien")
+    d.click("Sciences Économiques et Gestion")
+    d.click("Allemand")
+    finish_onboarding(d)
+
+
+def browse_library(d, kind):
+    # To the other Gestion chapter of the library fixture, then back (served from the app's cache)
+    chapters = d.at.selectbox(key=f"{kind}_chapter")
+    for chapter in reversed(chapters.options):
+        d.run(lambda: d.at.selectbox(key=f"{kind}_chapter").set_value(chapter))
+        if not any(m.value.startswith("###") for m in d.at.markdown):
+            raise AssertionError(f"{kind}: nothing shown for {chapter}")
+
+
+def flow_summaries(d, n):
+    onboarding_seg(d, f"bench.resume{n}@taki.com")
+    d.click("Résumés")
+    d.expect("summaries")
+    browse_library(d, "resume")
+    d.click("Retour au Dashboard")
+    d.expect("dashboard")
+
+
+def flow_exercises(d, n):
+    onboarding_seg(d, f"bench.exos{n}@taki.com")
+    d.click("Exercices")
+    d.expect("exercises")
+    browse_library(d, "exercices")
+    if not d.at.expander:
+        raise AssertionError("no solutions expander on the exercises page")
+    d.click("Retour au Dashboard")
+    d.expect("dashboard")
+
+
+def flow_chat_diagnose(d, n):
+    onboarding_seg(d, f"bench.chat{n}@taki.com")
+    d.click("AI Professor")
+    d.click("Gestion")
+    d.expect("chat_diagnose")
+    d.click("Thème 1")
+    for turn in range(10):
+        # QCM from the question bank: answered with a letter (graded without the LLM)
+        last = d.at.session_state["messages"][-1]["content"]
+        answer = "B" if "Réponds par la lettre" in last else f"Réponse de l'élève au tour {turn + 1}"
+        d.run(lambda: d.at.chat_input[0].set_value(answer))
+        if d.at.error:
+            raise RuntimeError(f"chat turn {turn + 1}: {d.at.error[0].value}")
+    if d.at.session_state["diag_step"] != "finished":
+        raise AssertionError("the diagnostic did not finish after 10 turns")
+
+    d.at.session_state["step"] = "dashboard"
+    d.run(record=False)
+    d.click("Plans")
+    d.expect("view_plan")
+    # The plan is written by a background worker: poll (not timed) until it is there
+    deadline = time.monotonic() + PLAN_TIMEOUT
+    while not any(e.label.startswith("✅") for e in d.at.expander):
+        if time.monotonic() > deadline:
+            raise TimeoutError("the revision plan job did not finish")
+        time.sleep(0.2)
+        d.run(record=False)
+    d.run()     # plan page with the finished plan and the PDF button
+    if not d.at.get("download_button"):
+        raise AssertionError("no PDF download button on the plan page")
+
+
+FLOWS = {
+    "landing": flow_landing,
+    "signup": flow_signup,
+    "login": flow_login,
+    "onboarding_tn": flow_onboarding_tn,
+    "onboarding_fr_techno": flow_onboarding_fr_techno,
+    "onboarding_fr_general": flow_onboarding_fr_general,
+    "dashboard": flow_dashboard,
+    "summaries": flow_summaries,
+    "exercises": flow_exercises,
+    "chat_diagnose": flow_chat_diagnose,
+}
+
+
+# --- REPORT ---
+
+class Report:
+    def __init__(self):
+        self.times = {}         # page -> [ms]
+        self.allocs = {}        # page -> [KB]
+        self.flows = {}         # flow -> {"total_ms": [...], "llm_calls": int}
+
+    def time(self, page, ms):
+        self.times.setdefault(page, []).append(ms)
+
+    def alloc(self, page, kb):
+        self.allocs.setdefault(page, []).append(kb)
+
+    def summary(self):
+        pages = {}
+        for page in sorted(set(self.times) | set(self.allocs)):
+            samples = self.times.get(page, [])
+            pages[page] = {
+                "reruns": len(samples),
+                "median_ms": round(statistics.median(samples), 1) if samples else None,
+                "max_ms": round(max(samples), 1) if samples else None,
+                "peak_kb": round(max(self.allocs.get(page, [0])), 1),
+            }
+        flows = {
+            name: {"median_ms": round(statistics.median(flow["total_ms"]), 1), "llm_calls": flow["llm_calls"]}
+            for name, flow in self.flows.items()
+        }
+        return {"pages": pages, "flows": flows}
+
+
+def run_benchmark(args):
+    stub = StubLLM(ttft=args.ttft_ms / 1000, chunk_delay=args.chunk_ms / 1000).start()
+    os.environ["GROQ_BASE_URL"] = stub.base_url
+    workdir = tempfile.mkdtemp(prefix="khirmintaki-bench-")
+    secrets = {
+        "GEMINI_API_KEY": "bench", "GROQ_API_KEY": "bench",
+        "SUPABASE_URL": "https://bench.supabase.co", "SUPABASE_KEY": "bench",
+        "ACCOUNTS_BACKEND": "memory", "TRANSCRIPTS_BACKEND": "memory",
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "SESSION_DB_PATH": os.path.join(workdir, "sessions.db"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "answer_cache.db"),
+        "ANALYTICS_DB_PATH": os.path.join(workdir, "analytics.db"),
+        # The Gestion chapter of the chat flow is served from this bank (see question_bank.py)
+        "QUESTION_BANK_PATH": str(BENCH_DIR / "question_bank.json"),
+        # Two Gestion chapters of the same branch for the Résumés and Exercices pages (see library.py)
+        "LIBRARY_DIR": str(BENCH_DIR / "library"),
+        # The limiter is not what is measured here: quotas far above what the flows use
+        "GROQ_RPM": 100_000, "GROQ_TPM": 100_000_000,
+        # No hedged requests to Gemini: every LLM call goes to the stub and is counted
+        "LLM_HEDGE_PERCENTILE": 0,
+    }
+    selected = args.flows or list(FLOWS)
+    report = Report()
+    try:
+        for name in selected:
+            totals = []
+            llm_calls = None
+            # Repeats 0..n-1 are timed, the extra last one is traced for allocations
+            for n in range(args.repeat + 1):
+                traced = n == args.repeat
+                if traced:
+                    tracemalloc.start()
+                calls_before = stub.total_calls()
+                started = time.perf_counter()
+                try:
+                    FLOWS[name](Driver(report, secrets, traced), n)
+                finally:
+                    if traced:
+                        tracemalloc.stop()
+                if not traced:
+                    totals.append((time.perf_counter() - started) * 1000)
+                if llm_calls is None:
+                    # First run: cold response cache, the number the baseline is compared with
+                    time.sleep(0.2)     # late background calls (plan job) are counted too
+                    llm_calls = stub.total_calls() - calls_before
+            report.flows[name] = {"total_ms": totals, "llm_calls": llm_calls}
+            print(f"  {name}: {statistics.median(totals):.0f} ms, {llm_calls} LLM calls", file=sys.stderr)
+    finally:
+        stub.stop()
+    result = report.summary()
+    result["config"] = {"repeat": args.repeat, "ttft_ms": args.ttft_ms, "chunk_ms": args.chunk_ms}
+    return result
+
+
+# --- BASELINE ---
+
+def speed_ratio(result, baseline):
+    # How much slower this machine is than the baseline's: the median over the pages of both
+    # runs, so that one slower page barely moves it
+    ratios = [
+        row["median_ms"] / baseline["pages"][page]["median_ms"]
+        for page, row in result["pages"].items()
+        if row["median_ms"] and baseline["pages"].get(page, {}).get("median_ms")
+    ]
+    return statistics.median(ratios) if ratios else 1.0
+
+
+def compare(result, baseline):
+    """
+    (regressions, slower): the first fail the run, the second are only reported.
+    """
+    regressions = []
+    slower = []
+    ratio = speed_ratio(result, baseline)
+    for page, current in result["pages"].items():
+        base = baseline["pages"].get(page)
+        if base is None:
+            continue
+        if current["median_ms"] is not None and base["median_ms"] is not None:
+            expected = base["median_ms"] * ratio
+            limit = max(expected * (1 + TIME_TOLERANCE), expected + TIME_FLOOR_MS)
+            if current["median_ms"] > limit:
+                slower.append(f"{page}: median rerun {current['median_ms']} ms > {limit:.1f} ms "
+                              f"(baseline x {ratio:.2f}, the speed of this machine)")
+        limit = max(base["peak_kb"] * (1 + ALLOC_TOLERANCE), base["peak_kb"] + ALLOC_FLOOR_KB)
+        if current["peak_kb"] > limit:
+            regressions.append(f"{page}: peak allocation {current['peak_kb']} KB > {limit:.0f} KB")
+    for flow, current in result["flows"].items():
+        base = baseline["flows"].get(flow)
+        if base is not None and current["llm_calls"] > base["llm_calls"]:
+            regressions.append(f"{flow}: {current['llm_calls']} LLM calls > {base['llm_calls']}")
+    return regressions, slower
+
+
+def format_report(result, baseline):
+    lines = [f"{'page':<26}{'reruns':>7}{'median ms':>11}{'max ms':>9}{'peak KB':>10}{'base ms':>9}"]
+    for page, row in result["pages"].items():
+        base = (baseline or {}).get("pages", {}).get(page, {})
+        lines.append(f"{page:<26}{row['reruns']:>7}{row['median_ms'] or 0:>11.1f}{row['max_ms'] or 0:>9.1f}"
+                     f"{row['peak_kb']:>10.1f}{base.get('median_ms') or 0:>9.1f}")
+    lines.append("")
+    lines.append(f"{'flow':<26}{'median ms':>11}{'LLM calls':>11}{'base calls':>12}")
+    for flow, row in result["flows"].items():
+        base = (baseline or {}).get("flows", {}).get(flow, {})
+        lines.append(f"{flow:<26}{row['median_ms']:>11.1f}{row['llm_calls']:>11}{base.get('llm_calls', '-'):>12}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("flows", nargs="*", help=f"flows to run (default: all): {', '.join(FLOWS)}")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="stub latency before the first chunk")
+    parser.add_argument("--chunk-ms", type=float, default=10.0, help="stub delay between two chunks")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", type=Path, default=Path("bench_output.txt"))
+    args = parser.parse_args()
+    unknown = [name for name in args.flows if name not in FLOWS]
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(unknown)}")
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else None
+    result = run_benchmark(args)
+    text = format_report(result, baseline)
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        text += f"\n\nBaseline written to {args.baseline}"
+        regressions = []
+    elif baseline is None:
+        text += "\n\nNo baseline yet: run with --update-baseline"
+        regressions = []
+    else:
+        regressions, slower = compare(result, baseline)
+        if slower:
+            text += "\n\n" + "\n".join(["Slower (reported only, timings depend on the machine):", *slower])
+        text += "\n\n" + ("\n".join(["REGRESSIONS:", *regressions]) if regressions else "No regression.")
+
+    print(text)
+    args.output.write_text(text + "\n", encoding="utf-8")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# --- STUB LLM SERVER ---
+# OpenAI-compatible /chat/completions endpoint (what the Groq SDK calls) replaying the
+# completions recorded in recordings.json, with a configurable latency: `ttft` seconds
+# before the first chunk, then `chunk_delay` seconds between chunks. Every request is counted.
+
+RECORDINGS = Path(__file__).with_name("recordings.json")
+
+
+class StubLLM:
+    def __init__(self, port=0, ttft=0.2, chunk_delay=0.01, recordings=RECORDINGS):
+        self.ttft = ttft
+        self.chunk_delay = chunk_delay
+        self.recordings = json.loads(Path(recordings).read_text(encoding="utf-8"))
+        self._lock = threading.Lock()
+        self.calls = {}         # kind -> number of requests
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    # 1. Which recording answers a request
+    def reply_for(self, messages):
+        system = " ".join(m["content"] for m in messages if m["role"] == "system")
+        if "Résume" in system:
+            kind, text = "summary", self.recordings["summary"]
+        elif "plan de révision personnalisé" in system:
+            kind, text = "plan", self.recordings["plan"]
+        elif "Tu corriges" in system:
+            evaluations = self.recordings["evaluation"]
+            with self._lock:
+                seen = self.calls.get("evaluation", 0)
+            kind, text = "evaluation", evaluations[seen % len(evaluations)]
+        else:
+            turns = sum(1 for m in messages if m["role"] == "user")
+            replies = self.recordings["tutor"]
+            kind, text = "tutor", replies[(turns - 1) % len(replies)]
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+        return text
+
+    # 2. HTTP
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                text = stub.reply_for(body["messages"])
+                time.sleep(stub.ttft)
+                if body.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    words = text.split(" ")
+                    for i, word in enumerate(words):
+                        chunk = {
+                            "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                            "choices": [{"index": 0, "delta": {"content": word if i == len(words) - 1 else word + " "},
+                                         "finish_reason": None}],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        time.sleep(stub.chunk_delay)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    return
+                payload = json.dumps({
+                    "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
@@ -0,0 +1,83 @@
+import functools
+import json
+from pathlib import Path
+from types import MappingProxyType
+
+# --- CURRICULUM CATALOG ---
+# All curriculum knowledge (sections, séries, voies, subjects, chapters, emojis) lives in
+# catalog.json. It is compiled once per process into read-only, pre-indexed tables so that
+# page renders only do dictionary lookups. Adding a section or a série is a data change.
+
+CATALOG_PATH = Path(__file__).with_name("catalog.json")
+DEFAULT_EMOJI = "📘"
+
+
+class Catalog:
+    """
+    Read-only view of catalog.json. Every lookup is a single dict access;
+    lists are returned as tuples so that callers cannot mutate the shared tables.
+    """
+
+    def __init__(self, raw):
+        self.version = raw.get("version", 1)
+        tn = raw["Tunisien"]
+        fr = raw["Français"]
+
+        # 1. Navigation lists, in display order
+        self.tn_sections = tuple(tn["sections"])
+        self.tn_options = MappingProxyType(dict(tn["options"]))
+        self.fr_levels = tuple(fr["levels"])
+        self.fr_series = tuple(fr["series"])
+        self.fr_specialites = tuple(fr["specialites"])
+        self.fr_specialites_count = MappingProxyType(
+            {level: info["specialites_count"] for level, info in fr["levels"].items()}
+        )
+
+        # 2. (curriculum, branch, level) -> subjects. The Tunisian level is None.
+        subjects = {}
+        for section, subs in tn["sections"].items():
+            subjects[("Tunisien", section, None)] = tuple(subs)
+        fr_branches = {**fr["voies"], **fr["series"]}
+        for level, info in fr["levels"].items():
+            for branch, subs in fr_branches.items():
+                subjects[("Français", branch, level)] = (info["first_subject"],) + tuple(subs)
+        self._subjects = MappingProxyType(subjects)
+
+        # 3. (curriculum, branch, subject) -> chapters
+        chapters = {}
+        for branch, by_subject in tn.get("chapters", {}).items():
+            for subject, chaps in by_subject.items():
+                chapters[("Tunisien", branch, subject)] = tuple(chaps)
+        for branch, by_subject in fr.get("chapters", {}).items():
+            for subject, chaps in by_subject.items():
+                chapters[("Français", branch, subject)] = tuple(chaps)
+        self._chapters = MappingProxyType(chapters)
+        self._branches_with_chapters = frozenset((c, b) for c, b, _ in chapters)
+
+        # 4. subject -> emoji
+        self._emojis = MappingProxyType(dict(raw.get("emojis", {})))
+
+    def subjects(self, curriculum, branch, level=None):
+        if curriculum == "Tunisien":
+            level = None
+        return self._subjects.get((curriculum, branch, level), ())
+
+    def has_chapters(self, curriculum, branch):
+        return (curriculum, branch) in self._branches_with_chapters
+
+    def chapters(self, curriculum, branch, subject):
+        return self._chapters.get((curriculum, branch, subject), ())
+
+    def emoji(self, subject):
+        return self._emojis.get(subject, DEFAULT_EMOJI)
+
+    def iter_chapters(self):
+        # (curriculum, branch, subject, chapters) for every subject that has chapters
+        for (curriculum, branch, subject), chaps in self._chapters.items():
+            yield curriculum, branch, subject, chaps
+
+
+@functools.lru_cache(maxsize=None)
+def load_catalog(path=CATALOG_PATH):
+    with open(path, encoding="utf-8") as f:
+        return Catalog(json.load(f))
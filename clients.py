@@ -0,0 +1,182 @@
+import threading
+import time
+
+import sdk
+
+# --- PROCESS-WIDE CLIENTS ---
+# Streamlit re-executes app.py on every rerun, but imported modules stay in memory.
+# One ClientRegistry is shared by every session of the process (see get_clients in app.py),
+# so each client, and its pool of keep-alive HTTP connections, is built only once.
+# The SDKs themselves are imported when their client is first built (see sdk.py).
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60   # seconds an idle connection stays open
+DEFAULT_MAX_FAILURES = 3        # consecutive errors before a client is rebuilt
+DEFAULT_HEALTH_INTERVAL = 60    # seconds between two background health checks
+
+
+def build_http_client(pool_size, keepalive_expiry, timeout=30.0):
+    # One httpx.Client per upstream so that a slow vendor cannot starve the other pool
+    httpx = sdk.load("httpx")
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return httpx.Client(limits=limits, timeout=timeout)
+
+
+def transport_errors():
+    # Only an SDK that was imported can have raised its own error types
+    errors = [ConnectionError]
+    if sdk.is_loaded("httpx"):
+        errors.append(sdk.load("httpx").TransportError)
+    if sdk.is_loaded("groq"):
+        errors.append(sdk.load("groq").APIConnectionError)
+    return tuple(errors)
+
+
+class ClientRegistry:
+    """
+    Lazily builds the Groq, Supabase and Gemini clients and keeps them alive.
+    A client is recreated when its HTTP pool was closed or after too many
+    consecutive failures reported by the callers.
+    """
+
+    def __init__(self, secrets, pool_size=DEFAULT_POOL_SIZE,
+                 keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY, max_failures=DEFAULT_MAX_FAILURES):
+        self.secrets = secrets
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._clients = {}      # name -> client object
+        self._http = {}         # name -> underlying httpx.Client
+        self._failures = {}     # name -> consecutive failure count
+        self._rebuilds = {}     # name -> how many times the client was (re)built
+        self._gemini_ready = False
+        self._health_thread = None
+
+    # 1. Builders, one per upstream
+    def _build_groq(self):
+        http = build_http_client(self.pool_size, self.keepalive_expiry)
+        # No SDK retries: 429s go back to the shared rate limiter, other errors to the LLM router
+        groq = sdk.load("groq")
+        return groq.Groq(api_key=self.secrets["GROQ_API_KEY"], http_client=http, max_retries=0), http
+
+    def _build_supabase(self):
+        http = build_http_client(self.pool_size, self.keepalive_expiry)
+        supabase = sdk.load("supabase")
+        options = supabase.ClientOptions(httpx_client=http)
+        return supabase.create_client(self.secrets["SUPABASE_URL"], self.secrets["SUPABASE_KEY"], options=options), http
+
+    def _get(self, name, builder):
+        client = self._clients.get(name)
+        http = self._http.get(name)
+        if client is not None and not http.is_closed and self._failures.get(name, 0) < self.max_failures:
+            return client
+
+        with self._lock:
+            # Another session may have rebuilt it while we were waiting
+            client = self._clients.get(name)
+            http = self._http.get(name)
+            if client is not None and not http.is_closed and self._failures.get(name, 0) < self.max_failures:
+                return client
+            if http is not None and not http.is_closed:
+                http.close()
+            client, http = builder()
+            self._clients[name] = client
+            self._http[name] = http
+            self._failures[name] = 0
+            self._rebuilds[name] = self._rebuilds.get(name, 0) + 1
+            return client
+
+    # 2. Public accessors
+    def groq(self):
+        return self._get("groq", self._build_groq)
+
+    def supabase(self):
+        return self._get("supabase", self._build_supabase)
+
+    def gemini(self):
+        # genai keeps its configuration globally, it only needs to be set once per process
+        genai = sdk.load("genai")
+        if not self._gemini_ready:
+            with self._lock:
+                if not self._gemini_ready:
+                    genai.configure(api_key=self.secrets["GEMINI_API_KEY"])
+                    self._gemini_ready = True
+        return genai
+
+    # 3. Health tracking
+    def report_success(self, name):
+        if self._failures.get(name):
+            self._failures[name] = 0
+
+    def report_failure(self, name, error=None):
+        # Only transport problems say something about the client itself
+        if error is not None and not isinstance(error, transport_errors()):
+            return
+        self._failures[name] = self._failures.get(name, 0) + 1
+
+    def health_check(self):
+        """
+        Actively probes every client that was already built. Failing clients are
+        marked so that the next accessor call recreates them.
+        """
+        probes = {
+            "groq": lambda c, http: c.models.list(),
+            "supabase": lambda c, http: http.get(
+                f"{self.secrets['SUPABASE_URL']}/auth/v1/health",
+                headers={"apikey": self.secrets["SUPABASE_KEY"]},
+            ).raise_for_status(),
+        }
+        results = {}
+        for name, probe in probes.items():
+            client = self._clients.get(name)
+            if client is None:
+                continue
+            started = time.perf_counter()
+            try:
+                probe(client, self._http[name])
+                self.report_success(name)
+                results[name] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1)}
+            except Exception as e:
+                self._failures[name] = self.max_failures
+                results[name] = {"ok": False, "error": type(e).__name__}
+        return results
+
+    def start_health_checks(self, interval=DEFAULT_HEALTH_INTERVAL):
+        # Probing happens on a daemon thread, never on a session's render thread
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.health_check()
+
+        self._health_thread = threading.Thread(target=loop, name="client-health", daemon=True)
+        self._health_thread.start()
+
+    # 4. Warm-up, off the render thread
+    def warm_up(self):
+        """
+        Imports the SDKs, builds the clients and opens one connection per upstream
+        (the health probes), so that the first chat turn of the process does not pay for it.
+        """
+        for name in ("httpx", "groq", "supabase", "genai"):
+            sdk.load(name, trigger="warm-up")
+        for accessor in (self.groq, self.supabase, self.gemini):
+            try:
+                accessor()
+            except Exception:
+                pass    # missing secret or vendor down: built again on first use
+        return self.health_check()
+
+    def stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "built": dict(self._rebuilds),
+            "failures": dict(self._failures),
+        }
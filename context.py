@@ -0,0 +1,146 @@
+import math
+
+# --- TOKEN-BUDGETED CONVERSATION CONTEXT ---
+# The prompt sent to the LLM is: system prompt + running summary + last N turns (+ extra instructions).
+# Older turns are folded into the summary once, so the request size stays bounded
+# however long the student keeps chatting.
+
+DEFAULT_TOKEN_BUDGET = 3000     # max prompt tokens per request
+DEFAULT_KEEP_TURNS = 3          # user/assistant pairs kept verbatim
+SUMMARY_MAX_TOKENS = 400        # the summary itself is capped too
+MESSAGE_OVERHEAD_TOKENS = 4     # role + separators added by the chat template
+SUMMARY_HEADER = "Résumé de la conversation précédente :\n"
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for French/English text with Llama tokenizers.
+    # Slightly pessimistic on purpose, an exact tokenizer is not worth the import here.
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
+
+
+def messages_tokens(messages):
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def truncate_to_tokens(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    # Keep the end: the most recent facts are the most useful ones
+    return "…" + text[-max_chars:]
+
+
+def local_summary(previous_summary, turns):
+    """
+    Fallback summariser used when no LLM summariser is given or when it fails:
+    keeps the first sentence of every folded turn.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for m in turns:
+        first_sentence = m["content"].strip().split("\n")[0].split(". ")[0]
+        who = "Élève" if m["role"] == "user" else "Tuteur"
+        lines.append(f"{who} : {first_sentence[:200]}")
+    return "\n".join(lines)
+
+
+class ConversationContext:
+    """
+    Per-session state of the rolling summary. It is kept in st.session_state
+    next to `messages`, and only the turns that were not folded yet are sent
+    to the summariser.
+    """
+
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, keep_turns=DEFAULT_KEEP_TURNS):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.summarized_upto = 0    # index in `messages` of the first turn not in the summary
+
+    def reset(self):
+        self.summary = ""
+        self.summarized_upto = 0
+
+    def to_dict(self):
+        # Stored with the diagnostic checkpoint so a resumed chat does not re-summarise
+        return {"summary": self.summary, "summarized_upto": self.summarized_upto}
+
+    @classmethod
+    def from_dict(cls, state, **kwargs):
+        context = cls(**kwargs)
+        if state:
+            context.summary = state.get("summary", "")
+            context.summarized_upto = state.get("summarized_upto", 0)
+        return context
+
+    def _fold(self, turns, summarizer):
+        if not turns:
+            return
+        summary = None
+        if summarizer is not None:
+            try:
+                summary = summarizer(self.summary, turns)
+            except Exception:
+                summary = None
+        if not summary:
+            summary = local_summary(self.summary, turns)
+        self.summary = truncate_to_tokens(summary, SUMMARY_MAX_TOKENS)
+
+    def build(self, system_prompt, messages, extra_system=None, summarizer=None):
+        """
+        Returns the list of messages for the chat completion call.
+        `extra_system` is appended last (e.g. the "pose la Question 1" instruction).
+        `summarizer(previous_summary, turns)` returns the updated summary text.
+        """
+        # The history may have been shortened behind our back (new chat, restore...)
+        if self.summarized_upto > len(messages):
+            self.reset()
+
+        # 1. Fold everything older than the last N turns into the summary
+        keep_from = max(len(messages) - 2 * self.keep_turns, 0)
+        if keep_from > self.summarized_upto:
+            self._fold(messages[self.summarized_upto:keep_from], summarizer)
+            self.summarized_upto = keep_from
+
+        recent = [{"role": m["role"], "content": m["content"]} for m in messages[self.summarized_upto:]]
+
+        # 2. Fixed parts that are always sent
+        head = [{"role": "system", "content": system_prompt}]
+        tail = [{"role": "system", "content": extra_system}] if extra_system else []
+
+        # 3. Enforce the budget: fold the oldest recent turns (in one summariser call),
+        #    never the last message. The summary is assumed to reach its cap once it grows.
+        drop = 0
+        while drop < len(recent) - 1 and self._size(head, tail, recent[drop:], drop > 0) > self.token_budget:
+            drop += 1
+        if drop:
+            self._fold(recent[:drop], summarizer)
+            recent = recent[drop:]
+            self.summarized_upto += drop
+
+        # 4. Still too big (tiny budget or one huge message): shorten the summary for
+        #    this request first, then cut the last message from the front
+        summary = self.summary
+        overflow = self._size(head, tail, recent) - self.token_budget
+        if overflow > 0 and summary:
+            if estimate_tokens(summary) > overflow:
+                summary = truncate_to_tokens(summary, estimate_tokens(summary) - overflow)
+                overflow = 0
+            else:
+                overflow -= estimate_tokens(SUMMARY_HEADER + summary) + MESSAGE_OVERHEAD_TOKENS
+                summary = ""
+        if overflow > 0 and recent:
+            last = recent[-1]
+            last["content"] = truncate_to_tokens(last["content"], max(estimate_tokens(last["content"]) - overflow, 1))
+
+        summary_msg = []
+        if summary:
+            summary_msg = [{"role": "system", "content": SUMMARY_HEADER + summary}]
+        return head + summary_msg + recent + tail
+
+    def _size(self, head, tail, recent, summary_grows=False):
+        summary_tokens = estimate_tokens(SUMMARY_HEADER + self.summary) + MESSAGE_OVERHEAD_TOKENS if self.summary else 0
+        if summary_grows:
+            summary_tokens = estimate_tokens(SUMMARY_HEADER) + SUMMARY_MAX_TOKENS + MESSAGE_OVERHEAD_TOKENS
+        return messages_tokens(head) + messages_tokens(tail) + messages_tokens(recent) + summary_tokens
@@ -0,0 +1,273 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+# --- BACKGROUND JOBS ---
+# Heavy work (e.g. generating a revision plan with the LLM) must not run on a Streamlit
+# render thread. Pages enqueue a job and poll its status; a small pool of worker threads
+# runs the registered handlers. Jobs live in a SQLite table so that they survive a process
+# restart. The processes of one host may share the table: a running job records the process
+# that claimed it, which sends heartbeats while it runs. Only the jobs whose heartbeats
+# stopped (their process died) are put back in the queue, by any live process.
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 3
+POLL_INTERVAL = 0.5         # seconds an idle worker waits before looking for work again
+HEARTBEAT_INTERVAL = 10     # seconds between two heartbeats of the running jobs of a process
+STALE_AFTER = 60            # seconds without heartbeat before a running job is given back to the queue
+
+SCHEMA = """
+create table if not exists jobs (
+    id text primary key,
+    kind text not null,
+    owner text,
+    dedupe_key text,
+    status text not null,           -- queued | running | done | failed
+    progress real not null default 0,
+    message text,
+    payload text not null,
+    result text,
+    error text,
+    attempts integer not null default 0,
+    claimed_by text,                -- process running the job (see JobQueue.worker_id)
+    heartbeat_at real,
+    created_at real not null,
+    updated_at real not null
+);
+create unique index if not exists jobs_active_dedupe
+    on jobs (dedupe_key) where status in ('queued', 'running');
+create index if not exists jobs_owner on jobs (owner, created_at);
+create index if not exists jobs_status on jobs (status, created_at);
+"""
+
+ACTIVE = ("queued", "running")
+CLAIM_COLUMNS = {"claimed_by": "text", "heartbeat_at": "real"}     # added to tables of older versions
+
+
+def row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+class JobQueue:
+    def __init__(self, db_path, workers=DEFAULT_WORKERS, max_attempts=DEFAULT_MAX_ATTEMPTS, stale_after=STALE_AFTER):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self.handlers = {}          # kind -> fn(payload, progress) -> result (JSON-serialisable)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._local = threading.local()
+        with self._lock:
+            db = self._db()
+            db.executescript(SCHEMA)
+            columns = {row["name"] for row in db.execute("pragma table_info(jobs)")}
+            for column, kind in CLAIM_COLUMNS.items():
+                if column not in columns:
+                    db.execute(f"alter table jobs add column {column} {kind}")
+            db.commit()
+        self.recover()
+
+    def _db(self):
+        # One connection per thread, SQLite connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("pragma journal_mode = wal")
+            self._local.conn = conn
+        return conn
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    # 2. Producer side (render thread): only quick local writes and reads
+    def enqueue(self, kind, payload, owner=None, dedupe_key=None):
+        """
+        Returns the id of the new job, or of the queued/running job that already has
+        the same dedupe_key (e.g. one plan per user and subject at a time).
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            db = self._db()
+            if dedupe_key is not None:
+                active = self._active_id(dedupe_key)
+                if active is not None:
+                    return active
+            try:
+                db.execute(
+                    "insert into jobs (id, kind, owner, dedupe_key, status, message, payload, created_at, updated_at) "
+                    "values (?, ?, ?, ?, 'queued', 'En attente', ?, ?, ?)",
+                    (job_id, kind, owner, dedupe_key, json.dumps(payload, ensure_ascii=False), now, now),
+                )
+                db.commit()
+            except sqlite3.IntegrityError:
+                # Another process sharing the table enqueued the same key since the select
+                # (jobs_active_dedupe): its job is the one to follow
+                db.rollback()
+                active = self._active_id(dedupe_key)
+                if active is None:
+                    raise
+                return active
+        self._wakeup.set()
+        return job_id
+
+    def _active_id(self, dedupe_key):
+        row = self._db().execute(
+            "select id from jobs where dedupe_key = ? and status in ('queued', 'running')", (dedupe_key,)
+        ).fetchone()
+        return row["id"] if row is not None else None
+
+    def get(self, job_id):
+        return row_to_job(self._db().execute("select * from jobs where id = ?", (job_id,)).fetchone())
+
+    def latest_by_owner(self, owner, kind=None):
+        """
+        Most recent job of every dedupe_key of `owner`, newest first.
+        """
+        query = "select * from jobs where owner = ?"
+        params = [owner]
+        if kind is not None:
+            query += " and kind = ?"
+            params.append(kind)
+        rows = self._db().execute(query + " order by created_at desc", params).fetchall()
+        seen = set()
+        jobs = []
+        for row in rows:
+            key = row["dedupe_key"] or row["id"]
+            if key not in seen:
+                seen.add(key)
+                jobs.append(row_to_job(row))
+        return jobs
+
+    def retry(self, job_id):
+        # Skipped when a job with the same dedupe_key is already queued or running (enqueued again
+        # since the failure, possibly by another process): that one is followed instead
+        with self._lock:
+            self._db().execute(
+                "update jobs set status = 'queued', attempts = 0, error = null, progress = 0, "
+                "message = 'En attente', updated_at = ? where id = ? and status = 'failed' "
+                "and (dedupe_key is null or not exists (select 1 from jobs as active "
+                "where active.dedupe_key = jobs.dedupe_key and active.status in ('queued', 'running')))",
+                (time.time(), job_id),
+            )
+            self._db().commit()
+        self._wakeup.set()
+
+    # 3. Worker side
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "select * from jobs where status = 'queued' order by created_at limit 1"
+            ).fetchone()
+            if row is None:
+                return None
+            # Conditional: another process sharing the table may have claimed it since the select
+            claimed = db.execute(
+                "update jobs set status = 'running', attempts = attempts + 1, claimed_by = ?, heartbeat_at = ?, "
+                "updated_at = ? where id = ? and status = 'queued'",
+                (self.worker_id, now, now, row["id"]),
+            ).rowcount
+            db.commit()
+        return row_to_job(row) if claimed else None
+
+    def heartbeat(self):
+        with self._lock:
+            self._db().execute(
+                "update jobs set heartbeat_at = ? where claimed_by = ? and status = 'running'",
+                (time.time(), self.worker_id),
+            )
+            self._db().commit()
+
+    def recover(self):
+        """
+        Puts back in the queue the running jobs without a heartbeat for `stale_after` seconds:
+        their process died. Returns how many were requeued.
+        """
+        now = time.time()
+        with self._lock:
+            requeued = self._db().execute(
+                "update jobs set status = 'queued', claimed_by = null, message = 'Reprise après redémarrage', "
+                "updated_at = ? where status = 'running' and coalesce(heartbeat_at, updated_at) < ?",
+                (now, now - self.stale_after),
+            ).rowcount
+            self._db().commit()
+        if requeued:
+            self._wakeup.set()
+        return requeued
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db().execute(f"update jobs set {assignments} where id = ?", (*fields.values(), job_id))
+            self._db().commit()
+
+    def _run(self, job):
+        handler = self.handlers.get(job["kind"])
+
+        def progress(fraction, message=None):
+            self._update(job["id"], progress=min(max(fraction, 0.0), 1.0), message=message)
+
+        try:
+            if handler is None:
+                raise LookupError(f"Aucun handler pour les jobs '{job['kind']}'")
+            result = handler(job["payload"], progress)
+            self._update(job["id"], status="done", progress=1.0, message="Terminé",
+                         result=json.dumps(result, ensure_ascii=False))
+        except Exception as e:
+            retry = job["attempts"] + 1 < self.max_attempts and handler is not None
+            self._update(
+                job["id"],
+                status="queued" if retry else "failed",
+                message="Nouvelle tentative" if retry else "Échec",
+                error=f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=3)}",
+            )
+
+    def _loop(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self.heartbeat()
+                self.recover()
+            except Exception:
+                pass    # database locked: retried at the next beat
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"jobs-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat_loop, name="jobs-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stats(self):
+        rows = self._db().execute("select status, count(*) as n from jobs group by status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
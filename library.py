@@ -0,0 +1,307 @@
+"""
+Résumés and exercise sets of every chapter, generated offline.
+
+    python library.py build                             # generate what is missing or outdated
+    python library.py build --kind resume --subject Gestion --workers 8
+    python library.py stats
+
+`build` reads the API keys like `python question_bank.py generate` (.streamlit/secrets.toml or
+the environment). Every finished artifact is recorded at once, so an interrupted build resumes
+where it stopped.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from question_bank import SECRETS_PATH, build_router, load_secrets
+
+# --- CONTENT LIBRARY ---
+# Generating a résumé or an exercise set per student would burn the LLM quota on the same
+# chapters over and over. They are generated once per chapter by a batch build (bounded pool of
+# worker threads behind the shared Groq rate limiter) and stored as content-addressed files:
+#
+#   library/objects/<sha256>.json   one artifact, named after the hash of its bytes (immutable)
+#   library/index.json              (kind, curriculum, branch, subject, chapter) -> current hash,
+#                                   version and the hashes of the previous versions
+#
+# The app only reads these files: the Résumés and Exercices pages make no LLM call.
+
+LIBRARY_DIR = Path(__file__).with_name("library")
+FORMAT_VERSION = 1
+# Bump the generator of a kind when its prompt changes: `build` then regenerates that kind
+GENERATOR_VERSIONS = {"resume": 1, "exercices": 1}
+KINDS = tuple(GENERATOR_VERSIONS)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+DEFAULT_CACHE_ENTRIES = 256         # artifacts kept in memory by the app
+RELOAD_INTERVAL = 60                # seconds between two checks of index.json by the app
+SOLUTIONS_MARKER = "---CORRIGÉ---"
+
+
+def index_key(kind, curriculum, branch, subject, chapter):
+    return "|".join((kind, curriculum, branch, subject, chapter))
+
+
+def object_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def split_solutions(markdown):
+    # Exercise sets are "statements SOLUTIONS_MARKER solutions"
+    statements, _, solutions = markdown.partition(SOLUTIONS_MARKER)
+    return statements.strip(), solutions.strip()
+
+
+# 1. App side: read-only
+class ContentLibrary:
+    """
+    Read-only view of a library directory. Artifacts are immutable, so a loaded
+    one is kept (LRU) until the process ends; index.json is re-read when it changes.
+    """
+
+    def __init__(self, root=LIBRARY_DIR, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()     # hash -> artifact
+        self._index = {}
+        self._available = {}            # (kind, curriculum, branch) -> {subject: [chapters]}
+        self._mtime = None
+        self._checked = 0.0
+        self.counters = {"hits": 0, "misses": 0, "reloads": 0}
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.time()
+        if not force and now - self._checked < RELOAD_INTERVAL:
+            return
+        self._checked = now
+        path = self.root / "index.json"
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return      # no library built yet: both pages stay locked
+        if mtime == self._mtime:
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                index = json.load(f)["entries"]
+        except (OSError, ValueError, KeyError):
+            return      # unreadable or half-written index: the previous one is kept
+        available = {}
+        for entry in index.values():
+            by_subject = available.setdefault((entry["kind"], entry["curriculum"], entry["branch"]), {})
+            by_subject.setdefault(entry["subject"], []).append(entry["chapter"])
+        with self._lock:
+            self._index = index
+            self._available = available
+            self._mtime = mtime
+            self.counters["reloads"] += 1
+
+    def available(self, kind, curriculum, branch):
+        """
+        {subject: [chapters]} of the artifacts of `kind` for this branch.
+        """
+        self.refresh()
+        return self._available.get((kind, curriculum, branch), {})
+
+    def get(self, kind, curriculum, branch, subject, chapter):
+        entry = self._index.get(index_key(kind, curriculum, branch, subject, chapter))
+        if entry is None:
+            return None
+        digest = entry["hash"]
+        with self._lock:
+            artifact = self._cache.get(digest)
+            if artifact is not None:
+                self._cache.move_to_end(digest)
+                self.counters["hits"] += 1
+                return artifact
+            self.counters["misses"] += 1
+        with open(self.root / "objects" / f"{digest}.json", encoding="utf-8") as f:
+            artifact = json.load(f)
+        with self._lock:
+            self._cache[digest] = artifact
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return artifact
+
+    def stats(self):
+        return {**self.counters, "artifacts": len(self._index), "cached": len(self._cache)}
+
+
+# 2. Batch build
+def generation_messages(kind, curriculum, branch, subject, chapter):
+    intro = f"Tu es un professeur expert du baccalauréat ({curriculum}), classe {branch}, matière {subject}. "
+    if kind == "resume":
+        task = (
+            f"Rédige en Markdown la fiche de révision du chapitre : {chapter}. "
+            "Plan : notions clés et définitions, formules et méthodes (avec un mini exemple chiffré si "
+            "le chapitre s'y prête), erreurs fréquentes, ce qu'il faut savoir faire le jour de l'examen. "
+            "600 mots au maximum, sans introduction ni conclusion."
+        )
+    else:
+        task = (
+            f"Rédige en Markdown trois exercices progressifs de type Bac sur le chapitre : {chapter}, "
+            "avec des données chiffrées quand le chapitre s'y prête. Puis écris une ligne contenant "
+            f"uniquement {SOLUTIONS_MARKER} et, après elle, le corrigé détaillé de chaque exercice."
+        )
+    return [{"role": "system", "content": intro + task}, {"role": "user", "content": f"Chapitre : {chapter}"}]
+
+
+def generate_artifact(router, kind, curriculum, branch, subject, chapter, model, attempts=3):
+    for _ in range(attempts):
+        markdown = router.complete(generation_messages(kind, curriculum, branch, subject, chapter),
+                                   max_tokens=3000).strip()
+        if len(markdown) < 200:
+            continue
+        if kind == "exercices" and not all(split_solutions(markdown)):
+            continue
+        return {
+            "kind": kind, "curriculum": curriculum, "branch": branch, "subject": subject, "chapter": chapter,
+            "generator": GENERATOR_VERSIONS[kind],
+            "model": model,
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "markdown": markdown,
+        }
+    return None
+
+
+def write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def store_object(root, artifact):
+    data = json.dumps(artifact, ensure_ascii=False, sort_keys=True, indent=1).encode("utf-8")
+    digest = object_hash(data)
+    path = root / "objects" / f"{digest}.json"
+    if not path.exists():
+        write_atomic(path, data)
+    return digest
+
+
+def load_index(root):
+    try:
+        with open(root / "index.json", encoding="utf-8") as f:
+            return json.load(f)["entries"]
+    except FileNotFoundError:
+        return {}
+
+
+def save_index(root, entries):
+    raw = {"format": FORMAT_VERSION, "entries": dict(sorted(entries.items()))}
+    write_atomic(root / "index.json", json.dumps(raw, ensure_ascii=False, indent=1).encode("utf-8"))
+
+
+def is_current(root, entry, kind):
+    return (entry is not None and entry["generator"] == GENERATOR_VERSIONS[kind]
+            and (root / "objects" / f"{entry['hash']}.json").exists())
+
+
+def run_build(args):
+    from catalog import load_catalog
+
+    root = Path(args.dir)
+    (root / "objects").mkdir(parents=True, exist_ok=True)
+    entries = load_index(root)
+    todo = [
+        (kind, curriculum, branch, subject, chapter)
+        for curriculum, branch, subject, chapters in load_catalog().iter_chapters()
+        for chapter in chapters
+        for kind in args.kind
+        if (not args.subject or subject == args.subject) and (not args.chapter or args.chapter in chapter)
+    ]
+    # 1. Resume: what is already built with the current generator is skipped
+    if not args.force:
+        todo = [key for key in todo if not is_current(root, entries.get(index_key(*key)), key[0])]
+    print(f"{len(todo)} artefacts à générer", file=sys.stderr)
+    if not todo:
+        return 0
+
+    router = build_router(load_secrets(args.secrets), args.model)
+    done = failed = 0
+
+    def work(key):
+        artifact = generate_artifact(router, *key, model=args.model)
+        return None if artifact is None else (artifact, store_object(root, artifact))
+
+    # 2. Bounded pool: at most `workers` generations in flight, the index is written by this thread only
+    pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="library-build")
+    queue = iter(todo)
+    pending = {pool.submit(work, key): key for key in itertools.islice(queue, args.workers)}
+    try:
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = None
+                    print(f"  erreur ({type(e).__name__}) : {' / '.join(key)}", file=sys.stderr)
+                if result is None:
+                    failed += 1
+                else:
+                    artifact, digest = result
+                    previous = entries.get(index_key(*key))
+                    # Previous versions stay in objects/, their hashes are kept for rollbacks
+                    history = previous["history"] + [previous["hash"]] if previous else []
+                    entries[index_key(*key)] = {
+                        "kind": key[0], "curriculum": key[1], "branch": key[2], "subject": key[3], "chapter": key[4],
+                        "hash": digest,
+                        "version": previous["version"] + 1 if previous else 1,
+                        "generator": artifact["generator"],
+                        "generated_at": artifact["generated_at"],
+                        "history": history,
+                    }
+                    save_index(root, entries)
+                    done += 1
+                    print(f"  {' / '.join(key)}", file=sys.stderr)
+                next_key = next(queue, None)
+                if next_key is not None:
+                    pending[pool.submit(work, next_key)] = next_key
+    except KeyboardInterrupt:
+        print("interrompu : relancer la même commande pour reprendre", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        return 130
+    pool.shutdown()
+    print(f"{done} artefacts générés, {failed} échecs, {len(entries)} dans {root / 'index.json'}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Résumés and exercise sets of every chapter")
+    parser.add_argument("--dir", default=str(LIBRARY_DIR))
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="generate the missing or outdated artifacts")
+    build.add_argument("--kind", nargs="+", default=list(KINDS), choices=KINDS)
+    build.add_argument("--subject")
+    build.add_argument("--chapter", help="part of the chapter title")
+    build.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    build.add_argument("--model", default=DEFAULT_MODEL)
+    build.add_argument("--secrets", default=str(SECRETS_PATH))
+    build.add_argument("--force", action="store_true", help="regenerate artifacts that are up to date")
+    commands.add_parser("stats", help="artifacts in the library")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        return run_build(args)
+    entries = load_index(Path(args.dir))
+    by_kind = {kind: sum(1 for e in entries.values() if e["kind"] == kind) for kind in KINDS}
+    print(json.dumps({"artifacts": len(entries), "by_kind": by_kind}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from context import estimate_tokens, messages_tokens
+from metrics import TOKENS_BUCKETS
+from ratelimit import request_cost
+from singleflight import request_key
+
+# --- LLM PROVIDERS WITH FAILOVER AND HEDGING ---
+# The chat path talks to an LLMRouter, never to a vendor SDK directly.
+# Providers are tried in order (Groq first, Gemini second): transient errors are retried
+# with exponential backoff, rate limits switch provider at once, and when the primary is
+# slower than its usual time-to-first-token a hedged request is sent to the next provider.
+# The first provider that produces a token wins, the other attempt is cancelled.
+
+DEFAULT_RETRIES = 2             # attempts per provider before failing over
+DEFAULT_BACKOFF = 0.4           # seconds, doubled at each retry (+ jitter)
+DEFAULT_HEDGE_PERCENTILE = 0.95
+DEFAULT_HEDGE_AFTER = 4.0       # seconds, used until enough latency samples exist
+MIN_HEDGE_SAMPLES = 20
+LATENCY_WINDOW = 500            # samples kept per provider for the percentiles
+DEFAULT_GROQ_MODEL = "llama-3.1-8b-instant"
+DEFAULT_GEMINI_MODEL = "gemini-2.5-flash"
+
+
+class AllProvidersFailed(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        detail = "; ".join(f"{name}: {type(e).__name__}: {e}" for name, e in errors)
+        super().__init__(f"Aucun fournisseur IA n'a répondu ({detail})")
+
+
+class EmptyCompletion(Exception):
+    """
+    The provider ended the stream without any text (safety block, empty candidate...):
+    treated like an error, so the router fails over instead of returning "".
+    """
+
+
+def status_code_of(error):
+    # groq.APIStatusError exposes .status_code, google.api_core errors expose .code
+    code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_rate_limit(error):
+    return status_code_of(error) == 429 or type(error).__name__ in ("RateLimitError", "ResourceExhausted")
+
+
+def retry_after_of(error):
+    # Seconds from the Retry-After header of a 429, when the SDK exposes the response
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    code = status_code_of(error)
+    if code is not None:
+        return code in (408, 409, 429) or code >= 500
+    # No status code: connection reset, timeout, DNS...
+    return type(error).__name__ in (
+        "APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout",
+        "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+        "ConnectionError", "TimeoutError",
+    )
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(int(p * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+class ProviderStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "successes": 0, "failures": 0, "rate_limited": 0,
+                         "hedges_started": 0, "hedges_won": 0, "cancelled": 0}
+        self.latency = deque(maxlen=LATENCY_WINDOW)     # seconds, full completion
+        self.ttft = deque(maxlen=LATENCY_WINDOW)        # seconds, time to first token
+
+    def incr(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def observe(self, ttft, latency):
+        with self._lock:
+            self.ttft.append(ttft)
+            self.latency.append(latency)
+
+    def snapshot(self):
+        with self._lock:
+            latency = list(self.latency)
+            ttft = list(self.ttft)
+            result = dict(self.counters)
+        for p in (0.5, 0.95, 0.99):
+            label = f"p{int(p * 100)}"
+            value = percentile(latency, p)
+            result[f"latency_{label}_ms"] = round(value * 1000, 1) if value is not None else None
+            value = percentile(ttft, p)
+            result[f"ttft_{label}_ms"] = round(value * 1000, 1) if value is not None else None
+        return result
+
+
+# --- PROVIDERS ---
+
+class GroqProvider:
+    name = "groq"
+
+    def __init__(self, clients, model=DEFAULT_GROQ_MODEL, limiter=None):
+        self.clients = clients
+        self.model = model
+        # Shared RateLimiter (ratelimit.py): every Groq call of the process queues there first
+        self.limiter = limiter
+
+    def stream(self, messages, max_tokens=None, cancelled=None):
+        kwargs = {"messages": messages, "model": self.model, "stream": True}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        reserved = 0
+        used = messages_tokens(messages)    # prompt, then + the generated tokens
+        if self.limiter is not None:
+            reserved = request_cost(messages, max_tokens)
+            if not self.limiter.acquire(reserved, cancelled=cancelled):
+                return      # cancelled while queued (another provider already answered)
+        try:
+            response = self.clients.groq().chat.completions.create(**kwargs)
+            for chunk in response:
+                if cancelled is not None and cancelled.is_set():
+                    response.close()
+                    return
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    used += estimate_tokens(delta)
+                    yield delta
+        except Exception as e:
+            if self.limiter is not None and is_rate_limit(e):
+                self.limiter.on_rate_limited(retry_after_of(e))
+            # Lets the registry rebuild the client if its connections are broken
+            self.clients.report_failure("groq", e)
+            raise
+        finally:
+            if self.limiter is not None and reserved:
+                self.limiter.settle(reserved, used)
+        if self.limiter is not None:
+            self.limiter.on_success()
+        self.clients.report_success("groq")
+
+
+class GeminiProvider:
+    name = "gemini"
+
+    def __init__(self, clients, model=DEFAULT_GEMINI_MODEL):
+        self.clients = clients
+        self.model = model
+
+    def to_gemini(self, messages):
+        # System messages (prompt, summary, injected instructions) become the system instruction,
+        # consecutive turns of the same role are merged because Gemini expects alternation.
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        contents = []
+        for m in messages:
+            if m["role"] == "system":
+                continue
+            role = "model" if m["role"] == "assistant" else "user"
+            if contents and contents[-1]["role"] == role:
+                contents[-1]["parts"][0] += "\n\n" + m["content"]
+            else:
+                contents.append({"role": role, "parts": [m["content"]]})
+        if not contents or contents[-1]["role"] != "user":
+            contents.append({"role": "user", "parts": ["Continue."]})
+        return system, contents
+
+    def stream(self, messages, max_tokens=None, cancelled=None):
+        genai = self.clients.gemini()
+        system, contents = self.to_gemini(messages)
+        model = genai.GenerativeModel(self.model, system_instruction=system or None)
+        config = {"max_output_tokens": max_tokens} if max_tokens else None
+        response = model.generate_content(contents, stream=True, generation_config=config)
+        for chunk in response:
+            if cancelled is not None and cancelled.is_set():
+                return
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (safety block, finish reason only...)
+                continue
+            if text:
+                yield text
+
+
+# --- ROUTER ---
+
+class LLMRouter:
+    def __init__(self, providers, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE, hedge_after=DEFAULT_HEDGE_AFTER, max_workers=32,
+                 single_flight=None, metrics=None):
+        self.providers = providers
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_percentile = hedge_percentile     # None disables hedging
+        self.hedge_after = hedge_after
+        self.stats = {p.name: ProviderStats() for p in providers}
+        # Optional SingleFlight (singleflight.py): identical concurrent requests share one call
+        self.single_flight = single_flight
+        self.models = [getattr(p, "model", p.name) for p in providers]
+        # Optional Metrics (metrics.py): latency, TTFT, tokens and error classes per provider
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    def hedge_delay(self, provider):
+        samples = self.stats[provider.name].ttft
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return self.hedge_after
+        return percentile(list(samples), self.hedge_percentile)
+
+    def _run_attempt(self, attempt_id, provider, messages, max_tokens, events, cancelled):
+        # Runs on a worker thread; everything goes back to the caller through `events`
+        try:
+            produced = False
+            for text in provider.stream(messages, max_tokens=max_tokens, cancelled=cancelled):
+                produced = True
+                events.put((attempt_id, "chunk", text))
+                if cancelled.is_set():
+                    break
+            if not produced and not cancelled.is_set():
+                raise EmptyCompletion(f"{provider.name} returned no text")
+            events.put((attempt_id, "done", None))
+        except Exception as e:
+            events.put((attempt_id, "error", e))
+
+    def stream(self, messages, max_tokens=None, coalesce_key=None):
+        """
+        Yields the reply text chunk by chunk. Failover and hedging only happen before
+        the first token; after that the winning provider streams to the end.
+        `coalesce_key` replaces the prompt as the single-flight key when prompts that differ
+        ask for the same reply (first turn: only the profile and the chapter matter).
+        """
+        if self.single_flight is None:
+            return self._stream(messages, max_tokens)
+        if coalesce_key is not None:
+            key = ("coalesce", coalesce_key, max_tokens)
+        else:
+            key = request_key(messages, self.models, max_tokens)
+        return self.single_flight.stream(key, lambda: self._stream(messages, max_tokens))
+
+    def _stream(self, messages, max_tokens):
+        events = queue.Queue()
+        plan = list(self.providers)         # providers not tried yet, in order
+        attempts = {}                        # attempt_id -> dict(provider, started, cancelled, tries, first)
+        errors = []
+        winner = None
+        next_id = 0
+        hedge_deadline = None
+        completion_tokens = 0
+
+        def launch(provider, tries=1, hedge=False):
+            nonlocal next_id, hedge_deadline
+            attempt_id = next_id
+            next_id += 1
+            cancelled = threading.Event()
+            attempts[attempt_id] = {"provider": provider, "started": time.perf_counter(),
+                                    "cancelled": cancelled, "tries": tries, "first": None, "hedge": hedge}
+            stats = self.stats[provider.name]
+            stats.incr("requests")
+            if hedge:
+                stats.incr("hedges_started")
+            self._executor.submit(self._run_attempt, attempt_id, provider, messages, max_tokens, events, cancelled)
+            if self.hedge_percentile is not None and plan:
+                hedge_deadline = time.perf_counter() + self.hedge_delay(provider)
+            else:
+                hedge_deadline = None
+
+        launch(plan.pop(0))
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge_deadline is not None:
+                    timeout = max(hedge_deadline - time.perf_counter(), 0)
+                try:
+                    attempt_id, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # 1. Hedge: the running attempt is slower than usual, start the next provider too
+                    launch(plan.pop(0), hedge=True)
+                    continue
+
+                attempt = attempts[attempt_id]
+                provider = attempt["provider"]
+                stats = self.stats[provider.name]
+                if winner is not None and attempt_id != winner:
+                    continue        # late events from a cancelled attempt
+
+                if kind == "chunk":
+                    if winner is None:
+                        # 2. First token wins, every other attempt is cancelled
+                        winner = attempt_id
+                        attempt["first"] = time.perf_counter()
+                        if attempt["hedge"]:
+                            stats.incr("hedges_won")
+                        for other_id, other in attempts.items():
+                            if other_id != attempt_id and not other["cancelled"].is_set():
+                                other["cancelled"].set()
+                                self.stats[other["provider"].name].incr("cancelled")
+                    completion_tokens += estimate_tokens(payload)
+                    yield payload
+
+                elif kind == "done":
+                    end = time.perf_counter()
+                    first = attempt["first"] or end
+                    stats.incr("successes")
+                    stats.observe(first - attempt["started"], end - attempt["started"])
+                    if self.metrics is not None:
+                        self._record(provider.name, messages, first - attempt["started"],
+                                     end - attempt["started"], completion_tokens)
+                    return
+
+                elif kind == "error":
+                    stats.incr("failures")
+                    if self.metrics is not None:
+                        self.metrics.incr("llm_errors_total", provider=provider.name, error=type(payload).__name__)
+                    errors.append((provider.name, payload))
+                    if winner is not None:
+                        raise payload       # tokens were already shown, cannot switch silently
+                    del attempts[attempt_id]
+
+                    # 3. Retry the same provider with backoff, or fail over to the next one
+                    if is_rate_limit(payload):
+                        stats.incr("rate_limited")
+                    if is_retryable(payload) and not is_rate_limit(payload) and attempt["tries"] < self.retries:
+                        delay = self.backoff * (2 ** (attempt["tries"] - 1)) * (1 + random.random() / 2)
+                        time.sleep(delay)
+                        launch(provider, tries=attempt["tries"] + 1)
+                    elif plan:
+                        if not attempts:
+                            launch(plan.pop(0))
+                    elif not attempts:
+                        raise AllProvidersFailed(errors)
+        finally:
+            # Generator closed early (user left the page...): stop the workers
+            for attempt in attempts.values():
+                attempt["cancelled"].set()
+
+    def _record(self, provider, messages, ttft, latency, completion_tokens):
+        # Token counts are estimates (~4 characters per token), the streaming API gives no usage
+        self.metrics.observe("llm_ttft_seconds", ttft, provider=provider)
+        self.metrics.observe("llm_latency_seconds", latency, provider=provider)
+        self.metrics.observe("llm_prompt_tokens", messages_tokens(messages), buckets=TOKENS_BUCKETS, provider=provider)
+        self.metrics.observe("llm_completion_tokens", completion_tokens, buckets=TOKENS_BUCKETS, provider=provider)
+
+    def complete(self, messages, max_tokens=None, coalesce_key=None):
+        return "".join(self.stream(messages, max_tokens=max_tokens, coalesce_key=coalesce_key))
+
+    def snapshot(self):
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
@@ -0,0 +1,119 @@
+import sdk
+
+# --- CHAPTER MASTERY (BAYESIAN KNOWLEDGE TRACING) ---
+# Estimates, for every chapter of a student, the probability that the chapter is mastered.
+# The prior comes from the self-assessed level of the subject; each graded diagnostic answer
+# (✅ / 🟡 / ❌, from the local QCM grading or the LLM evaluation) updates the chapter with the
+# standard BKT rule: a few float operations on one array cell, no LLM call. All the chapters of
+# the student live in one NumPy array, so ranking the weakest ones (in a subject or overall) is
+# one vectorised pass for the dashboard and the plan page. NumPy is imported on first use (see
+# sdk.py): the pages before the dashboard do not pay for it.
+
+P_LEARN = 0.10          # chance of learning the chapter between two answers
+P_SLIP = 0.10           # chance of a wrong answer although the chapter is mastered
+P_GUESS_OPEN = 0.10     # chance of a right answer to an open question without mastery
+P_GUESS_QCM = 0.25      # ...to a 4-choice QCM
+KEY_SEPARATOR = "::"    # profile keys are "subject::chapter" (see get_revision_scheduler)
+
+VERDICTS = {"✅": 1.0, "🟡": 0.5, "❌": 0.0}
+
+
+def verdict_score(text):
+    """
+    1, 0.5 or 0 from the verdict emoji an evaluation starts with; None without verdict.
+    """
+    head = (text or "").lstrip(" *_#>\n")[:3]
+    for emoji, score in VERDICTS.items():
+        if head.startswith(emoji):
+            return score
+    return None
+
+
+class MasteryModel:
+    """
+    BKT state of one student. `p[i]` is the mastery of chapter i, `n[i]` the number of
+    graded answers it is based on.
+    """
+
+    def __init__(self, chapters, priors):
+        # chapters: [(subject, chapter)], priors: mastery before any answer, same order
+        np = sdk.load("numpy")
+        self.keys = [f"{subject}{KEY_SEPARATOR}{chapter}" for subject, chapter in chapters]
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.subjects = sorted({subject for subject, _ in chapters})
+        subject_ids = {subject: i for i, subject in enumerate(self.subjects)}
+        self.subject_of = np.array([subject_ids[subject] for subject, _ in chapters], dtype=np.int32)
+        self.prior = np.array(priors, dtype=np.float64)
+        self.p = self.prior.copy()
+        self.n = np.zeros(len(self.keys), dtype=np.int32)
+
+    @classmethod
+    def from_profile(cls, subjects, prior_of, mastery=None, answers=None):
+        """
+        subjects: {subject: [chapters]}, prior_of(subject) -> 0..1, mastery / answers: the
+        "subject::chapter" dicts saved in the profile by to_profile().
+        """
+        chapters = [(subject, chapter) for subject, chaps in subjects.items() for chapter in chaps]
+        model = cls(chapters, [prior_of(subject) for subject, _ in chapters])
+        for key, value in (mastery or {}).items():
+            i = model.index.get(key)
+            if i is not None:
+                model.p[i] = value
+                model.n[i] = (answers or {}).get(key, 1)
+        return model
+
+    # 1. O(1) update after one answer
+    def observe(self, subject, chapter, score, guess=P_GUESS_OPEN, slip=P_SLIP, learn=P_LEARN):
+        """
+        score: 1 (right), 0.5 (partly right) or 0 (wrong). Returns the new mastery.
+        """
+        i = self.index.get(f"{subject}{KEY_SEPARATOR}{chapter}")
+        if i is None:
+            return None
+        p = self.p[i]
+        right = p * (1 - slip) / (p * (1 - slip) + (1 - p) * guess)
+        wrong = p * slip / (p * slip + (1 - p) * (1 - guess))
+        # A partly right answer counts as a mix of both observations
+        posterior = score * right + (1 - score) * wrong
+        self.p[i] = posterior + (1 - posterior) * learn
+        self.n[i] += 1
+        return float(self.p[i])
+
+    def estimate(self, subject, chapter):
+        # (mastery, graded answers); (None, 0) for a chapter outside the student's program
+        i = self.index.get(f"{subject}{KEY_SEPARATOR}{chapter}")
+        if i is None:
+            return None, 0
+        return float(self.p[i]), int(self.n[i])
+
+    # 2. Vectorised reads
+    def weakest(self, k=3, subject=None, practised_only=True):
+        """
+        [(subject, chapter, mastery)] of the k least mastered chapters, weakest first.
+        """
+        np = sdk.load("numpy")
+        mask = np.ones(len(self.keys), dtype=bool)
+        if practised_only:
+            mask &= self.n > 0
+        if subject is not None:
+            if subject not in self.subjects:
+                return []
+            mask &= self.subject_of == self.subjects.index(subject)
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+        k = min(k, len(candidates))
+        top = candidates[np.argpartition(self.p[candidates], k - 1)[:k]]
+        top = top[np.argsort(self.p[top], kind="stable")]
+        return [(*self.keys[i].split(KEY_SEPARATOR, 1), float(self.p[i])) for i in top]
+
+    def to_profile(self):
+        """
+        (mastery, answers) of the practised chapters only, as stored in user_data:
+        the other chapters are fully described by the self-assessed level.
+        """
+        np = sdk.load("numpy")
+        practised = np.flatnonzero(self.n > 0)
+        mastery = {self.keys[i]: round(float(self.p[i]), 3) for i in practised}
+        answers = {self.keys[i]: int(self.n[i]) for i in practised}
+        return mastery, answers
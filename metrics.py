@@ -0,0 +1,235 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- IN-PROCESS METRICS ---
+# Render durations, rerun counts, LLM latency / time to first token / tokens and error classes.
+# Recording an event is a few dict lookups and an increment under a lock: nothing is written
+# anywhere on the render thread. The numbers leave the process only when they are read,
+# through a local Prometheus-style scrape endpoint and/or a periodic log line.
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKENS_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+DEFAULT_PORT_TRIES = 8      # ports tried from METRICS_PORT on: one per Streamlit process of the host
+
+# Streamlit stops a script run with these on st.rerun() / st.stop(): not errors
+CONTROL_FLOW = ("RerunException", "StopException")
+
+log = logging.getLogger("khirmintaki.metrics")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)      # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation (good enough for dashboards)
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip((*self.buckets, float("inf")), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def label_text(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}         # (name, labels) -> value
+        self._histograms = {}       # (name, labels) -> Histogram
+        self._buckets = {}          # histogram name -> bucket bounds
+        self._gauges = {}           # name -> fn() returning the current value, called when read
+        self.started = time.time()
+        self._server = None
+        self._dumper = None
+
+    # 1. Recording (render thread, LLM worker threads)
+    def incr(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._buckets.setdefault(name, buckets))
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, counter=None, **labels):
+        """
+        Observes the duration of the block in histogram `name`. When `counter` is given, it is
+        incremented with an outcome label: ok, rerun (st.rerun / st.stop) or error.
+        """
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException as e:
+            if type(e).__name__ in CONTROL_FLOW:
+                outcome = "rerun"
+            else:
+                outcome = "error"
+                self.incr("errors_total", where=name, error=type(e).__name__)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+            if counter:
+                self.incr(counter, outcome=outcome, **labels)
+
+    def timed(self, name, **labels):
+        # Decorator version of timer(), e.g. for fragments (their reruns skip the page router)
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def gauge(self, name, fn):
+        # Values owned by another component (e.g. session memory), sampled at read time
+        with self._lock:
+            self._gauges[name] = fn
+
+    # 2. Reading
+    def _sample_gauges(self):
+        with self._lock:
+            gauges = dict(self._gauges)
+        values = {}
+        for name, fn in sorted(gauges.items()):
+            try:
+                values[name] = fn()
+            except Exception:
+                pass
+        return values
+
+    def _copy(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (h.buckets, list(h.counts), h.count, h.sum) for key, h in self._histograms.items()
+            }
+        return counters, histograms
+
+    def render_prometheus(self):
+        counters, histograms = self._copy()
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{label_text(labels)} {value}")
+        for (name, labels), (buckets, counts, count, total) in sorted(histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, n in zip((*buckets, "+Inf"), counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{label_text(labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{label_text(labels)} {round(total, 6)}")
+            lines.append(f"{name}_count{label_text(labels)} {count}")
+        for name, value in self._sample_gauges().items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        lines.append(f"process_uptime_seconds {round(time.time() - self.started, 1)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Compact view: counters, gauges, and count / mean / p50 / p95 of every histogram.
+        """
+        gauges = self._sample_gauges()
+        with self._lock:
+            counters = {f"{name}{label_text(labels)}": value for (name, labels), value in self._counters.items()}
+            histograms = {
+                f"{name}{label_text(labels)}": {
+                    "count": h.count,
+                    "mean": round(h.sum / h.count, 4) if h.count else None,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                }
+                for (name, labels), h in self._histograms.items()
+            }
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    # 3. Export, off the render thread
+    def start_http_server(self, port, host="127.0.0.1", tries=DEFAULT_PORT_TRIES):
+        """
+        Serves /metrics on the first free port of port .. port + tries - 1 and returns it.
+        When none is free, logs it and returns None: the app runs without the endpoint.
+        """
+        if self._server is not None:
+            return self._server.server_address[1]
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        # ThreadingHTTPServer sets SO_REUSEADDR: a restart binds again while the old socket is in TIME_WAIT
+        for candidate in range(port, port + tries):
+            try:
+                self._server = ThreadingHTTPServer((host, candidate), Handler)
+                break
+            except OSError:
+                continue    # another process of the host serves its metrics there
+        else:
+            log.warning("metrics endpoint disabled: ports %d-%d are all in use", port, port + tries - 1)
+            return None
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        log.info("metrics endpoint on http://%s:%d/metrics", host, candidate)
+        return candidate
+
+    def start_log_dump(self, interval):
+        if self._dumper is not None:
+            return
+        if not log.handlers:
+            # Streamlit only configures its own loggers
+            log.addHandler(logging.StreamHandler())
+            log.setLevel(logging.INFO)
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                log.info("metrics %s", self.summary())
+
+        self._dumper = threading.Thread(target=loop, name="metrics-log", daemon=True)
+        self._dumper.start()
@@ -0,0 +1,246 @@
+import copy
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import sdk
+
+# --- REVISION PLAN AS PDF ---
+# "Télécharger mon plan" is clicked by many students at the same time the night before an
+# exam, often several times in a row. The plan is turned into a plain document (dict of
+# strings), its content hash is the cache key: the same plan is rendered once per process,
+# whoever asks for it. The document holds no identity of the student (no email), so the
+# students of one programme with the same schedule share one PDF. Fonts are parsed once into a prototype FPDF that every render copies;
+# fpdf itself is only imported for the first render (or by the warm-up).
+
+# Bump when the layout below changes: cached PDFs of the old layout are then ignored
+TEMPLATE_VERSION = 2
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024      # total size of the cached PDFs
+
+FONT_CANDIDATES = [
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/dejavu/DejaVuSans.ttf", "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf"),
+    ("/Library/Fonts/Arial Unicode.ttf", None),
+    ("C:/Windows/Fonts/arial.ttf", "C:/Windows/Fonts/arialbd.ttf"),
+]
+
+KIND_LABELS = {"apprentissage": "Apprentissage", "rappel": "Rappel"}
+WEEKDAYS = ["Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim"]
+
+BOLD_STARS = re.compile(r"\*\*(.+?)\*\*")
+SINGLE_STAR = re.compile(r"(?<![*\w])\*(?!\s)(.+?)(?<!\s)\*(?![*\w])")
+
+
+def plan_document(student, exam_date, days, plans):
+    """
+    Plain data of the PDF, also the input of its content hash.
+    student: {"curriculum", "branch"}, days: [(date, [(subject, chapter, kind)])],
+    plans: results of the plan jobs ({subject, chapter, markdown, generated_at}).
+    """
+    return {
+        "student": student,
+        "exam_date": exam_date.isoformat() if exam_date else None,
+        "days": [
+            [day.isoformat(), [[subject, chapter, kind] for subject, chapter, kind in sessions]]
+            for day, sessions in days
+        ],
+        "plans": [
+            {key: plan.get(key) for key in ("subject", "chapter", "markdown", "generated_at")}
+            for plan in plans
+        ],
+    }
+
+
+def content_hash(document):
+    raw = json.dumps([TEMPLATE_VERSION, document], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def plan_pdf_class():
+    class PlanPDF(sdk.load("fpdf").FPDF):
+        def footer(self):
+            self.set_y(-12)
+            self.set_font(self.body_font, size=8)
+            self.set_text_color(130)
+            self.cell(0, 8, f"KhirMinTaki - page {self.page_no()}/{{nb}}", align="C")
+
+    return PlanPDF
+
+
+class PlanPdfRenderer:
+    def __init__(self, font_path=None, bold_font_path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()     # content hash -> PDF bytes, least recently used first
+        self._size = 0
+        self.counters = {"hits": 0, "misses": 0, "renders": 0, "evictions": 0}
+        self.font_path = font_path
+        self.bold_font_path = bold_font_path
+        self._prototype = None
+        self._charset = None
+
+    # 1. Fonts and layout, once per process (first render or warm-up)
+    def _ensure_prototype(self):
+        with self._lock:
+            if self._prototype is None:
+                self._prototype, self._charset = self._build_prototype(self.font_path, self.bold_font_path)
+        return self._prototype
+
+    def warm_up(self):
+        sdk.load("fpdf", trigger="warm-up")
+        self._ensure_prototype()
+
+    @staticmethod
+    def _build_prototype(font_path, bold_font_path):
+        pdf = plan_pdf_class()(format="A4")
+        pdf.set_margins(18, 16, 18)
+        pdf.set_auto_page_break(auto=True, margin=16)
+        pdf.set_title("Plan de révision")
+        pdf.set_creator("KhirMinTaki")
+
+        candidates = [(font_path, bold_font_path)] if font_path else FONT_CANDIDATES
+        for regular, bold in candidates:
+            if not os.path.exists(regular):
+                continue
+            bold = bold if bold and os.path.exists(bold) else regular
+            # Markdown may switch to italic: the upright faces stand in for the missing ones
+            for style, path in (("", regular), ("B", bold), ("I", regular), ("BI", bold)):
+                pdf.add_font("PlanFont", style, path)
+            pdf.body_font = "PlanFont"
+            return pdf, frozenset(pdf.fonts["planfont"].cmap)
+
+        # No Unicode font on this machine: core font, Latin-1 only
+        pdf.body_font = "Helvetica"
+        return pdf, None
+
+    # 2. Text clean-up (emojis and characters the font has no glyph for)
+    def clean(self, text):
+        text = str(text or "")
+        if self._charset is None:
+            text = text.replace("—", "-").replace("’", "'").replace("•", "-")
+            return text.encode("latin-1", "ignore").decode("latin-1")
+        return "".join(c for c in text if c in "\n\t" or ord(c) in self._charset).strip()
+
+    def clean_markdown(self, text):
+        # fpdf2 understands **bold** only; single-star emphasis is dropped
+        return SINGLE_STAR.sub(r"\1", self.clean(text))
+
+    # 3. Rendering, section by section
+    def _render(self, document):
+        pdf = copy.deepcopy(self._ensure_prototype())     # a render mutates the font subsets
+        font = pdf.body_font
+        width = pdf.epw
+        pdf.add_page()
+
+        pdf.set_font(font, "B", 18)
+        pdf.cell(0, 10, self.clean("Plan de révision"), new_x="LMARGIN", new_y="NEXT")
+        student = document["student"]
+        pdf.set_font(font, "", 10)
+        pdf.set_text_color(90)
+        subtitle = " · ".join(filter(None, [student.get("curriculum"), student.get("branch")]))
+        pdf.cell(0, 6, self.clean(subtitle), new_x="LMARGIN", new_y="NEXT")
+        if document["exam_date"]:
+            exam = "/".join(reversed(document["exam_date"].split("-")))
+            pdf.cell(0, 6, self.clean(f"Examen le {exam}"), new_x="LMARGIN", new_y="NEXT")
+        pdf.set_text_color(0)
+        pdf.ln(4)
+
+        if document["days"]:
+            self._render_schedule(pdf, font, width, document["days"])
+        for plan in document["plans"]:
+            self._render_ai_plan(pdf, font, width, plan)
+
+        buffer = io.BytesIO()
+        pdf.output(buffer)
+        return buffer.getvalue()
+
+    def _render_schedule(self, pdf, font, width, days):
+        pdf.set_font(font, "B", 14)
+        pdf.cell(0, 9, self.clean("Planning jour par jour"), new_x="LMARGIN", new_y="NEXT")
+        for iso_day, sessions in days:
+            day = datetime.date.fromisoformat(iso_day)
+            pdf.set_font(font, "B", 10)
+            pdf.cell(24, 5.5, f"{WEEKDAYS[day.weekday()]} {day.strftime('%d/%m')}")
+            pdf.set_font(font, "", 10)
+            if not sessions:
+                line = "Repos"
+            else:
+                line = " ; ".join(f"{subject} — {chapter} ({KIND_LABELS.get(kind, kind)})"
+                                  for subject, chapter, kind in sessions)
+            pdf.multi_cell(width - 24, 5.5, self.clean(line), align="L",
+                           new_x="LMARGIN", new_y="NEXT")
+        pdf.ln(4)
+
+    def _render_ai_plan(self, pdf, font, width, plan):
+        pdf.set_font(font, "B", 14)
+        pdf.multi_cell(width, 8, self.clean(f"{plan['subject']} — {plan['chapter']}"), align="L",
+                       new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font(font, "", 8)
+        pdf.set_text_color(110)
+        pdf.cell(0, 5, self.clean(f"Rédigé par l'AI Professor le {plan['generated_at']}"),
+                 new_x="LMARGIN", new_y="NEXT")
+        pdf.set_text_color(0)
+
+        bullet = "•" if self._charset and ord("•") in self._charset else "-"
+        for raw in (plan.get("markdown") or "").splitlines():
+            line = raw.strip()
+            if not line:
+                pdf.ln(2)
+                continue
+            if line.startswith("#"):
+                level = min(len(line) - len(line.lstrip("#")), 3)
+                pdf.set_font(font, "B", {1: 13, 2: 12, 3: 11}[level])
+                text = BOLD_STARS.sub(r"\1", self.clean_markdown(line.lstrip("#")))
+                pdf.multi_cell(width, 7, text, align="L", new_x="LMARGIN", new_y="NEXT")
+                continue
+            pdf.set_font(font, "", 10)
+            indent = 0
+            if line[:2] in ("- ", "* ", "+ "):
+                indent = 5 + 4 * min((len(raw) - len(raw.lstrip())) // 2, 3)
+                line = f"{bullet} {line[2:]}"
+            pdf.set_x(pdf.l_margin + indent)
+            pdf.multi_cell(width - indent, 5.5, self.clean_markdown(line), align="L", markdown=True,
+                           new_x="LMARGIN", new_y="NEXT")
+        pdf.ln(4)
+
+    # 4. Cached access
+    def render(self, document):
+        """
+        PDF bytes of `document` (see plan_document). Identical plans are rendered once.
+        """
+        key = content_hash(document)
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                self.counters["hits"] += 1
+                return data
+            self.counters["misses"] += 1
+
+        data = self._render(document)
+        with self._lock:
+            self.counters["renders"] += 1
+            if key not in self._cache:
+                self._cache[key] = data
+                self._size += len(data)
+            while self._size > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._size -= len(evicted)
+                self.counters["evictions"] += 1
+        return data
+
+    def stream(self, document):
+        # File-like view of the cached PDF, for st.download_button
+        return io.BytesIO(self.render(document))
+
+    def stats(self):
+        return {**self.counters, "cached": len(self._cache), "bytes": self._size,
+                "unicode_font": self._charset is not None if self._prototype is not None else None}
+
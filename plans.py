@@ -0,0 +1,49 @@
+import time
+
+# --- REVISION PLAN GENERATION ---
+# Runs inside a background job (see jobs.py), never on a render thread.
+
+PLAN_JOB = "revision_plan"
+
+
+def plan_dedupe_key(email, subject):
+    # One plan job per user and subject at a time
+    return f"{PLAN_JOB}:{email}:{subject}"
+
+
+def build_plan_messages(payload):
+    profile = payload["profile"]
+    transcript = "\n".join(
+        f"{'Élève' if m['role'] == 'user' else 'Tuteur'} : {m['content']}" for m in payload["messages"]
+    )
+    system = (
+        f"Tu es 'AI Professor', un tuteur expert pour le système {profile['curriculum']}. "
+        f"L'élève est en classe de {profile['level']} {profile['branch']}, matière {profile['subject']}, "
+        f"niveau auto-évalué '{profile['student_level']}'. "
+        "À partir du diagnostic ci-dessous, rédige un plan de révision personnalisé en Markdown : "
+        "1. points forts, 2. lacunes repérées, 3. programme semaine par semaine avec des exercices ciblés."
+    )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": f"Chapitre : {payload['chapter']}\n\nDiagnostic :\n{transcript}"},
+    ]
+
+
+def generate_plan(router, payload, progress):
+    progress(0.1, "Analyse du diagnostic")
+    messages = build_plan_messages(payload)
+
+    progress(0.3, "Rédaction du plan")
+    chunks = []
+    for i, text in enumerate(router.stream(messages, max_tokens=1500)):
+        chunks.append(text)
+        # The exact length is unknown: move slowly towards 90 % while tokens arrive
+        if i % 20 == 0:
+            progress(min(0.3 + i / 1500, 0.9), "Rédaction du plan")
+
+    return {
+        "subject": payload["profile"]["subject"],
+        "chapter": payload["chapter"],
+        "markdown": "".join(chunks),
+        "generated_at": time.strftime("%Y-%m-%d %H:%M"),
+    }
@@ -0,0 +1,337 @@
+"""
+Diagnostic question bank.
+
+    python question_bank.py generate                        # fill the missing or outdated entries
+    python question_bank.py generate --subject Gestion --difficulty moyen --force
+    python question_bank.py stats
+
+`generate` reads the API keys from .streamlit/secrets.toml (or the environment) and writes
+question_bank.json after every entry, so an interrupted run resumes where it stopped.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from types import MappingProxyType
+
+# --- DIAGNOSTIC QUESTION BANK ---
+# The ten questions of a diagnostic used to be written live by the LLM, one chat turn at a time,
+# although the chapters are fixed. They are generated offline into question_bank.json, one
+# versioned entry per (curriculum, branch, subject, chapter, difficulty), and served from an
+# in-memory index: showing the next question is a dict lookup. During the chat the LLM only
+# evaluates the free-text answers (a QCM answered with a letter is graded locally).
+
+BANK_PATH = Path(__file__).with_name("question_bank.json")
+SECRETS_PATH = Path(__file__).with_name(".streamlit") / "secrets.toml"
+FORMAT_VERSION = 1
+# Bump when the generation prompt changes: `generate` then rewrites every entry
+GENERATOR_VERSION = 1
+
+QUESTIONS_PER_DIAGNOSTIC = 10
+DEFAULT_QUESTIONS_PER_ENTRY = 14    # a few more than needed, so two students do not get the same ten
+DEFAULT_GENERATION_MODEL = "llama-3.3-70b-versatile"
+EVALUATION_MAX_TOKENS = 250
+
+DIFFICULTIES = ("facile", "moyen", "difficile")
+LEVEL_DIFFICULTY = {
+    "Insuffisant": "facile", "Fragile": "facile",
+    "Satisfaisant": "moyen", "Bien": "moyen",
+    "Très bien": "difficile", "Excellent": "difficile",
+}
+LETTERS = "ABCDEF"
+CHOICE_ANSWER = re.compile(r"^\s*(?:réponse\s*)?([a-fA-F])\s*[\).:-]?\s*$")
+
+
+def difficulty_for(student_level):
+    return LEVEL_DIFFICULTY.get(student_level, "moyen")
+
+
+def question_id(text):
+    return hashlib.sha1(text.strip().lower().encode("utf-8")).hexdigest()[:12]
+
+
+# 1. Chat side: formatting and grading
+def format_question(number, question):
+    text = f"**Question {number} :** {question['question']}"
+    if question["type"] == "qcm":
+        text += "\n\n" + "\n".join(f"- **{LETTERS[i]}.** {choice}" for i, choice in enumerate(question["choices"]))
+        text += "\n\n_Réponds par la lettre, ou avec tes mots._"
+    return text
+
+
+def match_choice(question, answer):
+    """
+    Index of the choice picked in `answer` ("B", "b)", or the exact text of a choice),
+    None when the answer is free text (or the question is not a QCM).
+    """
+    if question["type"] != "qcm":
+        return None
+    m = CHOICE_ANSWER.match(answer)
+    if m:
+        index = LETTERS.index(m.group(1).upper())
+        return index if index < len(question["choices"]) else None
+    normalized = answer.strip().lower().rstrip(".")
+    for i, choice in enumerate(question["choices"]):
+        if normalized == choice.strip().lower().rstrip("."):
+            return i
+    return None
+
+
+def choice_feedback(question, index):
+    correct = question["answer"]
+    if index == correct:
+        text = "✅ Exact !"
+    else:
+        text = f"❌ Pas tout à fait : la bonne réponse était **{LETTERS[correct]}. {question['choices'][correct]}**."
+    if question.get("explanation"):
+        text += f" {question['explanation']}"
+    return text
+
+
+def evaluation_messages(tutor_prompt, question, answer):
+    """
+    Prompt of the answer evaluation: the question and its expected elements are enough,
+    the conversation history is not sent.
+    """
+    if question["type"] == "qcm":
+        expected = question["choices"][question["answer"]]
+        if question.get("explanation"):
+            expected += f" ({question['explanation']})"
+    else:
+        expected = question["expected"]
+    system = (
+        f"{tutor_prompt} "
+        "Tu corriges la réponse de l'élève à une question de diagnostic. Commence par ✅ (juste), "
+        "🟡 (partiellement juste) ou ❌ (faux), puis explique en deux ou trois phrases ce qui est juste "
+        "et ce qui manque, en t'appuyant sur les éléments attendus. Ne pose pas de nouvelle question."
+    )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": f"Question : {question['question']}\n"
+                                    f"Éléments de réponse attendus : {expected}\n"
+                                    f"Réponse de l'élève : {answer}"},
+    ]
+
+
+# 2. The bank
+class QuestionBank:
+    """
+    Read-only index of question_bank.json: (curriculum, branch, subject, chapter, difficulty)
+    -> (version, questions). Questions are returned as shared dicts: do not mutate them.
+    """
+
+    def __init__(self, raw=None):
+        raw = raw or {}
+        self.format = raw.get("format", FORMAT_VERSION)
+        self.entries = list(raw.get("entries", []))
+        self._index = MappingProxyType({entry_key(e): (e["version"], tuple(e["questions"])) for e in self.entries})
+
+    @classmethod
+    def load(cls, path=BANK_PATH):
+        # No bank yet (not generated): every diagnostic falls back to live questions
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls()
+
+    def entry(self, curriculum, branch, subject, chapter, difficulty):
+        """
+        (version, questions) of the entry, or of the nearest difficulty that has one. None if
+        the chapter has no questions.
+        """
+        order = sorted(DIFFICULTIES, key=lambda d: abs(DIFFICULTIES.index(d) - DIFFICULTIES.index(difficulty)))
+        for candidate in order:
+            found = self._index.get((curriculum, branch, subject, chapter, candidate))
+            if found is not None:
+                return found
+        return None
+
+    def draw(self, curriculum, branch, subject, chapter, difficulty, seed="", n=QUESTIONS_PER_DIAGNOSTIC):
+        """
+        The n questions of one diagnostic. The same seed (the student) gives the same draw,
+        so a resumed diagnostic goes on with the same questions. [] if the bank cannot serve it.
+        """
+        if difficulty not in DIFFICULTIES:
+            difficulty = "moyen"
+        found = self.entry(curriculum, branch, subject, chapter, difficulty)
+        if found is None or len(found[1]) < n:
+            return []
+        version, questions = found
+        rng = random.Random(f"{seed}|{chapter}|{difficulty}|{version}")
+        return rng.sample(questions, n)
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "questions": sum(len(e["questions"]) for e in self.entries),
+            "by_difficulty": {d: sum(1 for e in self.entries if e["difficulty"] == d) for d in DIFFICULTIES},
+        }
+
+
+def entry_key(entry):
+    return (entry["curriculum"], entry["branch"], entry["subject"], entry["chapter"], entry["difficulty"])
+
+
+# 3. Offline generation
+def generation_messages(curriculum, branch, subject, chapter, difficulty, count):
+    system = (
+        f"Tu es un professeur expert du baccalauréat ({curriculum}), classe {branch}, matière {subject}. "
+        f"Rédige {count} questions de diagnostic, niveau {difficulty}, sur le chapitre : {chapter}. "
+        "Elles doivent couvrir les notions principales du chapitre, du cours à l'application. "
+        "Mélange des questions ouvertes courtes (l'élève répond en quelques phrases) et des QCM à 4 choix. "
+        "Réponds uniquement par un objet JSON de la forme : "
+        '{"questions": [{"type": "ouverte", "question": "...", "expected": "éléments de réponse attendus"}, '
+        '{"type": "qcm", "question": "...", "choices": ["...", "...", "...", "..."], "answer": 0, '
+        '"explanation": "une phrase"}]}'
+    )
+    return [{"role": "system", "content": system}, {"role": "user", "content": f"Chapitre : {chapter}"}]
+
+
+def parse_questions(text):
+    """
+    Valid questions of a generation reply (malformed ones are dropped, duplicates too).
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return []
+    try:
+        items = json.loads(text[start:end + 1]).get("questions", [])
+    except (ValueError, AttributeError):
+        return []
+    questions, seen = [], set()
+    for item in items:
+        if not isinstance(item, dict) or not str(item.get("question", "")).strip():
+            continue
+        question = {"id": question_id(item["question"]), "question": item["question"].strip()}
+        if question["id"] in seen:
+            continue
+        if item.get("type") == "qcm":
+            choices = [str(c).strip() for c in item.get("choices") or [] if str(c).strip()]
+            answer = item.get("answer")
+            if not 2 <= len(choices) <= len(LETTERS) or not isinstance(answer, int) or not 0 <= answer < len(choices):
+                continue
+            question.update(type="qcm", choices=choices, answer=answer,
+                            explanation=str(item.get("explanation") or "").strip())
+        elif str(item.get("expected", "")).strip():
+            question.update(type="ouverte", expected=item["expected"].strip())
+        else:
+            continue
+        seen.add(question["id"])
+        questions.append(question)
+    return questions
+
+
+def generate_entry(router, curriculum, branch, subject, chapter, difficulty, count, attempts=3):
+    for _ in range(attempts):
+        reply = router.complete(generation_messages(curriculum, branch, subject, chapter, difficulty, count),
+                                max_tokens=4000)
+        questions = parse_questions(reply)
+        if len(questions) >= QUESTIONS_PER_DIAGNOSTIC:
+            return questions[:count]
+    return None
+
+
+def save_bank(path, entries):
+    # Written to a temporary file first: the app never reads a half-written bank
+    raw = {"format": FORMAT_VERSION, "entries": sorted(entries.values(), key=entry_key)}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(raw, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def load_secrets(path=SECRETS_PATH):
+    # Same keys as st.secrets; the environment wins (CI, cron)
+    secrets = {}
+    if Path(path).exists():
+        import tomllib
+        with open(path, "rb") as f:
+            secrets.update(tomllib.load(f))
+    for key in ("GROQ_API_KEY", "GEMINI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY"):
+        if os.environ.get(key):
+            secrets[key] = os.environ[key]
+    return secrets
+
+
+def build_router(secrets, model):
+    from clients import ClientRegistry
+    from llm import GeminiProvider, GroqProvider, LLMRouter
+    from ratelimit import DEFAULT_RPM, DEFAULT_TPM, RateLimiter
+
+    registry = ClientRegistry(secrets)
+    limiter = RateLimiter(rpm=int(secrets.get("GROQ_RPM", DEFAULT_RPM)), tpm=int(secrets.get("GROQ_TPM", DEFAULT_TPM)))
+    providers = [GroqProvider(registry, model=model, limiter=limiter)]
+    if secrets.get("GEMINI_API_KEY"):
+        providers.append(GeminiProvider(registry))
+    return LLMRouter(providers, hedge_percentile=None)
+
+
+def run_generate(args):
+    from catalog import load_catalog
+
+    bank = QuestionBank.load(args.bank)
+    entries = {entry_key(e): e for e in bank.entries}
+    router = build_router(load_secrets(args.secrets), args.model)
+    todo = [
+        (curriculum, branch, subject, chapter, difficulty)
+        for curriculum, branch, subject, chapters in load_catalog().iter_chapters()
+        for chapter in chapters
+        for difficulty in args.difficulty
+        if (not args.subject or subject == args.subject) and (not args.chapter or args.chapter in chapter)
+    ]
+    done = failed = 0
+    for key in todo:
+        current = entries.get(key)
+        if current is not None and current.get("generator") == GENERATOR_VERSION and not args.force:
+            continue
+        questions = generate_entry(router, *key, count=args.count)
+        if questions is None:
+            failed += 1
+            print(f"  échec : {' / '.join(key)}", file=sys.stderr)
+            continue
+        curriculum, branch, subject, chapter, difficulty = key
+        entries[key] = {
+            "curriculum": curriculum, "branch": branch, "subject": subject, "chapter": chapter,
+            "difficulty": difficulty,
+            "version": (current["version"] + 1) if current else 1,
+            "generator": GENERATOR_VERSION,
+            "model": args.model,
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "questions": questions,
+        }
+        save_bank(args.bank, entries)
+        done += 1
+        print(f"  {len(questions)} questions : {' / '.join(key)}", file=sys.stderr)
+    print(f"{done} entrées générées, {failed} échecs, {len(entries)} entrées dans {args.bank}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diagnostic question bank")
+    parser.add_argument("--bank", default=str(BANK_PATH))
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="generate the missing or outdated entries")
+    generate.add_argument("--subject")
+    generate.add_argument("--chapter", help="part of the chapter title")
+    generate.add_argument("--difficulty", nargs="+", default=list(DIFFICULTIES), choices=DIFFICULTIES)
+    generate.add_argument("--count", type=int, default=DEFAULT_QUESTIONS_PER_ENTRY)
+    generate.add_argument("--model", default=DEFAULT_GENERATION_MODEL)
+    generate.add_argument("--secrets", default=str(SECRETS_PATH))
+    generate.add_argument("--force", action="store_true", help="regenerate entries that are up to date")
+    commands.add_parser("stats", help="entries and questions in the bank")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        return run_generate(args)
+    print(json.dumps(QuestionBank.load(args.bank).stats(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
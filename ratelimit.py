@@ -0,0 +1,182 @@
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+from context import messages_tokens
+
+# --- GROQ RATE LIMITER ---
+# Groq enforces requests/minute and tokens/minute per API key, i.e. for the whole process
+# (and every replica sharing the key). Sessions no longer call Groq as soon as a student
+# answers: each request takes a ticket in one FIFO queue and leaves it when both buckets
+# have room, so a classroom answering at once is served in order at the quota ceiling.
+# A 429 still means our view of the quota is off (other replicas, token estimates): the
+# queue is paused for Retry-After and the refill rate is lowered, then slowly restored.
+
+DEFAULT_RPM = 30                # Groq free tier, llama-3.1-8b-instant
+DEFAULT_TPM = 6000
+DEFAULT_COMPLETION_TOKENS = 512     # reserved when the caller sets no max_tokens
+DEFAULT_MAX_WAIT = 20.0         # seconds; beyond that the request is refused (the router fails over)
+DEFAULT_BACKOFF = 2.0           # seconds of pause after a 429 without Retry-After, doubled per strike
+MAX_BACKOFF = 60.0
+MIN_RATE_FACTOR = 0.25
+RATE_DECREASE = 0.7             # multiplicative decrease on 429
+RATE_INCREASE = 0.05            # additive increase per successful request
+CHECK_INTERVAL = 0.25           # seconds between two looks at the `cancelled` flag
+
+
+class RateLimited(Exception):
+    """
+    The estimated wait is longer than the caller accepts. Carries status_code 429 so that
+    the LLM router treats it like a provider rate limit (immediate failover).
+    """
+    status_code = 429
+
+    def __init__(self, wait):
+        self.wait = wait
+        super().__init__(f"File d'attente Groq saturée (~{wait:.0f} s)")
+
+
+def request_cost(messages, max_tokens=None):
+    # Groq counts prompt + completion tokens; the completion is reserved up front and settled after
+    return messages_tokens(messages) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0       # units per second
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now, factor):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * factor)
+        self.updated = now
+
+    def time_for(self, amount, factor, level=None):
+        # Seconds until `amount` units are available (a request bigger than the bucket waits for a full one)
+        level = self.level if level is None else level
+        deficit = min(amount, self.capacity) - level
+        return max(deficit, 0) / (self.rate * factor)
+
+
+class RateLimiter:
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_wait=DEFAULT_MAX_WAIT, backoff=DEFAULT_BACKOFF):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_wait = max_wait
+        self.backoff = backoff
+        self.factor = 1.0           # share of the nominal rate currently used (lowered after 429s)
+        self.paused_until = 0.0
+        self.strikes = 0            # consecutive 429s
+        self._cond = threading.Condition()
+        self._queue = deque()       # tickets (cost, seq) in arrival order
+        self._seq = itertools.count()
+        self.counters = {"granted": 0, "rejected": 0, "cancelled": 0, "rate_limited": 0,
+                         "waited": 0, "wait_seconds": 0.0}
+
+    # 1. Waiting time (also shown in the UI)
+    def _refill(self, now):
+        self.requests.refill(now, self.factor)
+        self.tokens.refill(now, self.factor)
+
+    def _wait_for(self, ahead, cost, now):
+        # Everything queued before us is served first: simulate the buckets draining in order
+        wait = max(self.paused_until - now, 0)
+        req_level, tok_level = self.requests.level, self.tokens.level
+        for amount in [*ahead, cost]:
+            wait += max(self.requests.time_for(1, self.factor, req_level),
+                        self.tokens.time_for(amount, self.factor, tok_level))
+            req_level = max(req_level - 1, 0)
+            tok_level = max(tok_level - min(amount, self.tokens.capacity), 0)
+        return wait
+
+    def estimate_wait(self, cost):
+        """
+        Seconds a new request of `cost` tokens would wait before being sent to Groq.
+        """
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return self._wait_for([t[0] for t in self._queue], cost, now)
+
+    # 2. Tickets
+    def acquire(self, cost, cancelled=None, max_wait=None):
+        """
+        Blocks until the request may be sent. Returns True, or False when `cancelled` was set
+        while waiting. Raises RateLimited when the estimated wait exceeds `max_wait`.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        ticket = (cost, next(self._seq))
+        started = time.monotonic()
+        with self._cond:
+            self._refill(started)
+            wait = self._wait_for([t[0] for t in self._queue], cost, started)
+            if wait > max_wait:
+                self.counters["rejected"] += 1
+                raise RateLimited(wait)
+            self._queue.append(ticket)
+            try:
+                while True:
+                    if cancelled is not None and cancelled.is_set():
+                        self.counters["cancelled"] += 1
+                        return False
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._queue[0] == ticket and now >= self.paused_until:
+                        delay = max(self.requests.time_for(1, self.factor), self.tokens.time_for(cost, self.factor))
+                        if delay <= 0:
+                            self.requests.level -= 1
+                            self.tokens.level -= min(cost, self.tokens.capacity)
+                            self.counters["granted"] += 1
+                            if now - started > 0.01:
+                                self.counters["waited"] += 1
+                                self.counters["wait_seconds"] += now - started
+                            return True
+                    else:
+                        delay = CHECK_INTERVAL
+                    self._cond.wait(min(delay, CHECK_INTERVAL))
+            finally:
+                # Granted, cancelled or interrupted: the next ticket may go
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def settle(self, reserved, used):
+        # The completion was reserved at its maximum: give back what was not generated
+        with self._cond:
+            reserved = min(reserved, self.tokens.capacity)
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved - used)
+            self._cond.notify_all()
+
+    # 3. Feedback from Groq
+    def on_success(self):
+        with self._cond:
+            self.strikes = 0
+            self.factor = min(1.0, self.factor + RATE_INCREASE)
+
+    def on_rate_limited(self, retry_after=None):
+        with self._cond:
+            self.counters["rate_limited"] += 1
+            self.strikes += 1
+            self.factor = max(MIN_RATE_FACTOR, self.factor * RATE_DECREASE)
+            if retry_after is None:
+                retry_after = min(self.backoff * 2 ** (self.strikes - 1), MAX_BACKOFF) * (1 + random.random() / 4)
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            waited = self.counters["waited"]
+            return {
+                **self.counters,
+                "wait_seconds": round(self.counters["wait_seconds"], 1),
+                "avg_wait_s": round(self.counters["wait_seconds"] / waited, 2) if waited else 0.0,
+                "queued": len(self._queue),
+                "rate_factor": round(self.factor, 2),
+                "paused_s": round(max(self.paused_until - now, 0), 1),
+                "requests_available": int(self.requests.level),
+                "tokens_available": int(self.tokens.level),
+            }
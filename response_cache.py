@@ -0,0 +1,125 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# --- RESPONSE CACHE FOR DETERMINISTIC TUTOR TURNS ---
+# Tier 1: in-process LRU with TTL, shared by every session of the replica.
+# Tier 2 (optional): a Supabase table shared by every replica.
+#
+#   create table tutor_response_cache (
+#       key text primary key,
+#       value text not null,
+#       created_at timestamptz not null default now()
+#   );
+
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL = 24 * 3600     # seconds
+
+
+def make_cache_key(namespace, version, **fields):
+    # Sorted JSON so that the key does not depend on argument order
+    raw = json.dumps({"ns": namespace, "v": version, **fields}, sort_keys=True, ensure_ascii=False)
+    return f"{namespace}:{version}:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SupabaseCacheStore:
+    """
+    Persistent tier. Every error is swallowed: a cache must never break a chat turn.
+    """
+
+    def __init__(self, clients, table="tutor_response_cache", ttl=DEFAULT_TTL):
+        # The registry, not a client: the client may be rebuilt after failures
+        self.clients = clients
+        self.table = table
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            oldest = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - self.ttl))
+            res = (self.clients.supabase().table(self.table).select("value")
+                   .eq("key", key).gte("created_at", oldest).limit(1).execute())
+            if res.data:
+                return res.data[0]["value"]
+        except Exception:
+            pass
+        return None
+
+    def put(self, key, value):
+        try:
+            self.clients.supabase().table(self.table).upsert({"key": key, "value": value}).execute()
+        except Exception:
+            pass
+
+    def delete_prefix(self, prefix):
+        try:
+            self.clients.supabase().table(self.table).delete().like("key", f"{prefix}%").execute()
+        except Exception:
+            pass
+
+
+class ResponseCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, store=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, value), most recent last
+        self.counters = {"memory_hits": 0, "store_hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+
+        # Second tier outside the lock, it is a network round trip
+        if self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                self._remember(key, value)
+                self.counters["store_hits"] += 1
+                return value
+
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        self.counters["puts"] += 1
+        if self.store is not None:
+            self.store.put(key, value)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def invalidate(self, prefix=""):
+        """
+        Drops every entry whose key starts with `prefix` (everything by default),
+        in memory and in the persistent tier. Call it when a prompt changes.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+        if self.store is not None:
+            self.store.delete_prefix(prefix)
+
+    def stats(self):
+        hits = self.counters["memory_hits"] + self.counters["store_hits"]
+        total = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "size": len(self._entries),
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,145 @@
+import datetime
+import heapq
+
+# --- SPACED-REPETITION REVISION SCHEDULER ---
+# Turns the self-assessed levels (show_level_audit), the chapter lists and the per-chapter
+# mastery coming out of the diagnostics into a day-by-day revision plan, locally and without
+# any LLM call.
+#
+# Every chapter is a card: its first session is placed by priority (weakest first), then it
+# comes back after growing intervals (SM-2 style, the ease depends on mastery). Days have a
+# fixed number of slots and a per-subject cap so that subjects are interleaved.
+# When one subject's mastery changes, only that subject's sessions are removed and placed
+# again in the free slots; the rest of the plan does not move.
+
+LEVEL_MASTERY = {
+    "Insuffisant": 0.10,
+    "Fragile": 0.25,
+    "Satisfaisant": 0.45,
+    "Bien": 0.60,
+    "Très bien": 0.75,
+    "Excellent": 0.90,
+}
+DEFAULT_SLOTS_PER_DAY = 4
+DEFAULT_MAX_PER_SUBJECT = 2
+REVIEW_GAIN = 0.15          # expected mastery gain of one session, for planning purposes
+
+
+def review_interval(reps, mastery):
+    # Days until the next session: 1, then x ease at each repetition (ease 1.6 .. 3.1)
+    ease = 1.6 + 1.5 * mastery
+    return max(1, round(ease ** reps))
+
+
+class RevisionScheduler:
+    def __init__(self, start_date, exam_date, slots_per_day=DEFAULT_SLOTS_PER_DAY,
+                 max_per_subject=DEFAULT_MAX_PER_SUBJECT):
+        self.start_date = start_date
+        self.exam_date = exam_date
+        self.horizon = max((exam_date - start_date).days, 1)
+        self.slots_per_day = slots_per_day
+        self.max_per_subject = max_per_subject
+        self.days = [[] for _ in range(self.horizon)]     # day -> [(subject, chapter, kind)]
+        self.per_subject = [{} for _ in range(self.horizon)]   # day -> {subject: sessions}
+        self.inputs = {}    # subject -> (chapters tuple, mastery tuple) used for its placement
+
+    # 1. Inputs
+    @staticmethod
+    def subject_mastery(subject, chapters, levels, mastery):
+        # Diagnostic results (per chapter) win over the self-assessed level of the subject
+        base = LEVEL_MASTERY.get(levels.get(subject), LEVEL_MASTERY["Satisfaisant"])
+        return tuple(mastery.get((subject, chapter), base) for chapter in chapters)
+
+    def sync(self, subjects, levels, mastery=None):
+        """
+        subjects: {subject: [chapters]}, levels: {subject: level label},
+        mastery: {(subject, chapter): 0..1} from the diagnostics.
+        Only the subjects whose inputs changed are placed again. Returns their names.
+        """
+        mastery = mastery or {}
+        changed = []
+        for subject in list(self.inputs):
+            if subject not in subjects:
+                self._remove(subject)
+                del self.inputs[subject]
+                changed.append(subject)
+        pending = {}
+        for subject, chapters in subjects.items():
+            chapters = tuple(chapters)
+            key = (chapters, self.subject_mastery(subject, chapters, levels, mastery))
+            if self.inputs.get(subject) != key:
+                self._remove(subject)
+                self.inputs[subject] = key
+                pending[subject] = key
+                changed.append(subject)
+        if pending:
+            self._place(pending)
+        return changed
+
+    # 2. Placement
+    def _remove(self, subject):
+        for day in range(self.horizon):
+            if self.per_subject[day].pop(subject, 0):
+                self.days[day] = [s for s in self.days[day] if s[0] != subject]
+
+    def _place(self, subjects):
+        # Heap of cards: (due day, -priority, seq, subject, chapter, mastery, reps)
+        # Ties are broken round-robin across subjects (chapter 1 of each subject, then chapter 2...)
+        heap = []
+        seq = 0
+        longest = max((len(chapters) for chapters, _ in subjects.values()), default=0)
+        for index in range(longest):
+            for subject, (chapters, masteries) in subjects.items():
+                if index < len(chapters):
+                    heap.append((0, -(1.0 - masteries[index]), seq, subject, chapters[index], masteries[index], 0))
+                    seq += 1
+        heapq.heapify(heap)
+
+        day = 0
+        deferred = []
+        while heap and day < self.horizon:
+            # Everything due today competes for today's free slots, weakest first
+            while heap and heap[0][0] <= day and len(self.days[day]) < self.slots_per_day:
+                card = heapq.heappop(heap)
+                _, neg_priority, _, subject, chapter, m, reps = card
+                if self.per_subject[day].get(subject, 0) >= self.max_per_subject:
+                    deferred.append(card)
+                    continue
+                kind = "apprentissage" if reps == 0 else "rappel"
+                self.days[day].append((subject, chapter, kind))
+                self.per_subject[day][subject] = self.per_subject[day].get(subject, 0) + 1
+
+                next_day = day + review_interval(reps, m)
+                if next_day < self.horizon:
+                    m = min(m + (1.0 - m) * REVIEW_GAIN, 1.0)
+                    heapq.heappush(heap, (next_day, -(1.0 - m), seq, subject, chapter, m, reps + 1))
+                    seq += 1
+            # Cards left in the heap stay due; the ones skipped for the subject cap go back too
+            for card in deferred:
+                heapq.heappush(heap, card)
+            deferred.clear()
+            if heap and heap[0][0] > day + 1:
+                day = heap[0][0]    # skip days where nothing of these subjects is due
+            else:
+                day += 1
+
+    # 3. Output
+    def plan(self, from_day=0, days=None):
+        """
+        [(date, [(subject, chapter, kind), ...]), ...] starting at `from_day`.
+        """
+        end = self.horizon if days is None else min(self.horizon, from_day + days)
+        return [
+            (self.start_date + datetime.timedelta(days=d), list(self.days[d]))
+            for d in range(from_day, end)
+        ]
+
+    def stats(self):
+        sessions = sum(len(d) for d in self.days)
+        return {
+            "days": self.horizon,
+            "subjects": len(self.inputs),
+            "chapters": sum(len(chapters) for chapters, _ in self.inputs.values()),
+            "sessions": sessions,
+            "fill_rate": round(sessions / (self.horizon * self.slots_per_day), 3),
+        }
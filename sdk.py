@@ -0,0 +1,84 @@
+import importlib
+import logging
+import sys
+import threading
+import time
+
+# --- LAZY SDK IMPORTS ---
+# The provider SDKs (and fpdf, numpy) take about two seconds to import on a fresh container, and the
+# landing, signup and onboarding pages use none of them. Modules that need one ask for it with
+# load() on first use instead of importing it at the top. Every first import is timed (and
+# reported to the listeners, e.g. the metrics registry), so the cold-start cost of a pod can
+# be tracked. `python sdk.py` prints the same breakdown for a fresh interpreter.
+
+MODULES = {
+    "httpx": "httpx",
+    "groq": "groq",
+    "supabase": "supabase",
+    "genai": "google.generativeai",
+    "fpdf": "fpdf",
+    "numpy": "numpy",
+}
+
+log = logging.getLogger("khirmintaki.sdk")
+
+_lock = threading.Lock()
+_timings = {}       # name -> {"seconds", "trigger"}
+_listeners = []     # fn(name, seconds, trigger)
+
+
+def is_loaded(name):
+    return MODULES[name] in sys.modules
+
+
+def load(name, trigger="on demand"):
+    """
+    The module behind `name` (see MODULES), imported on the first call.
+    `trigger` says who paid for the import: "on demand" (a page) or "warm-up".
+    """
+    if name in _timings:
+        return sys.modules[MODULES[name]]
+    preloaded = is_loaded(name)
+    started = time.perf_counter()
+    module = importlib.import_module(MODULES[name])
+    seconds = time.perf_counter() - started
+    with _lock:
+        if name in _timings:
+            return module
+        # Imported before the façade was asked (by another SDK or a test): nothing was paid here
+        _timings[name] = {"seconds": round(seconds, 4), "trigger": "preloaded" if preloaded else trigger}
+        listeners = list(_listeners)
+    log.info("imported %s in %.0f ms (%s)", MODULES[name], seconds * 1000, _timings[name]["trigger"])
+    for listener in listeners:
+        try:
+            listener(name, seconds, _timings[name]["trigger"])
+        except Exception:
+            pass
+    return module
+
+
+def on_import(listener):
+    # Imports that already happened are replayed, the registration order does not matter
+    with _lock:
+        _listeners.append(listener)
+        done = dict(_timings)
+    for name, timing in done.items():
+        listener(name, timing["seconds"], timing["trigger"])
+
+
+def import_times():
+    with _lock:
+        return {name: dict(timing) for name, timing in _timings.items()}
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    importlib.import_module("streamlit")
+    rows = [("streamlit", time.perf_counter() - started)]
+    for name in MODULES:
+        t = time.perf_counter()
+        load(name)
+        rows.append((MODULES[name], time.perf_counter() - t))
+    for module, seconds in rows:
+        print(f"{module:<24} {seconds * 1000:8.0f} ms")
+    print(f"{'total':<24} {(time.perf_counter() - started) * 1000:8.0f} ms")
@@ -0,0 +1,320 @@
+import atexit
+import hashlib
+import hmac
+import json
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# --- SHARED SESSION STATE ---
+# The navigation state of a session (page, profile, subject, diagnostic step) is mirrored in a
+# store shared by every replica, keyed by a session id. When the browser reconnects to another
+# replica (load balancer, rollout, crash), the new process finds no st.session_state for it and
+# rebuilds it from the store, so no sticky sessions are needed.
+#
+# The page URL does not carry the bare id but a signed, expiring token (`sid` query parameter,
+# see SessionTokens). The signature also covers the email of the account the token was issued
+# to, at login or signup: a state holding an account is only restored with a token issued to
+# that account, never from an anonymous or forged one. A new id is issued at login, signup and
+# logout, so an id seen before authentication (fixation) or a URL shared while logged in does
+# not lead to the account afterwards.
+#
+# After each run only the keys whose value changed are queued (a fingerprint of the last synced
+# value is kept per session); a background thread coalesces them and writes one batched upsert.
+#
+#   create table session_state (
+#       session_id text not null,
+#       key text not null,
+#       value jsonb,                -- null: the key was removed from the session
+#       updated_at timestamptz not null default now(),
+#       primary key (session_id, key)
+#   );
+#   -- and a daily job: delete from session_state where updated_at < now() - interval '30 days';
+
+SYNCED_KEYS = ("step", "user_data", "selected_subject", "diag_step")
+DEFAULT_FLUSH_INTERVAL = 0.5    # seconds between two batched writes
+DEFAULT_MAX_BATCH = 500         # rows per upsert
+DEFAULT_MAX_SESSIONS = 10_000   # fingerprints kept in memory (a miss only costs a rewrite)
+DEFAULT_RETENTION = 30 * 86400  # seconds before an untouched session is purged (SQLite backend)
+DEFAULT_TOKEN_TTL = 12 * 3600   # seconds a session URL stays valid (renewed while the session is used)
+
+SQLITE_SCHEMA = """
+create table if not exists session_state (
+    session_id text not null,
+    key text not null,
+    value text,
+    updated_at real not null,
+    primary key (session_id, key)
+) without rowid;
+create index if not exists session_state_updated on session_state (updated_at);
+"""
+
+
+def encode(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def fingerprint(encoded):
+    # Compared instead of the values themselves: 16 bytes per key and session
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).digest()
+
+
+class SessionTokens:
+    """
+    `sid` tokens: "<session id>.<expiry>.<signature>", the signature being an HMAC of the id, the
+    expiry and the account email (or "" before login). The secret must be the same on every
+    replica; without one, a random per-process secret is used and sessions do not move across
+    replicas (they start over, like an expired token).
+    """
+
+    def __init__(self, secret=None, ttl=DEFAULT_TOKEN_TTL):
+        self.secret = (secret or secrets.token_hex(32)).encode("utf-8")
+        self.ttl = ttl
+
+    def _sign(self, session_id, expires, email):
+        message = f"{session_id}.{expires}.{email or ''}".encode("utf-8")
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()[:32]
+
+    def issue(self, session_id=None, email=None):
+        # A new session id unless one is given (renewal of a token close to expiry)
+        session_id = session_id or uuid.uuid4().hex
+        expires = int(time.time() + self.ttl)
+        return f"{session_id}.{expires}.{self._sign(session_id, expires, email)}"
+
+    def _parse(self, token):
+        parts = (token or "").split(".")
+        if len(parts) != 3 or not parts[1].isdigit() or int(parts[1]) < time.time():
+            return None
+        return parts[0], int(parts[1]), parts[2]
+
+    def session_id(self, token):
+        # Session id of a well-formed, unexpired token; None otherwise (the session starts over)
+        parsed = self._parse(token)
+        return parsed[0] if parsed else None
+
+    def verify(self, token, email=None):
+        # True when the token was issued to `email` (None: to an anonymous session)
+        parsed = self._parse(token)
+        if parsed is None:
+            return False
+        session_id, expires, signature = parsed
+        return hmac.compare_digest(signature, self._sign(session_id, expires, email))
+
+    def needs_renewal(self, token):
+        # Past half of its lifetime: the app issues a new token for the same session
+        parsed = self._parse(token)
+        return parsed is None or parsed[1] - time.time() < self.ttl / 2
+
+
+class SupabaseSessionBackend:
+    def __init__(self, clients, table="session_state"):
+        # The registry, not a client: the client may be rebuilt after failures
+        self.clients = clients
+        self.table = table
+
+    def fetch(self, session_id):
+        res = self.clients.supabase().table(self.table).select("key,value").eq("session_id", session_id).execute()
+        return {row["key"]: row["value"] for row in res.data or [] if row["value"] is not None}
+
+    def upsert_many(self, rows):
+        payload = [
+            {
+                "session_id": session_id,
+                "key": key,
+                "value": json.loads(value) if value is not None else None,
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(updated_at)),
+            }
+            for session_id, key, value, updated_at in rows
+        ]
+        self.clients.supabase().table(self.table).upsert(payload, on_conflict="session_id,key").execute()
+
+    def purge(self, older_than):
+        # Done by the database job (see the schema above)
+        return 0
+
+
+class SqliteSessionBackend:
+    """
+    Local backend (SESSION_BACKEND = "sqlite"): shared by the processes of one host.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _db(self):
+        # One connection per thread, SQLite connections must not be shared across threads. Opened
+        # on first use: a file that cannot be opened fails the loads and writes (which the app
+        # tolerates), not the construction, and is retried until it can
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("pragma journal_mode = wal")
+            conn.executescript(SQLITE_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def fetch(self, session_id):
+        rows = self._db().execute(
+            "select key, value from session_state where session_id = ? and value is not null", (session_id,)
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def upsert_many(self, rows):
+        db = self._db()
+        db.executemany(
+            "insert or replace into session_state (session_id, key, value, updated_at) values (?, ?, ?, ?)", rows
+        )
+        db.commit()
+
+    def purge(self, older_than):
+        db = self._db()
+        # A session is purged as a whole, once none of its keys was written since `older_than`
+        cur = db.execute(
+            "delete from session_state where session_id in ("
+            "select session_id from session_state group by session_id having max(updated_at) < ?)",
+            (older_than,),
+        )
+        db.commit()
+        return cur.rowcount
+
+
+class SessionStateSync:
+    def __init__(self, backend, keys=SYNCED_KEYS, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_batch=DEFAULT_MAX_BATCH, max_sessions=DEFAULT_MAX_SESSIONS, retention=DEFAULT_RETENTION):
+        self.backend = backend
+        self.keys = keys
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_sessions = max_sessions
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._synced = OrderedDict()    # session id -> {key: fingerprint of the last queued value}
+        self._pending = {}              # (session id, key) -> (encoded value or None, time)
+        self._inflight = {}             # rows being written, still visible to load()
+        self._thread = None
+        self.counters = {"captures": 0, "keys_changed": 0, "coalesced": 0, "writes": 0,
+                         "rows_written": 0, "loads": 0, "errors": 0}
+
+    # 1. Render thread side
+    def load(self, session_id):
+        """
+        Synced keys of a session unknown to this process ({} for a new session).
+        """
+        state = self.backend.fetch(session_id)
+        with self._lock:
+            # Values not written yet are newer than the store
+            for (sid, key), (value, _) in list(self._inflight.items()) + list(self._pending.items()):
+                if sid == session_id:
+                    if value is None:
+                        state.pop(key, None)
+                    else:
+                        state[key] = json.loads(value)
+            self._synced[session_id] = {key: fingerprint(encode(value)) for key, value in state.items()}
+            self._trim()
+            self.counters["loads"] += 1
+        return state
+
+    def capture(self, session_id, state):
+        """
+        Queues the synced keys of `state` whose value changed since the last capture.
+        Only encodes and hashes a few small values: safe to call at the end of every run.
+        """
+        now = time.time()
+        with self._lock:
+            synced = self._synced.get(session_id)
+            if synced is None:
+                synced = self._synced[session_id] = {}
+                self._trim()
+            else:
+                self._synced.move_to_end(session_id)
+            self.counters["captures"] += 1
+            for key in self.keys:
+                value = encode(state[key]) if key in state else None
+                mark = fingerprint(value) if value is not None else None
+                if synced.get(key) == mark:
+                    continue
+                synced[key] = mark
+                if (session_id, key) in self._pending:
+                    self.counters["coalesced"] += 1
+                self._pending[(session_id, key)] = (value, now)
+                self.counters["keys_changed"] += 1
+            if len(self._pending) >= self.max_batch:
+                self._wakeup.set()
+
+    def forget(self, session_id):
+        """
+        Queues the removal of every synced key of a session (logout, or an id replaced at login):
+        the old URL then restores nothing, even on a replica that never saw the session.
+        """
+        now = time.time()
+        with self._lock:
+            self._synced.pop(session_id, None)
+            for key in self.keys:
+                self._pending[(session_id, key)] = (None, now)
+
+    def _trim(self):
+        while len(self._synced) > self.max_sessions:
+            self._synced.popitem(last=False)
+
+    # 2. Background side
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return 0
+            keys = list(self._pending)[:self.max_batch]
+            batch = {key: self._pending.pop(key) for key in keys}
+            self._inflight = batch
+        try:
+            self.backend.upsert_many([(sid, key, value, at) for (sid, key), (value, at) in batch.items()])
+        except Exception:
+            self.counters["errors"] += 1
+            with self._lock:
+                # Re-queue, unless a newer value arrived in the meantime
+                for key, row in batch.items():
+                    self._pending.setdefault(key, row)
+                self._inflight = {}
+            raise
+        with self._lock:
+            self._inflight = {}
+            self.counters["writes"] += 1
+            self.counters["rows_written"] += len(batch)
+        return len(batch)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            last_purge = 0.0
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                try:
+                    while self.flush() >= self.max_batch:
+                        pass
+                    if time.time() - last_purge > 3600:
+                        last_purge = time.time()
+                        self.backend.purge(last_purge - self.retention)
+                except Exception:
+                    time.sleep(self.flush_interval)     # backend down, retry later
+
+        self._thread = threading.Thread(target=loop, name="session-state-flush", daemon=True)
+        self._thread.start()
+        # Graceful shutdown (pod rollout): the sessions continue on another replica
+        atexit.register(self._final_flush)
+
+    def _final_flush(self):
+        try:
+            while self.flush():
+                pass
+        except Exception:
+            pass
+
+    def stats(self):
+        return {**self.counters, "pending": len(self._pending), "sessions": len(self._synced)}
+
@@ -0,0 +1,361 @@
+import atexit
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from array import array
+
+# --- PER-SESSION MEMORY GOVERNANCE ---
+# Every browser tab holds its own st.session_state for as long as Streamlit keeps the session
+# around, abandoned tabs included. To fit more students per replica:
+#   - the chat history is a Transcript: one UTF-8 blob + offset/role arrays instead of a list of
+#     dicts of str, and only its last messages stay in RAM (older turns are spilled to SQLite);
+#   - a background sweeper offloads sessions idle for more than `idle_timeout`: their whole
+#     transcript goes to the spill file and their recomputable caches are dropped;
+#   - sessions that Streamlit has discarded are noticed through a weak reference and their
+#     spilled turns are deleted.
+# The spill file is local to the process (sessions do not outlive it): SESSION_SPILL_PATH only
+# names the directory and prefix, each process gets its own file (<path>-<pid>.db).
+
+DEFAULT_MAX_IN_MEMORY = 24      # messages of a transcript kept in RAM (a 10-question diagnostic is 22)
+DEFAULT_IDLE_TIMEOUT = 600      # seconds without a rerun before a session is offloaded
+SWEEP_INTERVAL = 30             # seconds between two sweeps
+MEASURE_INTERVAL = 30           # seconds between two size estimates of the same session
+
+ROLES = ("user", "assistant", "system")
+
+SCHEMA = """
+create table if not exists spilled_messages (
+    session_id text not null,
+    idx integer not null,
+    role integer not null,
+    content blob not null,
+    primary key (session_id, idx)
+) without rowid;
+"""
+
+
+def deep_size(value, depth=0):
+    """
+    Rough size in bytes of a session_state value (containers, strings, plain objects).
+    Objects exposing `nbytes` (Transcript) report their own size.
+    """
+    if hasattr(value, "nbytes") and not isinstance(value, type):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if depth > 6:
+        return size
+    if isinstance(value, dict):
+        size += sum(deep_size(k, depth + 1) + deep_size(v, depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, depth + 1) for v in value)
+    elif hasattr(value, "__dict__") and not isinstance(value, type):
+        size += deep_size(vars(value), depth + 1)
+    return size
+
+
+class SpillStore:
+    """
+    Older transcript turns, keyed by session id and message index.
+    """
+
+    def __init__(self, db_path=None):
+        # One file per process: another process sharing the path keeps its own spills
+        root, ext = os.path.splitext(db_path or os.path.join(tempfile.gettempdir(), "khirmintaki-sessions.db"))
+        self.db_path = f"{root}-{os.getpid()}{ext or '.db'}"
+        atexit.register(self._remove_files)
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(SCHEMA)
+        # Whatever is left belongs to a previous process that had the same pid
+        db.execute("delete from spilled_messages")
+        db.commit()
+
+    def _db(self):
+        # One connection per thread (render threads write, the sweeper offloads)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("pragma journal_mode = wal")
+            conn.execute("pragma synchronous = off")    # a spill file is not worth an fsync
+            self._local.conn = conn
+        return conn
+
+    def put(self, session_id, start, rows):
+        db = self._db()
+        db.executemany(
+            "insert or replace into spilled_messages (session_id, idx, role, content) values (?, ?, ?, ?)",
+            [(session_id, start + i, role, content) for i, (role, content) in enumerate(rows)],
+        )
+        db.commit()
+
+    def get(self, session_id, start, stop):
+        return self._db().execute(
+            "select role, content from spilled_messages where session_id = ? and idx >= ? and idx < ? order by idx",
+            (session_id, start, stop),
+        ).fetchall()
+
+    def drop(self, session_id):
+        db = self._db()
+        db.execute("delete from spilled_messages where session_id = ?", (session_id,))
+        db.commit()
+
+    def count(self):
+        return self._db().execute("select count(*) from spilled_messages").fetchone()[0]
+
+    def _remove_files(self):
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.db_path + suffix)
+            except OSError:
+                pass
+
+
+class Transcript:
+    """
+    List-like chat history (append, len, iteration, indexing and slicing give
+    {"role", "content"} dicts). Messages [0, spilled) live in the SpillStore and
+    are read back on demand; the others are in `_blob`, delimited by `_ends`.
+    """
+
+    def __init__(self, session_id, spill=None, max_in_memory=DEFAULT_MAX_IN_MEMORY, messages=()):
+        self.session_id = session_id
+        self.spill = spill
+        self.max_in_memory = max_in_memory
+        self.spilled = 0
+        self._roles = array("B")
+        self._ends = array("I")
+        self._blob = bytearray()
+        self._lock = threading.RLock()
+        for m in messages:
+            self.append(m)
+
+    # 1. List interface
+    def __len__(self):
+        return self.spilled + len(self._roles)
+
+    def append(self, message):
+        data = message["content"].encode("utf-8")
+        with self._lock:
+            self._blob += data
+            self._ends.append(len(self._blob))
+            self._roles.append(ROLES.index(message["role"]))
+            if self.spill is not None and len(self._roles) > self.max_in_memory:
+                self._spill_oldest(len(self._roles) - self.max_in_memory)
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                start, stop, step = index.indices(len(self))
+                if step != 1:
+                    return self.to_list()[index]
+                return self._range(start, max(stop, start))
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("transcript index out of range")
+            return self._range(index, index + 1)[0]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def to_list(self):
+        return self[0:len(self)]
+
+    def recent(self):
+        # Messages still in RAM (what the chat shows without loading older turns)
+        with self._lock:
+            return self._range(self.spilled, len(self))
+
+    @property
+    def in_memory(self):
+        return len(self._roles)
+
+    @property
+    def nbytes(self):
+        return (
+            len(self._blob)
+            + self._roles.itemsize * len(self._roles)
+            + self._ends.itemsize * len(self._ends)
+        )
+
+    # 2. Storage
+    def _local(self, i):
+        start = self._ends[i - 1] if i else 0
+        return {"role": ROLES[self._roles[i]], "content": self._blob[start:self._ends[i]].decode("utf-8")}
+
+    def _range(self, start, stop):
+        messages = []
+        if start < self.spilled:
+            rows = self.spill.get(self.session_id, start, min(stop, self.spilled))
+            messages += [{"role": ROLES[role], "content": content.decode("utf-8")} for role, content in rows]
+        for i in range(max(start, self.spilled), stop):
+            messages.append(self._local(i - self.spilled))
+        return messages
+
+    def _spill_oldest(self, n):
+        rows = []
+        for i in range(n):
+            start = self._ends[i - 1] if i else 0
+            rows.append((self._roles[i], bytes(self._blob[start:self._ends[i]])))
+        self.spill.put(self.session_id, self.spilled, rows)
+        cut = self._ends[n - 1]
+        self._blob = self._blob[cut:]
+        self._ends = array("I", (end - cut for end in self._ends[n:]))
+        self._roles = self._roles[n:]
+        self.spilled += n
+
+    def offload(self):
+        # Idle session: everything goes to the spill file
+        with self._lock:
+            if self.spill is not None and self._roles:
+                self._spill_oldest(len(self._roles))
+
+    def reload(self):
+        # Back from idle: the last messages are read back into RAM
+        with self._lock:
+            if self.spill is None or self._roles or not self.spilled:
+                return
+            start = max(self.spilled - self.max_in_memory, 0)
+            for role, content in self.spill.get(self.session_id, start, self.spilled):
+                self._blob += content
+                self._ends.append(len(self._blob))
+                self._roles.append(role)
+            self.spilled = start
+
+
+class SessionHandle:
+    """
+    Stored in st.session_state. Identifies the session to SessionMemory and owns
+    its current transcript and its recomputable caches (dropped when idle).
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.transcript = None
+        self.cache = {}
+
+
+class SessionMemory:
+    def __init__(self, spill=None, max_in_memory=DEFAULT_MAX_IN_MEMORY, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.spill = spill
+        self.max_in_memory = max_in_memory
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._sessions = {}     # session id -> {"ref", "seen", "bytes", "measured", "offloaded"}
+        self._thread = None
+        self.counters = {"sessions": 0, "offloaded": 0, "restored": 0, "expired": 0}
+
+    # 1. Render thread side
+    def attach(self):
+        handle = SessionHandle()
+        with self._lock:
+            self._sessions[handle.id] = {
+                "ref": weakref.ref(handle), "seen": time.time(), "bytes": 0, "measured": 0.0, "offloaded": False,
+            }
+            self.counters["sessions"] += 1
+        return handle
+
+    def new_transcript(self, handle, messages=()):
+        """
+        Replaces the session's transcript (new diagnostic or restored checkpoint).
+        """
+        if handle.transcript is not None and self.spill is not None:
+            self.spill.drop(handle.id)
+        handle.transcript = Transcript(handle.id, self.spill, self.max_in_memory, messages)
+        return handle.transcript
+
+    def touch(self, handle, state):
+        """
+        Called on every rerun. `state` is the session_state mapping; its size is
+        re-estimated at most every MEASURE_INTERVAL seconds.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(handle.id)
+            if entry is None:
+                return
+            entry["seen"] = now
+            restore = entry["offloaded"]
+            entry["offloaded"] = False
+            measure = now - entry["measured"] >= MEASURE_INTERVAL
+            if measure:
+                entry["measured"] = now
+        if restore:
+            if handle.transcript is not None:
+                handle.transcript.reload()
+            self.counters["restored"] += 1
+        if measure:
+            size = sum(deep_size(value) for key, value in state.items() if not isinstance(value, SessionHandle))
+            size += sum(deep_size(value) for value in handle.cache.values())
+            with self._lock:
+                entry["bytes"] = size
+
+    # 2. Background side
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            entries = list(self._sessions.items())
+        for session_id, entry in entries:
+            handle = entry["ref"]()
+            if handle is None:
+                # Streamlit discarded the session
+                with self._lock:
+                    self._sessions.pop(session_id, None)
+                if self.spill is not None:
+                    self.spill.drop(session_id)
+                self.counters["expired"] += 1
+            elif not entry["offloaded"] and now - entry["seen"] > self.idle_timeout:
+                if handle.transcript is not None:
+                    handle.transcript.offload()
+                handle.cache.clear()
+                entry["offloaded"] = True
+                entry["bytes"] = 0
+                entry["measured"] = 0.0
+                self.counters["offloaded"] += 1
+
+    def start(self, interval=SWEEP_INTERVAL):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception:
+                    pass    # spill file unavailable: retry at the next sweep
+
+        self._thread = threading.Thread(target=loop, name="session-sweeper", daemon=True)
+        self._thread.start()
+
+    # 3. Stats
+    def session_stats(self, handle):
+        transcript = handle.transcript
+        with self._lock:
+            entry = self._sessions.get(handle.id, {})
+            state_bytes = entry.get("bytes", 0)
+            idle = time.time() - entry.get("seen", time.time())
+        return {
+            "messages": len(transcript) if transcript is not None else 0,
+            "messages_in_memory": transcript.in_memory if transcript is not None else 0,
+            "messages_spilled": transcript.spilled if transcript is not None else 0,
+            "transcript_bytes": transcript.nbytes if transcript is not None else 0,
+            "state_bytes": state_bytes,
+            "cached_objects": len(handle.cache),
+            "idle_seconds": round(idle, 1),
+        }
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._sessions.values())
+        return {
+            **self.counters,
+            "active": sum(1 for e in entries if not e["offloaded"]),
+            "idle_offloaded": sum(1 for e in entries if e["offloaded"]),
+            "state_bytes": sum(e["bytes"] for e in entries),
+        }
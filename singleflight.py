@@ -0,0 +1,105 @@
+import hashlib
+import json
+import threading
+
+# --- SINGLE-FLIGHT LLM REQUESTS ---
+# When a teacher sends a whole class to the same chapter, dozens of sessions send the very
+# same prompt within seconds. Identical requests that overlap in time share one upstream call:
+# the first one (the leader) starts it on a background thread, every session (leader included)
+# reads the chunks from a shared buffer, and late joiners get the chunks already produced
+# first. Once the call is over the key is free again (repeat questions are the job of the
+# response cache, not of this module).
+
+
+def request_key(messages, model, max_tokens=None):
+    # Whitespace is normalised: prompts built by different sessions differ in spacing only
+    normalised = [[m["role"], " ".join(m["content"].split())] for m in messages]
+    raw = json.dumps([model, max_tokens, normalised], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.readers = 0        # sessions reading it, guarded by SingleFlight._lock
+        self.abandoned = False
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}      # key -> Flight in progress
+        self.counters = {"calls": 0, "coalesced": 0, "abandoned": 0, "errors": 0}
+
+    def stream(self, key, start):
+        """
+        Yields the chunks of `start()` (an iterator of text chunks), shared with every
+        concurrent caller of the same key.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight()
+                self.counters["calls"] += 1
+                leader = True
+            else:
+                self.counters["coalesced"] += 1
+                leader = False
+            flight.readers += 1
+        if leader:
+            thread = threading.Thread(target=self._produce, args=(key, flight, start),
+                                      name="llm-single-flight", daemon=True)
+            thread.start()
+        return self._read(flight)
+
+    def _produce(self, key, flight, start):
+        upstream = start()
+        try:
+            for chunk in upstream:
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+                with self._lock:
+                    if flight.readers == 0:
+                        # Every session left (page closed...): stop paying for tokens nobody reads
+                        flight.abandoned = True
+                        self._flights.pop(key, None)
+                        self.counters["abandoned"] += 1
+                        break
+        except Exception as e:
+            flight.error = e
+            self.counters["errors"] += 1
+        finally:
+            upstream.close()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _read(self, flight):
+        index = 0
+        try:
+            while True:
+                with flight.cond:
+                    while index >= len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    if index < len(flight.chunks):
+                        chunk = flight.chunks[index]
+                        index += 1
+                    elif flight.error is not None:
+                        raise flight.error
+                    else:
+                        return
+                yield chunk
+        finally:
+            with self._lock:
+                flight.readers -= 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "in_flight": len(self._flights)}
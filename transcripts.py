@@ -0,0 +1,173 @@
+import atexit
+import threading
+import time
+
+# --- DIAGNOSTIC CHECKPOINTS (WRITE-BEHIND) ---
+# The diagnostic conversation is checkpointed after every turn so that a websocket drop or a
+# pod restart does not lose the LLM turns already paid for. The render thread only drops the
+# snapshot in a queue; a background thread coalesces snapshots (latest per user and subject
+# wins) and writes them as one batched upsert.
+#
+#   create table diagnostic_checkpoints (
+#       email text not null,
+#       subject text not null,
+#       chapter text,
+#       diag_step text not null,
+#       q_count integer not null default 0,
+#       messages jsonb not null default '[]'::jsonb,
+#       context jsonb,
+#       updated_at timestamptz not null default now(),
+#       primary key (email, subject)
+#   );
+
+DEFAULT_FLUSH_INTERVAL = 1.0    # seconds between two batched writes
+DEFAULT_MAX_BATCH = 200         # rows per upsert
+
+
+class SupabaseTranscriptBackend:
+    def __init__(self, clients, table="diagnostic_checkpoints"):
+        # The registry, not a client: the client may be rebuilt after failures
+        self.clients = clients
+        self.table = table
+
+    def fetch(self, email, subject):
+        res = (self.clients.supabase().table(self.table).select("*")
+               .eq("email", email).eq("subject", subject).limit(1).execute())
+        return res.data[0] if res.data else None
+
+    def fetch_user(self, email):
+        res = self.clients.supabase().table(self.table).select("*").eq("email", email).execute()
+        return res.data or []
+
+    def upsert_many(self, rows):
+        self.clients.supabase().table(self.table).upsert(rows, on_conflict="email,subject").execute()
+
+
+class MemoryTranscriptBackend:
+    """
+    Process-local backend for development and tests (TRANSCRIPTS_BACKEND = "memory").
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, email, subject):
+        with self._lock:
+            row = self._rows.get((email, subject))
+            return dict(row) if row else None
+
+    def fetch_user(self, email):
+        with self._lock:
+            return [dict(row) for (e, _), row in self._rows.items() if e == email]
+
+    def upsert_many(self, rows):
+        with self._lock:
+            for row in rows:
+                self._rows[(row["email"], row["subject"])] = dict(row)
+
+
+class TranscriptWriter:
+    def __init__(self, backend, flush_interval=DEFAULT_FLUSH_INTERVAL, max_batch=DEFAULT_MAX_BATCH):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}      # (email, subject) -> row, only the latest snapshot is kept
+        self._inflight = {}     # rows being written, still visible to load()
+        self._thread = None
+        self.counters = {"checkpoints": 0, "coalesced": 0, "writes": 0, "rows_written": 0, "errors": 0}
+
+    # 1. Render thread side: never blocks on the network
+    def checkpoint(self, email, subject, chapter, diag_step, q_count, messages, context=None):
+        row = {
+            "email": email,
+            "subject": subject,
+            "chapter": chapter,
+            "diag_step": diag_step,
+            "q_count": q_count,
+            # Copies: the session keeps mutating its own lists
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+            "context": context,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        with self._lock:
+            if (email, subject) in self._pending:
+                self.counters["coalesced"] += 1
+            self._pending[(email, subject)] = row
+            self.counters["checkpoints"] += 1
+            if len(self._pending) >= self.max_batch:
+                self._wakeup.set()
+
+    def load(self, email, subject):
+        # Snapshots not written yet are newer than the database
+        with self._lock:
+            row = self._pending.get((email, subject)) or self._inflight.get((email, subject))
+        if row is not None:
+            return row
+        return self.backend.fetch(email, subject)
+
+    def in_progress(self, email):
+        """
+        subject -> checkpoint of every diagnostic the user started and did not finish.
+        """
+        rows = {row["subject"]: row for row in self.backend.fetch_user(email)}
+        with self._lock:
+            for (e, subject), row in list(self._inflight.items()) + list(self._pending.items()):
+                if e == email:
+                    rows[subject] = row
+        return {subject: row for subject, row in rows.items() if row["diag_step"] == "questioning"}
+
+    # 2. Background side
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return 0
+            keys = list(self._pending)[:self.max_batch]
+            batch = {key: self._pending.pop(key) for key in keys}
+            self._inflight = batch
+        try:
+            self.backend.upsert_many(list(batch.values()))
+        except Exception:
+            self.counters["errors"] += 1
+            with self._lock:
+                # Re-queue, unless a newer snapshot arrived in the meantime
+                for key, row in batch.items():
+                    self._pending.setdefault(key, row)
+                self._inflight = {}
+            raise
+        with self._lock:
+            self._inflight = {}
+            self.counters["writes"] += 1
+            self.counters["rows_written"] += len(batch)
+        return len(batch)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                try:
+                    while self.flush() >= self.max_batch:
+                        pass
+                except Exception:
+                    time.sleep(self.flush_interval)     # backend down, retry later
+
+        self._thread = threading.Thread(target=loop, name="transcripts-flush", daemon=True)
+        self._thread.start()
+        # Graceful shutdown (pod rollout): write what is still queued
+        atexit.register(self._final_flush)
+
+    def _final_flush(self):
+        try:
+            while self.flush():
+                pass
+        except Exception:
+            pass
+
+    def stats(self):
+        return {**self.counters, "pending": len(self._pending)}